@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module calculates the aperture photometry of the stars of an image
+without using iraf.
+
+The photometry of all the stars of the catalog of an image is calculated at
+once following the steps of iraf phot:
+
+1. The center of each star is calculated as the centroid of the marginal
+distributions in a box around its position in the catalog.
+2. The sky is estimated from the pixels of an annulus around the center,
+rejecting iteratively the pixels far from the median.
+3. The flux in the aperture is the sum of the pixels weighted by the fraction
+of each pixel inside the aperture, minus the sky.
+4. The magnitudes and their errors are calculated as iraf phot does.
+
+The sky and all the apertures of the parameters are measured from the same
+cutouts. Optionally, the magnitudes of all the apertures are corrected to
+the largest one with a curve of growth calculated from the brightest stars.
+
+The results are written directly to the file of photometry of the image,
+with the magnitudes of the additional apertures after those of the first one.
+
+"""
+
+import logging
+import numpy as np
+import pyfits
+import imgstats
+import photfile
+from fitfiles import read_header
+from fwhmest import read_catalog_positions
+from constants import *
+
+# Zero point of the magnitudes, the default of iraf phot.
+ZMAG = 25.0
+
+# Algorithms to calculate the sky.
+SKY_MEAN = "mean"
+SKY_MEDIAN = "median"
+SKY_MODE = "mode"
+
+SKY_ALGORITHMS = [ SKY_MEAN, SKY_MEDIAN, SKY_MODE ]
+
+# Rejection of the sky pixels.
+SKY_NUM_SIGMAS = 3.0
+SKY_MAX_ITERATIONS = 10
+
+# Keywords of the header used in the photometry.
+EXPOSURE_KEYWORD = "EXPOSURE"
+AIRMASS_KEYWORD = "AIRMASS"
+OBSTIME_KEYWORD = "MJD"
+
+# Maximum error of the magnitude of the largest aperture of a star and
+# minimum number of stars to calculate the curve of growth.
+COG_MAX_ERROR = 0.05
+COG_MIN_STARS = 3
+
+# Conversion of relative flux errors to magnitude errors.
+MAG_ERROR_FACTOR = 2.5 / np.log(10.0)
+
+class AperturePhotometryException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+
+        return self._msg
+
+def calculate_datamin(stats, phot_params):
+    """Calculates a datamin value for an image from the mean and the standard
+    deviation of its data.
+
+    Args:
+        stats: The statistics of the image.
+        phot_params: Parameters for phot.
+
+    Returns:
+        The datamin value, not lower than that of the parameters.
+
+    """
+
+    datamin = stats[imgstats.STAT_MEAN] - \
+        phot_params.datamin_mult * stats[imgstats.STAT_STDDEV]
+
+    return max(datamin, phot_params.datamin)
+
+def get_cutouts(data, rows, cols, half_size):
+    """Returns the cutouts of the data centered on the pixels received.
+
+    The pixels of the cutouts out of the image are NaN.
+
+    Args:
+        data: The data of the image.
+        rows: Rows of the centers of the cutouts.
+        cols: Columns of the centers of the cutouts.
+        half_size: Half size of the cutouts.
+
+    Returns:
+        An array with a cutout for each center and the offsets of the rows and
+        columns of the cutouts from their centers.
+
+    """
+
+    padded = np.empty((data.shape[0] + 2 * half_size, 
+                       data.shape[1] + 2 * half_size),
+                      dtype=np.promote_types(data.dtype, np.float32))
+    padded.fill(np.nan)
+
+    padded[half_size:half_size + data.shape[0],
+           half_size:half_size + data.shape[1]] = data
+
+    offsets = np.arange(-half_size, half_size + 1)
+
+    # Out of the image the centers are placed in the padding.
+    rows = np.clip(rows, -half_size, data.shape[0] + half_size - 1)
+    cols = np.clip(cols, -half_size, data.shape[1] + half_size - 1)
+
+    cutouts = padded[rows[:, np.newaxis, np.newaxis] + half_size +
+                     offsets[np.newaxis, :, np.newaxis],
+                     cols[:, np.newaxis, np.newaxis] + half_size +
+                     offsets[np.newaxis, np.newaxis, :]]
+
+    return cutouts, offsets
+
+def calculate_centers(data, x, y, cbox):
+    """Calculates the centers of the stars as the centroid of the marginal
+    distributions of a box around their positions.
+
+    As iraf does, the mean of each marginal is subtracted and only the
+    positive values are used.
+
+    Args:
+        data: The data of the image.
+        x: X coordinates of the stars, the first pixel is 0.
+        y: Y coordinates of the stars, the first pixel is 0.
+        cbox: Width in pixels of the box.
+
+    Returns:
+        The x and y coordinates of the centers.
+
+    """
+
+    rows = np.round(y).astype(int)
+    cols = np.round(x).astype(int)
+
+    boxes, offsets = get_cutouts(data, rows, cols, max(1, int(cbox) // 2))
+
+    boxes = np.where(np.isfinite(boxes), boxes, 0.0)
+
+    centers = []
+
+    # First the marginal of the columns, then the marginal of the rows.
+    for axis, origin in [(1, cols), (2, rows)]:
+        marginal = boxes.sum(axis=axis)
+
+        marginal = np.maximum(marginal - 
+                              marginal.mean(axis=1)[:, np.newaxis], 0)
+
+        total = marginal.sum(axis=1)
+
+        shift = np.zeros(len(total))
+
+        valid = total > 0
+
+        shift[valid] = (marginal[valid] * offsets).sum(axis=1) / total[valid]
+
+        centers.append(origin + shift)
+
+    return centers[0], centers[1]
+
+def calculate_sky(values, valid, salgorithm):
+    """Calculates the sky of each star from the values of its annulus.
+
+    The values far from the median are rejected iteratively.
+
+    Args:
+        values: The values of the annulus of each star, one row by star.
+        valid: The values of the annulus that could be used.
+        salgorithm: The algorithm to calculate the sky.
+
+    Returns:
+        The sky, its standard deviation and the number of values used for
+        each star.
+
+    """
+
+    sky_values = np.ma.array(values, mask=~valid)
+
+    for i in range(SKY_MAX_ITERATIONS):
+        median = np.ma.median(sky_values, axis=1)
+        stddev = sky_values.std(axis=1)
+
+        rejected = np.abs(sky_values - median[:, np.newaxis]) > \
+            SKY_NUM_SIGMAS * stddev[:, np.newaxis]
+
+        new_rejected = rejected.filled(False) & ~np.ma.getmaskarray(sky_values)
+
+        if not new_rejected.any():
+            break
+
+        sky_values.mask = np.ma.getmaskarray(sky_values) | new_rejected
+
+    mean = sky_values.mean(axis=1)
+    median = np.ma.median(sky_values, axis=1)
+
+    if salgorithm == SKY_MEAN:
+        sky = mean
+    elif salgorithm == SKY_MEDIAN:
+        sky = median
+    else:
+        # As iraf does, the mean is used when it is lower than the median.
+        sky = np.ma.where(mean < median, mean, 3.0 * median - 2.0 * mean)
+
+    nsky = sky_values.count(axis=1)
+
+    return np.ma.filled(sky, np.nan), \
+        np.ma.filled(sky_values.std(axis=1), np.nan), nsky
+
+def calculate_photometry(data, x, y, fwhm, phot_params, datamin, itime):
+    """Calculates the aperture photometry of the stars received for all the
+    apertures of the parameters.
+
+    Args:
+        data: The data of the image.
+        x: X coordinates of the stars, the first pixel is 1.
+        y: Y coordinates of the stars, the first pixel is 1.
+        fwhm: The FWHM of the image.
+        phot_params: Parameters for phot.
+        datamin: Minimum value of a good pixel.
+        itime: Exposure time of the image.
+
+    Returns:
+        The x and y coordinates of the centers, the first pixel is 1, and the
+        magnitudes and their errors with a column for each aperture, NaN for
+        the magnitudes that cannot be calculated.
+
+    """
+
+    apertures = [fwhm * a for a in phot_params.apertures]
+
+    n = len(x)
+
+    if n == 0:
+        return np.array([]), np.array([]), np.empty((0, len(apertures))), \
+            np.empty((0, len(apertures)))
+
+    xc, yc = calculate_centers(data, np.asarray(x) - 1.0,
+                               np.asarray(y) - 1.0, phot_params.cbox)
+
+    annulus = fwhm * phot_params.annulus_mult
+    outer_radius = annulus + phot_params.dannulus
+
+    rows = np.round(yc).astype(int)
+    cols = np.round(xc).astype(int)
+
+    # The same cutouts are used for the sky and all the apertures.
+    cutouts, offsets = get_cutouts(data, rows, cols,
+                                   int(np.ceil(max([outer_radius] +
+                                                   apertures))) + 1)
+
+    distances = np.hypot(offsets[np.newaxis, :, np.newaxis] -
+                         (yc - rows)[:, np.newaxis, np.newaxis],
+                         offsets[np.newaxis, np.newaxis, :] -
+                         (xc - cols)[:, np.newaxis, np.newaxis])
+
+    cutouts = cutouts.reshape(n, -1)
+    distances = distances.reshape(n, -1)
+
+    with np.errstate(invalid="ignore"):
+        good = np.isfinite(cutouts) & (cutouts >= datamin) & \
+            (cutouts <= phot_params.datamax)
+
+    in_annulus = (distances >= annulus) & (distances <= outer_radius)
+
+    sky, sky_stddev, nsky = calculate_sky(cutouts, in_annulus & good,
+                                          phot_params.salgorithm)
+
+    good_values = np.where(good, cutouts, 0.0)
+
+    mag = np.empty((n, len(apertures)))
+    mag.fill(np.nan)
+
+    merr = np.empty((n, len(apertures)))
+    merr.fill(np.nan)
+
+    for i, aperture in enumerate(apertures):
+        # Fraction of each pixel inside the aperture, as iraf calculates it.
+        fraction = np.clip(aperture + 0.5 - distances, 0.0, 1.0)
+
+        bad_pixels = ((fraction > 0) & ~good).any(axis=1)
+
+        area = fraction.sum(axis=1)
+
+        flux = (fraction * good_values).sum(axis=1) - area * sky
+
+        valid = (flux > 0) & ~bad_pixels & (nsky > 0)
+
+        mag[valid, i] = ZMAG - 2.5 * np.log10(flux[valid]) + \
+            2.5 * np.log10(itime)
+
+        # Error of the magnitude as calculated by iraf phot.
+        variance = flux[valid] / phot_params.epadu + \
+            area[valid] * sky_stddev[valid] ** 2 + \
+            area[valid] ** 2 * sky_stddev[valid] ** 2 / nsky[valid]
+
+        merr[valid, i] = MAG_ERROR_FACTOR * np.sqrt(variance) / flux[valid]
+
+    return xc + 1.0, yc + 1.0, mag, merr
+
+def apply_curve_of_growth(apertures, mag, merr):
+    """Corrects the magnitudes of each aperture to the largest aperture.
+
+    The correction of an aperture is the median of the differences between
+    the magnitudes of the largest aperture and those of the aperture, using
+    only the stars with low errors.
+
+    Args:
+        apertures: The apertures.
+        mag: Magnitudes with a column for each aperture, they are corrected.
+        merr: Errors of the magnitudes.
+
+    """
+
+    largest = int(np.argmax(apertures))
+
+    with np.errstate(invalid="ignore"):
+        bright = np.isfinite(mag[:, largest]) & \
+            (merr[:, largest] < COG_MAX_ERROR)
+
+    for i in range(len(apertures)):
+        if i != largest:
+            used = bright & np.isfinite(mag[:, i])
+
+            if np.sum(used) >= COG_MIN_STARS:
+                correction = np.median(mag[used, largest] - mag[used, i])
+
+                mag[:, i] += correction
+
+                logging.debug("Curve of growth correction for aperture %g: %.4f" %
+                              (apertures[i], correction))
+            else:
+                logging.debug("Not enough stars to correct aperture %g." %
+                              (apertures[i]))
+
+def get_header_number(header, keyword):
+    """Returns the numeric value of a keyword of a header.
+
+    Args:
+        header: The header.
+        keyword: The keyword.
+
+    Returns:
+        The value of the keyword, or None if it is not a number.
+
+    """
+
+    value = None
+
+    try:
+        value = float(header[keyword])
+    except (KeyError, TypeError, ValueError):
+        logging.debug("Keyword %s not found or not a number." % (keyword))
+
+    return value
+
+def do_aperture_photometry(image_file_name, catalog_file_name, mag_file_name,
+                           fwhm, phot_params, stats=None):
+    """Calculates the photometry of the stars of the catalog of an image and
+    writes it to the file of photometry.
+
+    Args:
+        image_file_name: Name of the file with the image.
+        catalog_file_name: File with the X, Y coordinates of the stars.
+        mag_file_name: Name of the output file with the photometry.
+        fwhm: The FWHM of the image.
+        phot_params: Parameters for phot.
+        stats: The statistics of the image, calculated if not received.
+
+    Raises:
+        AperturePhotometryException if the photometry cannot be calculated.
+
+    """
+
+    logging.debug("Calculating magnitudes for: %s in %s" %
+                  (image_file_name, mag_file_name))
+
+    if not phot_params.salgorithm in SKY_ALGORITHMS:
+        raise AperturePhotometryException("Sky algorithm not supported: %s" %
+                                          (phot_params.salgorithm))
+
+    try:
+        x, y = read_catalog_positions(catalog_file_name)
+
+        data = pyfits.getdata(image_file_name).astype(np.float64)
+
+        header = read_header(image_file_name)
+
+        itime = get_header_number(header, EXPOSURE_KEYWORD)
+
+        if itime is None or itime <= 0:
+            itime = 1.0
+
+        if stats is None or not imgstats.STAT_MEAN in stats:
+            stats = imgstats.calculate_statistics(data)
+
+        xc, yc, mag, merr = \
+            calculate_photometry(data, x, y, fwhm, phot_params,
+                                 calculate_datamin(stats, phot_params), itime)
+
+        if phot_params.curve_of_growth:
+            apply_curve_of_growth(phot_params.apertures, mag, merr)
+
+        phot_data = photfile.create_phot_data(xc, yc,
+            get_header_number(header, OBSTIME_KEYWORD), mag,
+            get_header_number(header, AIRMASS_KEYWORD), merr)
+
+        photfile.write_phot_file(mag_file_name, phot_data)
+
+    except IOError as ioe:
+        raise AperturePhotometryException("Error in photometry of %s: %s" %
+                                          (image_file_name, ioe))
+
+    except (IndexError, ValueError) as e:
+        raise AperturePhotometryException("Invalid catalog %s: %s" %
+                                          (catalog_file_name, e))
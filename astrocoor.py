@@ -22,94 +22,109 @@
 """
 
 import logging
+import numpy as np
+from scipy.spatial import cKDTree
 import starsset
-from fitfiles import get_fit_fields
+from fitfiles import read_header
 from constants import *
 
-# Error margin when assigning astrometry coordinates.
-ASTROMETRY_COORD_RANGE = 0.08    
+# Maximum angular distance in degrees when assigning astrometry coordinates.
+ASTROMETRY_MATCH_RADIUS = 0.02
 XY_PERCENT_DEV_FROM_CENTER = 0.7
 
 # Columns in celestial coordinates table.
 RD_DATA_RA_COL = 0
 RD_DATA_DEC_COL = 1
 
-CRPIX1 = "CRPIX1"
-CRPIX2 = "CRPIX2"
+IMAGEW = "IMAGEW"
+IMAGEH = "IMAGEH"
 
-XY_CENTER_FIT_HEADER_FIELDS = [CRPIX1, CRPIX2]
+class CelestialIndex(object):
+    """Spatial index of a set of RA, DEC coordinates to search the nearest 
+    to other coordinates.
+    
+    The coordinates are converted to unit vectors and stored in a KD-tree, so
+    the distance used is the angular distance, valid at any RA and DEC.
+    
+    """
+    
+    def __init__(self, rd_data):
+        """Constructor.
+        
+        Args:
+            rd_data: The columns of ra and dec values.
+            
+        """
+        
+        self._tree = None
+        
+        if rd_data is not None and len(rd_data[RD_DATA_RA_COL]) > 0:
+            self._tree = cKDTree(get_unit_vectors(rd_data[RD_DATA_RA_COL],
+                                                  rd_data[RD_DATA_DEC_COL]))
+            
+    def query(self, ra, dec):
+        """Returns the indexes of the coordinates nearest to each pair of 
+        RA, DEC values received, if they are closer than the matching radius.
+        
+        Args:
+            ra: List of RA values to search.
+            dec: List of DEC values to search.
+            
+        Returns:
+            An array with the index of the nearest coordinates for each pair
+            of values, -1 for those without coordinates closer than the radius.
+        
+        """
+        
+        indexes = np.empty(len(ra), dtype=int)
+        indexes.fill(-1)
+        
+        if self._tree is not None and len(ra) > 0:
+            distances, nearest = self._tree.query(get_unit_vectors(ra, dec))
+            
+            # The distance between unit vectors is the chord of the angle.
+            max_chord = 2.0 * np.sin(np.radians(ASTROMETRY_MATCH_RADIUS) / 2.0)
+            
+            matched = distances <= max_chord
+            
+            indexes[matched] = nearest[matched]
+            
+            for i in np.nonzero(~matched)[0]:
+                logging.debug("No match for coordinates %.10g %.10g, min. distance is: %.10g deg." %
+                              (ra[i], dec[i], 
+                               np.degrees(2.0 * np.arcsin(distances[i] / 2.0))))
+            
+        return indexes
 
-def get_rd_index(rd_data, ra, dec): 
-    """ Get the index of the RA, DEC pair whose values are more close to 
-    those received.
+def get_unit_vectors(ra, dec):
+    """Returns the unit vectors of the RA, DEC coordinates received.
     
     Args:
-        rd_data: List of ra, dec values. The closest pair of this list to the
-        ra,dec values are returned.
-        ra: RA value to search.
-        dec: DEC value to search.
-    
-    Returns:
-        A pair RA,DEC of the list received with the nearest values to those
-        RA, DEC parameters received.
+        ra: Array of RA values in degrees.
+        dec: Array of DEC values in degrees.
         
+    Returns:
+        An array with a unit vector in each row.
+    
     """
     
-    # Default values for the data to return.
-    index = -1    
-    ra_diff = 1000.0
-    dec_diff = 1000.0
-    ra_min_diff = 1000.0
-    dec_min_diff = 1000.0    
-    
-    # Iterate over the whole list to search for the nearest values to those
-    # received.
-    i = 0
-    for rd in rd_data:
-        # Compute the difference between the coordinates of the
-        # star in this row and the star received.  
-        temp_ra_diff = abs(float(rd[RD_DATA_RA_COL]) - ra)
-        
-        # If RA is close to 360 or 0, the differences could be close
-        # to 360 but actually should be considered close to 0. 
-        if temp_ra_diff > 355.0:
-            temp_ra_diff = abs(360.0 - temp_ra_diff)
-        
-        # DEC (up to 90 difference is multiplied by 4 to equate 
-        # the differences with RA (up to 360).
-        temp_dec_diff = abs(float(rd[RD_DATA_DEC_COL]) - dec) * 4.0   
-        
-        # If the differences are into the margin.
-        if temp_ra_diff < ASTROMETRY_COORD_RANGE and \
-            temp_dec_diff < ASTROMETRY_COORD_RANGE:
-            # If current row coordinates are smaller than previous this
-            # row is chosen as candidate for the star.
-            if temp_ra_diff + temp_dec_diff < ra_diff + dec_diff:
-                ra_diff = temp_ra_diff
-                dec_diff = temp_dec_diff
-                index = i
-                
-        # Collect the minimum difference found to debug the process in case
-        # of no matching.
-        if temp_ra_diff + temp_dec_diff < ra_min_diff + dec_min_diff:
-            ra_min_diff = temp_ra_diff
-            dec_min_diff = temp_dec_diff
+    ra_rad = np.radians(np.asarray(ra, dtype=np.float64))
+    dec_rad = np.radians(np.asarray(dec, dtype=np.float64))
     
-        i += 1
-        
-    if index == -1:
-        logging.debug("No match for star coordinates, min. diff. are: %.10g %.10g" %
-                      (ra_min_diff, dec_min_diff))
-        
-    return index
+    return np.column_stack((np.cos(dec_rad) * np.cos(ra_rad),
+                            np.cos(dec_rad) * np.sin(ra_rad),
+                            np.sin(dec_rad)))
 
 def get_indexes_for_star_coor(rd_data, star):
     """ Get the indexes of the ra,dec coordinates nearest to those of the 
     stars received.
     
+    The coordinates of the star and of all the stars of its field are 
+    searched at once.
+    
     Args:
-        rd_data: List of ra, dec values. The closest pair of this list to the
-        ra,dec values are returned.
+        rd_data: The columns of ra, dec values. The closest pair of these 
+        columns to the ra,dec values are returned.
         star: The star.
     
     Returns:
@@ -123,40 +138,170 @@ def get_indexes_for_star_coor(rd_data, star):
     # Identifiers of the stars found.
     identifiers = []
     
-    # Get the index for the star.
-    new_index = get_rd_index(rd_data, star.ra, star.dec)
+    stars_to_search = [star]
+    
+    # If the star isn't standard, get the indexes for the star in its field.
+    if not star.is_std:
+        stars_to_search.extend(star.field_stars)
+        
+    rd_indexes = CelestialIndex(rd_data).query([s.ra for s in stars_to_search],
+                                               [s.dec for s in stars_to_search])
     
     # If the star has been found.
-    if new_index >= 0:
+    if rd_indexes[0] >= 0:
         
-        # If the star isn't standard, get the indexes for the star in its field.
-        if not star.is_std:
+        # Get the indexes for the stars references.
+        for star_of_field, new_index in zip(stars_to_search[1:], 
+                                            rd_indexes[1:]):
             
-            # Get the indexes for the stars references.
-            for star_of_field in star.field_stars:
-                new_index = get_rd_index(rd_data, star_of_field.ra, \
-                                         star_of_field.dec)
+            # Check that an index has been found for this star.
+            if new_index >= 0:
+                logging.debug("Index for reference %.10g, %.10g with id %d is %d" %
+                              (star_of_field.ra, star_of_field.dec,
+                              star_of_field.id, new_index))        
+                                         
+                indexes.extend([new_index])  
                 
-                # Check that an index has been found for this star.
-                if new_index >= 0:
-                    logging.debug("Index for reference %.10g, %.10g with id %d is %d" %
-                                  (star_of_field.ra, star_of_field.dec,
-                                  star_of_field.id, new_index))        
-                                             
-                    indexes.extend([new_index])  
-                    
-                    identifiers.extend([star_of_field.id])    
-                else:
-                    logging.debug("Index for reference %.10g, %.10g with id %d not found" %
-                                  (star_of_field.ra, star_of_field.dec, 
-                                   star_of_field.id))
+                identifiers.extend([star_of_field.id])    
+            else:
+                logging.debug("Index for reference %.10g, %.10g with id %d not found" %
+                              (star_of_field.ra, star_of_field.dec, 
+                               star_of_field.id))
     else:
         logging.warning("Index for star %s not found" % star.name)
 
     return indexes, identifiers
     
-def check_celestial_coordinates(image_file_name, star, indexes, \
-                                identifiers, rd_data, xy_data):
+class CoordinatesValidation(object):
+    """The result of the validation of the coordinates calculated by the 
+    astrometry of an image.
+    
+    """
+    
+    def __init__(self, image_file_name):
+        
+        self._image_file_name = image_file_name
+        
+        self._star_in_field = False
+        self._star_near_center = None
+        self._duplicated_ids = False
+        self._star_identified = False
+        
+        self._ra_range = None
+        self._dec_range = None
+        self._center = None
+        self._star_xy = None
+        
+    def __str__(self):
+        return "Validation of %s: success: %s, in field: %s, near center: %s, duplicated ids: %s, star identified: %s" % \
+            (self._image_file_name, self.success, self._star_in_field, 
+             self._star_near_center, self._duplicated_ids, 
+             self._star_identified)
+        
+    @property
+    def image_file_name(self):
+        return self._image_file_name
+    
+    @property
+    def success(self):
+        # The distance to the center is not checked if the center is unknown.
+        return self._star_in_field and self._star_near_center is not False
+        
+    @property
+    def star_in_field(self):
+        return self._star_in_field
+    
+    @star_in_field.setter
+    def star_in_field(self, star_in_field):
+        self._star_in_field = star_in_field
+        
+    @property
+    def star_near_center(self):
+        return self._star_near_center
+    
+    @star_near_center.setter
+    def star_near_center(self, star_near_center):
+        self._star_near_center = star_near_center
+        
+    @property
+    def duplicated_ids(self):
+        return self._duplicated_ids
+    
+    @duplicated_ids.setter
+    def duplicated_ids(self, duplicated_ids):
+        self._duplicated_ids = duplicated_ids
+        
+    @property
+    def star_identified(self):
+        return self._star_identified
+    
+    @star_identified.setter
+    def star_identified(self, star_identified):
+        self._star_identified = star_identified
+        
+    @property
+    def ra_range(self):
+        return self._ra_range
+    
+    @ra_range.setter
+    def ra_range(self, ra_range):
+        self._ra_range = ra_range
+        
+    @property
+    def dec_range(self):
+        return self._dec_range
+    
+    @dec_range.setter
+    def dec_range(self, dec_range):
+        self._dec_range = dec_range
+        
+    @property
+    def center(self):
+        return self._center
+    
+    @center.setter
+    def center(self, center):
+        self._center = center
+        
+    @property
+    def star_xy(self):
+        return self._star_xy
+    
+    @star_xy.setter
+    def star_xy(self, star_xy):
+        self._star_xy = star_xy
+
+def get_xy_center(image_file_name):
+    """Returns the center of the image, taken from the size of the image in 
+    the wcs file generated by the astrometry.
+    
+    Args:
+        image_file_name: Name of the file of the image.
+        
+    Returns:
+        The x, y coordinates of the center of the image, None if not found.
+    
+    """
+    
+    center = None
+    
+    wcs_file_name = image_file_name.replace("." + FIT_FILE_EXT, 
+                                            "." + WCS_FILE_EXT)
+    
+    try:
+        header = read_header(wcs_file_name)
+        
+        center = (int(header[IMAGEW]) / 2, int(header[IMAGEH]) / 2)
+    except IOError as ioe:
+        logging.warning("WCS file %s not read: %s" % (wcs_file_name, ioe))
+    except KeyError as ke:
+        logging.warning("Header field for XY center not found in file %s" %
+                        (wcs_file_name))
+        
+    return center
+    
+def validate_celestial_coordinates(image_file_name, star, indexes,
+                                   identifiers, rd_data, xy_data):
     """Check if ra,dec coordinates complies the validation criteria.
     
     These validations are performed to ensure the astrometry coordinates are
@@ -165,92 +310,77 @@ def check_celestial_coordinates(image_file_name, star, indexes, \
     contained in the field recognized by the astrometry.
     - Checks that the X,Y coordinates for the star of interest are into a 
     distance from the center of the image.
+    Also the identifiers are checked to be unique and to contain the star of
+    interest, these checks does not affect the success of the validation.
     
     Args:
         image_file_name: Name of the file to the image whose coordinates are 
         checked.
         star: Data of the star whose image is analyzed to get the astrometry.
         indexes: Indexes to the coordinates of the stars found in this image.
-        rd_data: List of RA, DEC coordinates calculated by the astrometry.
-        xy_data: list of X, Y coordinates calculated by the astrometry.
+        identifiers: Identifiers of the stars found in this image.
+        rd_data: Columns of RA, DEC coordinates calculated by the astrometry.
+        xy_data: Columns of X, Y coordinates calculated by the astrometry.
     
     Returns:    
-        True if checks are ok, False otherwise.
+        The report of the validation.
     
     """
     
-    success = True
+    report = CoordinatesValidation(image_file_name)
     
-    # Default values.
-    min_ra = 1000.0
-    max_ra = -1000.0
-    min_dec = 1000.0
-    max_dec = -1000.0
+    ra = rd_data[RD_DATA_RA_COL]
+    dec = rd_data[RD_DATA_DEC_COL]
     
-    # Iterate over the RA, DEC list of coordinates to get the minimum and 
-    # maximum values of RA and DEC.
-    for rd in rd_data:
-        ra = float(rd[RD_DATA_RA_COL])
-        dec = float(rd[RD_DATA_DEC_COL])
-        
-        if ra < min_ra:
-            min_ra = ra
-            
-        if ra > max_ra:
-            max_ra = ra   
-            
-        if dec < min_dec:
-            min_dec = dec
+    if len(ra) > 0:
+        report.ra_range = (float(ra.min()), float(ra.max()))
+        report.dec_range = (float(dec.min()), float(dec.max()))
             
-        if dec > max_dec:
-            max_dec = dec       
-            
-    # Check that the RA,DEC coordinates for the star of interest
-    # are contained in the field recognized by the astrometry.
-    if (star.ra > min_ra) and (star.ra < max_ra) and \
-         (star.dec > min_dec) and (star.dec < max_dec):
+        # Check that the RA,DEC coordinates for the star of interest
+        # are contained in the field recognized by the astrometry.
+        report.star_in_field = \
+            report.ra_range[0] < star.ra < report.ra_range[1] and \
+            report.dec_range[0] < star.dec < report.dec_range[1]
+    
+    if report.star_in_field:
         
-        header_fields = get_fit_fields(image_file_name, \
-                                       XY_CENTER_FIT_HEADER_FIELDS)
+        report.center = get_xy_center(image_file_name)
         
-        try:
-            x_center = int(header_fields[CRPIX1])
-            y_center = int(header_fields[CRPIX2])
+        if report.center is not None and len(indexes) > 0:
+            x_center, y_center = report.center
             
             # Retrieve the index in the astrometry list saved as first index.
             # This index corresponds to the star of interest.
-            first_star = xy_data[indexes[0]] 
+            star_x = int(xy_data[XY_DATA_X_COL][indexes[0]])
+            star_y = int(xy_data[XY_DATA_Y_COL][indexes[0]])
             
-            star_x = int(first_star[XY_DATA_X_COL])
-            star_y = int(first_star[XY_DATA_Y_COL])
+            report.star_xy = (star_x, star_y)
             
             # Check that the X,Y coordinates for the star of interest are
             # into a distance from the center of the image.
-            if (star_x < x_center - x_center * XY_PERCENT_DEV_FROM_CENTER) | \
-                (star_x > x_center + x_center * XY_PERCENT_DEV_FROM_CENTER) | \
-                (star_y < y_center - y_center * XY_PERCENT_DEV_FROM_CENTER) | \
-                (star_y > y_center + y_center * XY_PERCENT_DEV_FROM_CENTER):
+            report.star_near_center = \
+                abs(star_x - x_center) <= x_center * XY_PERCENT_DEV_FROM_CENTER and \
+                abs(star_y - y_center) <= y_center * XY_PERCENT_DEV_FROM_CENTER
             
-                success = False             
-                
+            if not report.star_near_center:
                 logging.error("X,Y coordinates for star to far from %s center in " %
                               (image_file_name))
-        except KeyError as ke:
-            logging.warning("Header field 'for XY center not found in file %s" %
-                            (image_file_name))  
-        
     else:
         logging.error("RA DEC coordinates given by astrometry does not contain star in image: %s" %
                       (image_file_name))
         
-        success = False
+    ids = np.asarray(identifiers, dtype=int)
+        
+    report.duplicated_ids = len(np.unique(ids)) < len(ids)
+    
+    report.star_identified = np.any(ids == 0)
         
-    if len(set(identifiers)) < len(identifiers):
+    if report.duplicated_ids:
         logging.error("Duplicated coordinates for some star in: %s" %
                       (image_file_name))
         
-    if len([x for x in identifiers if x == '0']) == 0:
+    if not report.star_identified:
         logging.error("No coordinates identified for star of interest in: %s" %
                       (image_file_name))        
     
-    return success
\ No newline at end of file
+    return report
@@ -22,34 +22,183 @@
 The calculation is performed using sextractor. 
 
 sextractor identifies the objects in the images and calculates a FWHM for each 
-one.
+one. The objects are written to a catalog in FITS_LDAC format that is read
+as arrays.
 
 A FWHM from all the FWHM returned by sextractor is calculated as the FWHM of 
 the image.
 
+The FWHM calculated for each image is stored in a cache indexed by the hash 
+of the content of the image, so sextractor is only executed again for an 
+image when it changes. sextractor is executed for several images at the same
+time.
+
 """
 
-import sys
 import os
 import logging
-import glob
+import hashlib
+import json
+import numpy as np
+import pyfits
 from scipy.stats import mode
+import cmdpool
 from constants import *
 
 # sextractor parameters.
-SEXTRACTOR_COMMENT = "#"
-SEXTRACTOR_FWHM_COL = 2
+SEXTRACTOR_FWHM_FIELD = "FWHM_IMAGE"
 SEXTRACTOR_FWHM_MIN_VALUE = 1.2
 SEXTRACTOR_CFG_FILENAME = "sextractor.sex"
+SEXTRACTOR_CATALOG_TYPE = "FITS_LDAC"
+SEXTRACTOR_CATALOG_EXT = "ldac"
 
-# Depending on Python version this module has a different name.
-if sys.version_info < (3, 3):
-    from subprocess32 import check_output
-else:
-    from subprocess import check_output
+# Index of the table of objects in a FITS_LDAC catalog.
+LDAC_OBJECTS_TABLE_INDEX = 2
 
-def process_sextractor_output(command_out):
-    """Process sextractor' output to calculate the FWHM of the image. 
+# Name of the file of the cache of FWHM values.
+FWHM_CACHE_FILE_NAME = "fwhm_cache.json"
+
+# Size of the blocks read to calculate the hash of a file.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+class FwhmCache(object):
+    """Stores the FWHM calculated for each image in a file, indexed by the 
+    hash of the content of the image.
+    """
+    
+    def __init__(self, file_name):
+        """Constructor.
+        
+        Args:
+            file_name: The name of the file of the cache.
+            
+        """
+        
+        self._file_name = file_name
+        
+        self._values = {}
+        
+        self._modified = False
+        
+        if os.path.exists(file_name):
+            try:
+                with open(file_name, "r") as cache_file:
+                    self._values = json.load(cache_file)
+                    
+            except (IOError, ValueError) as e:
+                logging.warning("FWHM cache %s cannot be read, it is ignored: %s" %
+                                (file_name, e))
+                
+    @property
+    def file_name(self):
+        return self._file_name
+        
+    def get(self, file_hash):
+        """Returns the FWHM stored for the hash received.
+        
+        Args:
+            file_hash: The hash of the content of the image.
+            
+        Returns:
+            The FWHM stored, or None if there is no FWHM for the hash.
+            
+        """
+        
+        return self._values.get(file_hash)
+    
+    def put(self, file_hash, fwhm):
+        """Stores the FWHM of an image.
+        
+        Args:
+            file_hash: The hash of the content of the image.
+            fwhm: The FWHM of the image.
+            
+        """
+        
+        self._values[file_hash] = fwhm
+        
+        self._modified = True
+        
+    def save(self):
+        """Writes the cache to its file, if it has been modified. """
+        
+        if self._modified:
+            temp_file_name = self._file_name + ".tmp"
+            
+            try:
+                with open(temp_file_name, "w") as cache_file:
+                    json.dump(self._values, cache_file)
+                
+                # Replace the previous file only when the new one is complete.
+                os.rename(temp_file_name, self._file_name)
+                
+                self._modified = False
+                
+            except (IOError, OSError) as e:
+                logging.error("Error writing FWHM cache %s: %s" % 
+                              (self._file_name, e))
+
+def get_file_hash(file_name):
+    """Returns the hash of the content of a file.
+    
+    Args:
+        file_name: The name of the file.
+        
+    Returns:
+        The SHA-1 of the content of the file as a hexadecimal string.
+        
+    Raises:
+        IOError if the file cannot be read.
+        
+    """
+    
+    sha = hashlib.sha1()
+    
+    with open(file_name, "rb") as f:
+        block = f.read(HASH_BLOCK_SIZE)
+        
+        while len(block) > 0:
+            sha.update(block)
+            
+            block = f.read(HASH_BLOCK_SIZE)
+            
+    return sha.hexdigest()
+
+def get_sextractor_catalog_name(img_filename):
+    """Returns the name of the catalog written by sextractor for an image.
+    
+    Args:
+        img_filename: Name of the file of the image.
+        
+    Returns:
+        The name of the catalog.
+        
+    """
+    
+    return img_filename.replace("." + FIT_FILE_EXT, 
+                                "." + SEXTRACTOR_CATALOG_EXT)
+
+def get_sextractor_command(sextractor_cfg_path, img_filename):
+    """Returns the command to execute sextractor on an image writing the 
+    objects to a FITS_LDAC catalog.
+    
+    Args:
+        sextractor_cfg_path: Path to the sextractor configuration files.
+        img_filename: Name of the file of the image.
+        
+    Returns:
+        The command to execute.
+        
+    """
+    
+    return "sex -c %s %s -CATALOG_TYPE %s -CATALOG_NAME %s" % \
+        (os.path.join(sextractor_cfg_path, SEXTRACTOR_CFG_FILENAME),
+         os.path.abspath(img_filename),
+         SEXTRACTOR_CATALOG_TYPE,
+         os.path.abspath(get_sextractor_catalog_name(img_filename)))
+
+def get_fwhm_of_values(fwhm_values):
+    """Calculates the FWHM of an image from the FWHM of its objects.
     
     Only values of FWHM greater than a minimun value near zero
     are considered.
@@ -57,40 +206,148 @@ def process_sextractor_output(command_out):
     The mode is the statistics considered to get the best representation
     of the FWHM of the image.
     
-    Argss:
-        command_out: The output of the sextractor execution.
+    Args:
+        fwhm_values: The FWHM of the objects of the image.
+        
+    Returns:
+        The statistical mode of the all the FWHM values received, or None if 
+        there is not any valid value.
+        
+    """
+    
+    fwhm = None
+    
+    fwhm_values = np.asarray(fwhm_values, dtype=np.float64)
+    
+    # Keep only the values considered valid.
+    fwhm_values = fwhm_values[fwhm_values > SEXTRACTOR_FWHM_MIN_VALUE]
+    
+    # Return the mode of all the FWHM values found.
+    if len(fwhm_values) > 0:
+        fwhm = float(mode(fwhm_values)[0][0])
+    
+    return fwhm
+
+def process_sextractor_output(catalog_file_name):
+    """Process sextractor' output to calculate the FWHM of the image. 
+    
+    Args:
+        catalog_file_name: The FITS_LDAC catalog written by sextractor.
     
     Returns:
-        The statistical mode of the all the FWHM values received.
+        The statistical mode of the all the FWHM values of the catalog, or 
+        None if the catalog has not any valid value.
+        
+    Raises:
+        IOError if the catalog cannot be read.
+        KeyError if the catalog does not contain the FWHM.
     
     """    
     
-    # Get the output received in lines.
-    lines = command_out.split("\n")
+    hdulist = pyfits.open(catalog_file_name)
     
-    # To accumulate the valid FWHM values.
-    sum = []
+    try:
+        fwhm_values = np.array(
+            hdulist[LDAC_OBJECTS_TABLE_INDEX].data.field(SEXTRACTOR_FWHM_FIELD),
+            dtype=np.float64)
+    finally:
+        hdulist.close()
+    
+    return get_fwhm_of_values(fwhm_values)
+
+def sextractor_finished(img_filename, return_code, fwhms):
+    """Reads the catalog written by sextractor for an image when the command
+    finishes.
+    
+    Args:
+        img_filename: Name of the file of the image.
+        return_code: Return code of sextractor, None if it has not finished.
+        fwhms: Dictionary where the FWHM of the image is stored.
+        
+    """
     
-    # Process the output lines.
-    for l in lines:
-        # If it is not a commented line.
-        if len(l) > 0 and l[0] != SEXTRACTOR_COMMENT:
+    catalog_file_name = get_sextractor_catalog_name(img_filename)
+    
+    if return_code == 0:
+        try:
+            fwhms[img_filename] = process_sextractor_output(catalog_file_name)
             
-            # Get the columns of the line.
-            cols = l.split(" ")
+            logging.debug("FWHM calculated for %s is: %s" % 
+                          (img_filename, fwhms[img_filename]))
             
-            # Discard empty strings.
-            cols = filter(len, cols)      
+        except (IOError, IndexError, KeyError) as e:
+            logging.error("Error reading sextractor catalog %s: %s" %
+                          (catalog_file_name, e))
+    else:
+        logging.error("sextractor failed for image %s, return code: %s" %
+                      (img_filename, return_code))
+        
+    if os.path.exists(catalog_file_name):
+        os.remove(catalog_file_name)
+
+def get_fwhm_of_images(sextractor_cfg_path, image_file_names, 
+                       cache_file_name=None, num_processes=1):
+    """Calculates the FWHM of the images received.
+    
+    The FWHM of an image is taken from the cache if the image has not 
+    changed, sextractor is executed at the same time for the rest of images.
+    
+    Args:
+        sextractor_cfg_path: Path to the sextractor configuration files.
+        image_file_names: Names of the files of the images.
+        cache_file_name: Name of the file of the cache, None to not use it.
+        num_processes: Number of sextractor executed at the same time.
+    
+    Returns:    
+        A dictionary with the FWHM of each image, None for the images whose 
+        FWHM cannot be calculated.
+    
+    """
+    
+    fwhms = dict.fromkeys(image_file_names)
+    
+    cache = None
+    
+    if cache_file_name is not None:
+        cache = FwhmCache(cache_file_name)
+    
+    hashes = {}
+    
+    pool = cmdpool.CommandPool(num_processes)
+    
+    for img_filename in image_file_names:
+        if cache is not None:
+            try:
+                hashes[img_filename] = get_file_hash(img_filename)
+                
+                fwhms[img_filename] = cache.get(hashes[img_filename])
+                
+            except IOError as ioe:
+                logging.error("Error reading image %s: %s" % (img_filename, ioe))
+                
+        if fwhms[img_filename] is None:
+            pool.add_command(get_sextractor_command(sextractor_cfg_path,
+                                                    img_filename), 
+                             img_filename)
+        else:
+            logging.debug("FWHM of %s taken from cache: %s" % 
+                          (img_filename, fwhms[img_filename]))
             
-            # Get the fwhm from the columns of the line.
-            fwhm = float(cols[SEXTRACTOR_FWHM_COL])
+    logging.debug("Executing sextractor for %d images using %d processes." %
+                  (pool.number_of_commands, num_processes))
             
-            # If it is a value considered valid, store it.
-            if fwhm > SEXTRACTOR_FWHM_MIN_VALUE:
-                sum.extend([fwhm])
+    pool.run(lambda img_filename, return_code: 
+             sextractor_finished(img_filename, return_code, fwhms))
     
-    # Return the mode of all the FWHM values found.
-    return mode(sum)[0][0]
+    if cache is not None:
+        for img_filename, file_hash in hashes.items():
+            if fwhms[img_filename] is not None and \
+                cache.get(file_hash) is None:
+                cache.put(file_hash, fwhms[img_filename])
+            
+        cache.save()
+    
+    return fwhms
 
 def get_fwhm(sextractor_cfg_path, img_filename):
     """Execute sextractor on the image received to get its fwhm. 
@@ -100,24 +357,9 @@ def get_fwhm(sextractor_cfg_path, img_filename):
         img_filename: Name of the file with image whose FWHM is calculated.
     
     Returns:    
-        The FWHM value calculated for the image indicated.
+        The FWHM value calculated for the image indicated, or None if it 
+        cannot be calculated.
     
     """
 
-    # Build the command to execute.
-    command = "sex -c " + \
-        os.path.join(sextractor_cfg_path, SEXTRACTOR_CFG_FILENAME) \
-        + " " + os.path.join(os.getcwd(), img_filename)
-        
-    logging.debug("Executing: " + command)
-    
-    # Execute sextractor command to calculate the FWHM of the objects detected
-    # in the image.
-    command_out = check_output(command, shell=True)
-
-    # Process the output.
-    fwhm = process_sextractor_output(command_out)
-    
-    logging.debug("FWHM calculated is: " + str(fwhm))
-
-    return fwhm
\ No newline at end of file
+    return get_fwhm_of_images(sextractor_cfg_path, [img_filename])[img_filename]
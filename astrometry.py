@@ -30,17 +30,14 @@ import yargparser
 import glob
 import pyfits
 import csv
+import cmdpool
+import wcsprop
 from constants import *
 from textfiles import *
 from fitfiles import *
 from astrocoor import *
 from starcat import *
 
-if sys.version_info < (3, 3):
-    import subprocess32 as subprocess
-else:
-    import subprocess
-
 # Positions for the values of the stars coordinates. 
 RA_POS = 0
 DEC_POS = 1
@@ -85,11 +82,21 @@ class Astrometry(object):
         self._target_dir = progargs.target_dir
         self._data_dir_name = progargs.light_directory
         self._num_of_objects = progargs.number_of_objects_for_astrometry
+        self._num_processes = progargs.number_of_processes
+        self._timeout = progargs.astrometry_timeout
+        self._wcs_propagation = progargs.wcs_propagation
+        
+        # Images pending of the propagation of the astrometry and the last 
+        # image with astrometry, for each group of images of the same star 
+        # and filter.
+        self._images_to_propagate = {}
+        self._references = {}
         
         # Initializes attributes to store summary information of the astrometry.
         self._number_of_images = 0
         self._number_of_successful_images = 0    
         self._images_without_astrometry = []        
+        self._number_of_propagated_images = 0
         
         # Initialize base command to call external software to do astrometry.
         use_sextractor = ""
@@ -131,6 +138,8 @@ class Astrometry(object):
         
         """
         
+        files_to_catalog = []
+        
         # Walk from target directory.
         for path, dirs, files in os.walk(self._target_dir):
     
@@ -143,93 +152,205 @@ class Astrometry(object):
                     logging.info("Found a directory for data: %s" % (path))
     
                     # Get the list of files ignoring hidden files.
-                    files_to_catalog = \
+                    files_in_dir = \
                         [fn for fn in \
                          glob.glob(os.path.join(path, 
                                                 "*" + DATA_FINAL_PATTERN)) \
                         if not os.path.basename(fn).startswith('.')]
+                    
+                    # Sort to process the images in the order taken.
+                    files_in_dir.sort()
                         
                     logging.debug("Found %d files to catalog." % \
-                                  (len(files_to_catalog)))
+                                  (len(files_in_dir)))
+                    
+                    files_to_catalog.extend(files_in_dir)
     
-                    self.do_astrometry_of_images(files_to_catalog)
+        self.do_astrometry_of_images(files_to_catalog)
     
         self.print_summary()
         
-    def execute_astrometry_command(self, num_of_objects, image_file, star):
-        """Executes a external command to perform the astrometry.
+    def get_astrometry_command(self, num_of_objects, image_file, star):
+        """Returns the external command to perform the astrometry.
         
         Args:
             num_of_objects: Number of objects to use when identifying the
                 field of stars.
             image_file: The name of the file with the image.
             star: The star related to the image.
+            
+        Returns:
+            The command to execute.
+            
         """
         
         # Compose the command use the base command and adding the arguments
         # for current image.
-        command = "%s %s --ra %.10g --dec %.10g %s" % \
+        return "%s %s --ra %.10g --dec %.10g %s" % \
             (self._base_command, num_of_objects, 
              star.ra, star.dec, image_file)
             
-        logging.debug("Executing: %s" % (command))
+    def add_astrometry_command(self, pool, image_file, star, attempt):
+        """Adds to the pool the command to perform the astrometry of an image.
         
-        # Executes astrometry.net solver to get the astrometry
-        # of the image.
-        return_code = subprocess.call(command, shell=True, 
-                                      stdout=subprocess.PIPE,
-                                      stderr=subprocess.PIPE)
+        Args:
+            pool: The pool of commands.
+            image_file: The name of the file with the image.
+            star: The star related to the image.
+            attempt: Number of the attempt, the second attempt uses more 
+                objects.
+            
+        """
         
-        logging.debug("Astrometry execution return code: %d" % (return_code))        
+        if attempt == 1:
+            num_of_objects = self._num_of_objects
+        else:
+            num_of_objects = Astrometry.NUM_OBJECTS_SECOND_TRY
+            
+        command = self.get_astrometry_command(num_of_objects, image_file, star)
         
-        return return_code
+        pool.add_command(command, (image_file, star, attempt))
         
-    def do_astrometry_of_image(self, image_file, star):
-        """Get the astrometry of an image. The command is execute a second
-        time if the first execution does not generate the astrometry.
+    def astrometry_finished(self, pool, image_file, star, attempt, 
+                            return_code):
+        """Process the result of an execution of the astrometry of an image.
+        
+        If the execution does not generate the astrometry it is queued 
+        again a second time, otherwise the catalogs of the image are written.
         
         Args:
-            image_file: The image_file with the image.
+            pool: The pool of commands.
+            image_file: The name of the file with the image.
             star: The star related to the image.
+            attempt: Number of the attempt.
+            return_code: Return code of the command, None if it was killed.
             
         """
-                    
-        self.execute_astrometry_command(self._num_of_objects, image_file, star)
         
-        success = self.astrometry_success(image_file)
+        success = return_code is not None and \
+            self.astrometry_success(image_file)
         
         # Check if the astrometry has been successful.
         if success:
-            logging.debug("Astrometry first execution successful with %s objects" %
-                          (self._num_of_objects))
+            logging.debug("Astrometry execution %d successful for %s" %
+                          (attempt, image_file))
+            
+            self.astrometry_solved(image_file, star)
             
-        elif self._num_of_objects < Astrometry.NUM_OBJECTS_SECOND_TRY:
+            if self._wcs_propagation:
+                self._references[self.get_group_key(image_file, star)] = \
+                    image_file
+            
+        elif attempt == 1 and \
+            self._num_of_objects < Astrometry.NUM_OBJECTS_SECOND_TRY:
             
             # If the first execution of astrometry has not been successful do a
-            # second try incrementing the number of objects to identify.            
-            self.execute_astrometry_command(Astrometry.NUM_OBJECTS_SECOND_TRY,
-                                            image_file, star)
+            # second try incrementing the number of objects to identify.
+            self.add_astrometry_command(pool, image_file, star, attempt + 1)
+            
+        else:
+            logging.debug("Astrometry final execution not successful for %s" %
+                          (image_file))
+            
+            self._images_without_astrometry.extend([image_file])
+            
+        # Continue with the rest of images of the same star and filter.
+        if self._wcs_propagation and (success or attempt > 1 or 
+            self._num_of_objects >= Astrometry.NUM_OBJECTS_SECOND_TRY):
+            self.propagate_astrometry_of_group(pool, 
+                                               self.get_group_key(image_file, 
+                                                                  star))
+            
+    def astrometry_solved(self, image_file, star):
+        """Writes the catalog of an image whose astrometry has been 
+        calculated.
+        
+        Args:
+            image_file: The name of the file with the image.
+            star: The star related to the image.
+            
+        """
+        
+        self._number_of_successful_images += 1
+        
+        cat_file_name = image_file.replace(DATA_FINAL_PATTERN, 
+            "." + CATALOG_FILE_EXT)            
+        
+        # Generates catalog files with x,y and ra,dec values
+        # and if it is successful count it.
+        self.write_coord_catalogues(image_file, cat_file_name, star)
+        
+    def get_group_key(self, image_file, star):
+        """Returns the key of the group of images of the same star and filter
+        of an image.
+        
+        Args:
+            image_file: The name of the file with the image.
+            star: The star related to the image.
+            
+        Returns:
+            The key of the group.
+            
+        """
+        
+        # The images of each filter are in a different directory.
+        return os.path.dirname(image_file), star.name
+    
+    def propagate_astrometry_of_group(self, pool, key):
+        """Propagates the astrometry of the last image with astrometry of a 
+        group to the images pending of the group. 
         
-            success = self.astrometry_success(image_file)
+        The images where the astrometry cannot be propagated are solved. If
+        the group has not an image with astrometry, the first image pending 
+        is solved and the rest wait for the result.
+        
+        Args:
+            pool: The pool of commands.
+            key: The key of the group.
             
-            if success:
-                logging.debug("Astrometry second execution successful with %d objects" %
-                              (Astrometry.NUM_OBJECTS_SECOND_TRY))
+        """
+        
+        images = self._images_to_propagate.get(key, [])
+        
+        while len(images) > 0:
+            image_file, star = images.pop(0)
+            
+            reference = self._references.get(key)
+            
+            if reference is None:
+                self.add_astrometry_command(pool, image_file, star, 1)
+                
+                break
+            
+            elif wcsprop.propagate_astrometry(reference, image_file):
+                logging.debug("Astrometry propagated from %s to %s" %
+                              (reference, image_file))
+                
+                self._number_of_propagated_images += 1
+                
+                self.astrometry_solved(image_file, star)
+                
+                self._references[key] = image_file
+                
             else:
-                logging.debug("Astrometry second and final execution not " + 
-                              "successful with %d objects" %
-                              (Astrometry.NUM_OBJECTS_SECOND_TRY))       
-                 
-        return success
+                logging.debug("Astrometry of %s cannot be propagated from %s" %
+                              (image_file, reference))
+                
+                self.add_astrometry_command(pool, image_file, star, 1)
     
     def do_astrometry_of_images(self, files_to_catalog):
         """Perform the astrometry of the files received.
         
+        The astrometry of several images is calculated at the same time, 
+        keeping running the number of processes requested.
+        
         Args:
             files_to_catalog: List of catalog files to generate.
         
         """
         
+        pool = cmdpool.CommandPool(self._num_processes, self._timeout)
+        
         # Get the astrometry for each image_file found.
         for image_file in files_to_catalog:
             
@@ -245,19 +366,14 @@ class Astrometry(object):
                 try:
                     
                     star = self.get_star_from_file(image_file)
-
-                    # Generate astrometry of the image and check the result.                    
-                    if self.do_astrometry_of_image(image_file, star):
-                        
-                        self._number_of_successful_images += 1
+                    
+                    if self._wcs_propagation:
+                        key = self.get_group_key(image_file, star)
                         
-                        # Generates catalog files with x,y and ra,dec values
-                        # and if it is successful count it.
-                        self.write_coord_catalogues(image_file, cat_file_name, 
-                                                    star)
-                         
+                        self._images_to_propagate.setdefault(key, []).append(
+                            (image_file, star))
                     else:
-                        self._images_without_astrometry.extend([image_file])                     
+                        self.add_astrometry_command(pool, image_file, star, 1)
                     
                 except StarNotFound as onf:
                     logging.debug("Star not identified for image file: %s" % 
@@ -267,6 +383,28 @@ class Astrometry(object):
                 logging.debug("Catalog '%s' already exists." % 
                               (cat_file_name)) 
                 
+                # The astrometry of a previous run could be propagated.
+                if self._wcs_propagation and \
+                    self.astrometry_success(image_file):
+                    try:
+                        star = self.get_star_from_file(image_file)
+                        
+                        self._references[self.get_group_key(image_file, 
+                                                            star)] = image_file
+                    except StarNotFound as onf:
+                        logging.debug("Star not identified for image file: %s" % 
+                                      onf.filename)
+                
+        for key in sorted(self._images_to_propagate.keys()):
+            self.propagate_astrometry_of_group(pool, key)
+                
+        logging.debug("Calculating astrometry of %d images using %d processes." %
+                      (pool.number_of_commands, self._num_processes))
+                
+        pool.run(lambda data, return_code: 
+                 self.astrometry_finished(pool, data[0], data[1], data[2],
+                                          return_code))
+                
     def write_coord_catalogues(self, image_file_name, catalog_full_file_name, 
                                star):
         """Writes the x,y coordinates of a FITS file to a text file.    
@@ -304,6 +442,11 @@ class Astrometry(object):
         # Read x,y and ra,dec data from fit table.
         xy_data = get_fit_table_data(xyls_file_name)
         rd_data = get_fit_table_data(rdls_file_name)
+        
+        if xy_data is None or rd_data is None:
+            logging.warning("Catalog file not saved, astrometry files not read.")
+            
+            return success
                
         # Get the indexes for x,y and ra,dec data related to the
         # stars received.
@@ -313,8 +456,13 @@ class Astrometry(object):
         if len(indexes) > 0:              
             # Check if the coordinates complies with the 
             # coordinates validation criteria.
-            if check_celestial_coordinates(image_file_name, star, indexes, \
-                                           identifiers, rd_data, xy_data):
+            report = validate_celestial_coordinates(image_file_name, star,
+                                                    indexes, identifiers, 
+                                                    rd_data, xy_data)
+            
+            logging.debug(report)
+            
+            if report.success:
                 
                 try:
                     star_catalog = StarCatalog(catalog_full_file_name)
@@ -346,6 +494,9 @@ class Astrometry(object):
         logging.info("- Images processed successfully: %d" % \
                      (self._number_of_successful_images))
         
+        logging.info("- Images with astrometry propagated: %d" % \
+                     (self._number_of_propagated_images))
+        
         logging.info("- Number of images without astrometry: %d" % \
                      (len(self._images_without_astrometry)))   
          
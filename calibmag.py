@@ -116,6 +116,30 @@ class TransformingCoefficient(object):
         
         return slope1, intercept1, slope2, intercept2        
 
+def get_mags_of_day(magnitudes, star_name, day):
+    """Returns the extinction corrected magnitudes of a star in a day for the
+    B and V filters.
+    
+    Args:
+        magnitudes: Magnitudes of the stars.
+        star_name: Name of the star.
+        day: The day.
+        
+    Returns:
+        The rows of the table of magnitudes and the magnitudes of each 
+        filter.
+    
+    """
+    
+    table = magnitudes.magnitudes
+    
+    B_rows = table.select(star_name, B_FILTER_NAME, day)
+    V_rows = table.select(star_name, V_FILTER_NAME, day)
+    
+    return B_rows, V_rows, \
+        table.column(table.EXT_COR_MAG_FIELD, B_rows), \
+        table.column(table.EXT_COR_MAG_FIELD, V_rows)
+
 def get_transforming_coefficients(magnitudes):
     """Get the transforming coefficients to calculate the calibrated magnitudes.
     
@@ -143,80 +167,57 @@ def get_transforming_coefficients(magnitudes):
         V_std_mags_of_stars = []        
         
         # Use only standard stars.
-        for mag in magnitudes.std_stars:
-            
-            # Get the magnitudes of current star.
-            star_mags = magnitudes.get_mags_of_star(mag.name)
+        for star in magnitudes.std_stars:
             
-            # Get the stars with measures in the current day.
-            stars_of_B_filter = [m for m in star_mags \
-                       if m.day == d and m.filter == B_FILTER_NAME]
-            
-            stars_of_V_filter = [m for m in star_mags \
-                       if m.day == d and m.filter == V_FILTER_NAME] 
+            # Get the measures of the star in the current day.
+            B_rows, V_rows, B_mags, V_mags = \
+                get_mags_of_day(magnitudes, star.name, d)
             
             # Check there is at least two measures and the number matches both
             # sets.
             # Is is assumed that measurements for each filter are well paired.
-            if len(stars_of_B_filter) > 1 and len(stars_of_V_filter) > 1 and \
-                len(stars_of_B_filter) == len(stars_of_V_filter):
-                
-                B_mags_of_star = np.array([mag.ext_cor_mag \
-                                          for mag in stars_of_B_filter])
-                V_mags_of_star = np.array([mag.ext_cor_mag \
-                                          for mag in stars_of_V_filter]) 
+            if len(B_rows) > 1 and len(V_rows) > 1 and \
+                len(B_rows) == len(V_rows):
                 
-                B_mags = B_mags_of_star.astype(np.float)
-                V_mags = V_mags_of_star.astype(np.float)
-            
-                # Compute the mean for the magnitudes of this star
-                # in each filter. 
-                B_mean = np.mean(B_mags)
-                V_mean = np.mean(V_mags)
-
-                # Store the mean values of the magnitude observed for
-                # these stars to compute the transforming coefficients 
-                # of this day.
-                B_V_mags_of_day.extend([B_mags - V_mags])
-                V_mags_of_day.extend([V_mags])
+                # Store the values of the magnitude observed for these stars 
+                # to compute the transforming coefficients of this day.
+                B_V_mags_of_day.append(B_mags - V_mags)
+                V_mags_of_day.append(V_mags)
                 
                 # Add the standard magnitudes of the star.
                 B_std_mag_star = \
-                    np.array([float(magnitudes.get_std_mag(mag.star_name, \
-                                                           B_FILTER_NAME))] * \
-                             len(B_mags))
+                    float(magnitudes.get_std_mag(star.name, B_FILTER_NAME))
                     
                 V_std_mag_star = \
-                    np.array([float(magnitudes.get_std_mag(mag.star_name, \
-                                                           V_FILTER_NAME))] * \
-                             len(V_mags))
+                    float(magnitudes.get_std_mag(star.name, V_FILTER_NAME))
                 
-                B_V_std_mags_of_stars.extend([B_std_mag_star - \
-                                                V_std_mag_star])
+                B_V_std_mags_of_stars.append(
+                    np.repeat(B_std_mag_star - V_std_mag_star, len(B_mags)))
                 
-                V_std_mags_of_stars.extend(V_std_mag_star)
+                V_std_mags_of_stars.append(
+                    np.repeat(V_std_mag_star, len(V_mags)))
             else:
                 logging.debug("There is not enough measurements in all " +
                               "filters for star %s at day %d." % 
-                              (mag.name, d))
+                              (star.name, d))
 
-            # The coefficients are calculated only if there is enough values,
-            # (any list could be used for this check).
-            if len(V_mags_of_day) > 0:
-    
-                # Calculate the transforming coefficients of this day using the
-                # magnitudes found for this day.  
-                tc = TransformingCoefficient(d,
-                                             B_V_mags_of_day, \
-                                             V_mags_of_day, \
-                                             B_V_std_mags_of_stars, \
-                                             V_std_mags_of_stars)
-                    
-                trans_coef.append(tc)          
-            else:
-                logging.debug("No transforming coefficients could be " + 
-                              "calculated for day (there is only one " +
-                              "standard star) %d " % (d))
+        # The coefficients are calculated only if there is enough values,
+        # (any list could be used for this check).
+        if len(V_mags_of_day) > 0:
+
+            # Calculate the transforming coefficients of this day using the
+            # magnitudes found for this day.  
+            tc = TransformingCoefficient(d,
+                                         np.concatenate(B_V_mags_of_day), \
+                                         np.concatenate(V_mags_of_day), \
+                                         np.concatenate(B_V_std_mags_of_stars), \
+                                         np.concatenate(V_std_mags_of_stars))
+                
+            trans_coef.append(tc)          
+        else:
+            logging.debug("No transforming coefficients could be " + 
+                          "calculated for day (there is only one " +
+                          "standard star) %d " % (d))
             
     return trans_coef
     
@@ -231,6 +232,8 @@ def calibrated_magnitudes(magnitudes, trans_coef):
         magnitudes: Magnitudes of the stars. 
         
     """    
+    
+    table = magnitudes.magnitudes
         
     # Calculate for each star.
     for s in magnitudes.stars:
@@ -241,29 +244,15 @@ def calibrated_magnitudes(magnitudes, trans_coef):
             # Get the day of current transformation coefficient.
             day = tc.day
             
-            # Magnitudes of the star
-            star_mags = magnitudes.get_mags_of_star(s.name)
-            
-            # To store the magnitudes for this star in each filter.
-            mags_of_B_filter = [m for m in star_mags \
-                       if m.day == day and m.filter == B_FILTER_NAME]
-            
-            mags_of_V_filter = [m for m in star_mags \
-                       if m.day == day and m.filter == V_FILTER_NAME]    
+            # The magnitudes of the star in each filter.
+            B_rows, V_rows, B_obs_mags, V_obs_mags = \
+                get_mags_of_day(magnitudes, s.name, day)
             
             # If this star has measurements for all the filters.
             # Is is assumed that measurements for each filter are well paired.
-            if len(mags_of_B_filter) > 0 and len(mags_of_V_filter) > 0 and \
-                len(mags_of_B_filter) == len(mags_of_V_filter):
-                
-                B_mags_of_obj = np.array([m.ext_cor_mag \
-                                          for m in mags_of_B_filter])
-                
-                V_mags_of_obj = np.array([m.ext_cor_mag \
-                                          for m in mags_of_V_filter])
+            if len(B_rows) > 0 and len(V_rows) > 0 and \
+                len(B_rows) == len(V_rows):
                 
-                B_obs_mags = B_mags_of_obj.astype(np.float)
-                V_obs_mags = V_mags_of_obj.astype(np.float) 
                 B_V_obs_mags = B_obs_mags - V_obs_mags
                 
                 # Calculate the calibrated magnitudes.
@@ -272,17 +261,9 @@ def calibrated_magnitudes(magnitudes, trans_coef):
                 
                 B_cal_mag = B_V_cal_mag + V_cal_mag
                 
-                # Set the calibrated magnitudes of the star in B filter.
-                for j in range(len(mags_of_B_filter)):
-                    curr_B_mag = mags_of_B_filter[j]
-                    
-                    curr_B_mag.calib_mag = B_cal_mag[j]
-
-                # Set the calibrated magnitudes of the star in V filter.
-                for j in range(len(mags_of_V_filter)):
-                    curr_V_mag = mags_of_V_filter[j]
-                    
-                    curr_V_mag.calib_mag = V_cal_mag[j]
+                # Set the calibrated magnitudes of the star in each filter.
+                table.set_column(table.CALIB_MAG_FIELD, B_rows, B_cal_mag)
+                table.set_column(table.CALIB_MAG_FIELD, V_rows, V_cal_mag)
                 
                 logging.info("Calibrated magnitudes are calculated " +
                              "for star %s on day %d." % (s.name, day))
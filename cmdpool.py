@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module runs external commands keeping a number of them running at
+the same time.
+
+Each command could have a time limit, when it is exceeded the command is
+killed. The commands are added to a queue and started as the previous ones
+finish, the function called when a command finishes could add new commands
+to the queue, so a command could be retried without waiting for the rest.
+
+"""
+
+import sys
+import os
+import signal
+import time
+import logging
+import shlex
+from collections import deque
+
+if sys.version_info < (3, 3):
+    import subprocess32 as subprocess
+else:
+    import subprocess
+
+# Seconds to wait between each check of the commands running.
+POLL_INTERVAL = 0.2
+
+class CommandJob(object):
+    """A command to execute and the data related to it."""
+
+    def __init__(self, command, data):
+        """Constructor.
+
+        Args:
+            command: The command to execute.
+            data: Data related to the command, passed back when it finishes.
+
+        """
+
+        self._command = command
+        self._data = data
+        self._process = None
+        self._start_time = None
+
+    @property
+    def command(self):
+        return self._command
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def process(self):
+        return self._process
+
+    @property
+    def elapsed_time(self):
+        return time.time() - self._start_time
+
+    def start(self, devnull):
+        """Starts the execution of the command.
+
+        The command is executed in a new session, so all the processes
+        it creates could be killed.
+
+        Args:
+            devnull: File where the output of the command is discarded.
+
+        """
+
+        logging.debug("Executing: %s" % (self._command))
+
+        self._start_time = time.time()
+
+        self._process = subprocess.Popen(shlex.split(self._command),
+                                         stdout=devnull, stderr=devnull,
+                                         preexec_fn=os.setsid)
+
+    def kill(self):
+        """Kills the command and the processes it has created."""
+
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+
+        except OSError as oe:
+            logging.debug("Error killing command %s: %s" %
+                          (self._command, oe))
+
+        self._process.wait()
+
+class CommandPool(object):
+    """Executes a queue of commands keeping a maximum number of them running.
+    """
+
+    def __init__(self, num_processes, timeout=0):
+        """Constructor.
+
+        Args:
+            num_processes: Maximum number of commands running at the same time.
+            timeout: Maximum number of seconds a command could run, 0 for no
+            limit.
+
+        """
+
+        self._num_processes = max(1, num_processes)
+        self._timeout = timeout
+
+        self._pending = deque()
+        self._running = []
+
+    @property
+    def number_of_commands(self):
+        return len(self._pending) + len(self._running)
+
+    def add_command(self, command, data):
+        """Adds a command to the queue of commands to execute.
+
+        Args:
+            command: The command to execute.
+            data: Data related to the command, passed back when it finishes.
+
+        """
+
+        self._pending.append(CommandJob(command, data))
+
+    def cancel(self, data):
+        """Cancels the commands related to the data received, those pending
+        are removed and those running are killed.
+
+        Args:
+            data: The data of the commands to cancel.
+
+        """
+
+        self._pending = deque([j for j in self._pending if j.data != data])
+
+        for job in [j for j in self._running if j.data == data]:
+            logging.debug("Cancelling: %s" % (job.command))
+
+            job.kill()
+
+            self._running.remove(job)
+
+    def cancel_all(self):
+        """Cancels all the commands, pending or running."""
+
+        self._pending.clear()
+
+        for job in self._running:
+            job.kill()
+
+        self._running = []
+
+    def run(self, command_finished):
+        """Executes the commands of the queue until all of them have finished.
+
+        Args:
+            command_finished: Function called with the data and the return code
+            of each command when it finishes, the return code is None if the
+            command has been killed for exceeding the time limit.
+
+        """
+
+        with open(os.devnull, "w") as devnull:
+            try:
+                while self.number_of_commands > 0:
+
+                    while len(self._pending) > 0 and \
+                        len(self._running) < self._num_processes:
+
+                        job = self._pending.popleft()
+
+                        try:
+                            job.start(devnull)
+
+                            self._running.append(job)
+
+                        except OSError as oe:
+                            logging.error("Error executing: %s" % (job.command))
+                            logging.error("Error is: %s" % (oe))
+
+                            command_finished(job.data, None)
+
+                    for job in list(self._running):
+
+                        # The job could be cancelled by a previous call.
+                        if not job in self._running:
+                            continue
+
+                        return_code = job.process.poll()
+
+                        if return_code is None and self._timeout > 0 and \
+                            job.elapsed_time > self._timeout:
+
+                            logging.warning("Command killed after %d seconds: %s" %
+                                            (self._timeout, job.command))
+
+                            job.kill()
+
+                            self._running.remove(job)
+
+                            command_finished(job.data, None)
+
+                        elif return_code is not None:
+                            logging.debug("Return code %d for: %s" %
+                                          (return_code, job.command))
+
+                            self._running.remove(job)
+
+                            command_finished(job.data, return_code)
+
+                    if len(self._running) > 0:
+                        time.sleep(POLL_INTERVAL)
+
+            finally:
+                # Do not leave commands running if the execution is aborted.
+                self.cancel_all()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module combines a set of images in a single image.
+
+The images are combined pixel by pixel using the average, the median or
+the average after rejecting the values out of a number of standard deviations
+from the median (sigma clipping).
+
+The images are not loaded completely in memory, they are read and combined in
+tiles of rows, the number of rows of each tile depends on the number of images,
+so the memory used is bounded regardless of the number of images to combine.
+
+"""
+
+import logging
+import numpy as np
+import pyfits
+from constants import *
+
+# Methods to combine the images.
+COMBINE_AVERAGE = "average"
+COMBINE_MEDIAN = "median"
+COMBINE_SIGCLIP = "sigclip"
+
+COMBINE_METHODS = [ COMBINE_AVERAGE, COMBINE_MEDIAN, COMBINE_SIGCLIP ]
+
+# The default method is that used by default by imcombine.
+DEFAULT_COMBINE_METHOD = COMBINE_AVERAGE
+
+# Number of standard deviations from the median to reject a value.
+SIGCLIP_NUM_SIGMAS = 3.0
+SIGCLIP_MAX_ITERATIONS = 5
+
+# Maximum size in bytes of the data of all the images read for a tile.
+MAX_TILE_BYTES = 64 * 1024 * 1024
+
+# Keyword of the header to store the number of images combined.
+NCOMBINE_KEYWORD = "NCOMBINE"
+
+class CombineException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+
+        return self._msg
+
+def sigma_clipped_average(tile):
+    """Returns the average along the first axis of the data received after
+    rejecting iteratively the values out of a number of standard deviations
+    from the median.
+
+    Args:
+        tile: The data of the images to combine, one image for each index of
+        the first axis.
+
+    Returns:
+        The average of the values not rejected.
+
+    """
+
+    data = np.ma.array(tile, mask=np.zeros(tile.shape, dtype=bool))
+
+    for i in range(SIGCLIP_MAX_ITERATIONS):
+        median = np.ma.median(data, axis=0)
+        stddev = data.std(axis=0)
+
+        rejected = np.abs(data - median) > SIGCLIP_NUM_SIGMAS * stddev
+
+        # Only the values not rejected previously are taken into account.
+        new_rejected = rejected.filled(False) & ~data.mask
+
+        if not new_rejected.any():
+            break
+
+        data.mask |= new_rejected
+
+    # If all the values of a pixel are rejected, use the median of all them.
+    return data.mean(axis=0).filled(np.median(tile, axis=0))
+
+def combine_tile(tile, method):
+    """Combines the data of a tile of the images using the method indicated.
+
+    Args:
+        tile: The data of the images to combine, one image for each index of
+        the first axis.
+        method: The method to use to combine the images.
+
+    Returns:
+        The data combined.
+
+    """
+
+    if method == COMBINE_MEDIAN:
+        combined = np.median(tile, axis=0)
+    elif method == COMBINE_SIGCLIP:
+        combined = sigma_clipped_average(tile)
+    else:
+        combined = np.mean(tile, axis=0)
+
+    return combined
+
+def get_image_shape(header, file_name):
+    """Returns the shape of the image of the header received.
+
+    Args:
+        header: The header of the image.
+        file_name: The name of the file of the image.
+
+    Returns:
+        The number of rows and columns of the image.
+
+    Raises:
+        CombineException if the file does not contain an image of two
+        dimensions.
+
+    """
+
+    try:
+        if header["NAXIS"] != 2:
+            raise CombineException("File %s does not contain an image of two dimensions." %
+                                   (file_name))
+
+        shape = (header["NAXIS2"], header["NAXIS1"])
+
+    except KeyError as ke:
+        raise CombineException("File %s lacks the size of the image." %
+                               (file_name))
+
+    return shape
+
+def combine_images(file_names, method=DEFAULT_COMBINE_METHOD, offset=None,
+                   scales=None):
+    """Combines the images of the files received.
+
+    Before combining them, the offset is subtracted from each image and the
+    result is multiplied by the scale of the image, so the images could be
+    processed as they are read without writing intermediate files.
+
+    Args:
+        file_names: The names of the files with the images to combine.
+        method: The method to use to combine the images.
+        offset: Data to subtract from each image, if any.
+        scales: A scale for each image to multiply it by, if any.
+
+    Returns:
+        The data of the images combined and the header for these data, that
+        is the header of the first image.
+
+    Raises:
+        CombineException if the images cannot be combined.
+
+    """
+
+    if len(file_names) == 0:
+        raise CombineException("There is not any image to combine.")
+
+    if not method in COMBINE_METHODS:
+        raise CombineException("Invalid method to combine images: %s" %
+                               (method))
+
+    logging.debug("Combining %d images using %s." % (len(file_names), method))
+
+    hdulists = []
+
+    try:
+        # The files are opened but the data is read by tiles.
+        for fn in file_names:
+            hdulists.append(pyfits.open(fn, memmap=True))
+
+        header = hdulists[0][0].header.copy()
+
+        nrows, ncols = get_image_shape(header, file_names[0])
+
+        for i in range(1, len(hdulists)):
+            if get_image_shape(hdulists[i][0].header, file_names[i]) != \
+                (nrows, ncols):
+                raise CombineException("Image %s has a size different from %s." %
+                                       (file_names[i], file_names[0]))
+
+        # Number of rows of each tile to keep bounded the memory used.
+        rows_per_tile = max(1, MAX_TILE_BYTES /
+                            (len(file_names) * ncols *
+                             np.dtype(np.float32).itemsize))
+
+        combined = np.empty((nrows, ncols), dtype=np.float32)
+
+        tile = np.empty((len(file_names), min(rows_per_tile, nrows), ncols),
+                        dtype=np.float32)
+
+        for first_row in range(0, nrows, rows_per_tile):
+            last_row = min(first_row + rows_per_tile, nrows)
+            tile_rows = last_row - first_row
+
+            # Read only the rows of the tile from each image.
+            for i in range(len(hdulists)):
+                tile[i, :tile_rows] = hdulists[i][0].section[first_row:last_row, :]
+
+                if offset is not None:
+                    tile[i, :tile_rows] -= offset[first_row:last_row]
+
+                if scales is not None:
+                    tile[i, :tile_rows] *= scales[i]
+
+            combined[first_row:last_row] = combine_tile(tile[:, :tile_rows],
+                                                        method)
+
+        header[NCOMBINE_KEYWORD] = len(file_names)
+
+    except IOError as ioe:
+        raise CombineException("Error reading images to combine: %s" % (ioe))
+
+    except ValueError as ve:
+        raise CombineException("Error applying the offset to the images: %s" %
+                               (ve))
+
+    finally:
+        for hdul in hdulists:
+            hdul.close()
+
+    return combined, header
@@ -19,6 +19,33 @@
 
 DEFAULT_DIFF_PHOT_FILE_NAME_PREFIX = "diff_mag"
 
+# Modes to place the files when they are organized.
+ORG_MODE_COPY = "copy"
+ORG_MODE_HARDLINK = "hardlink"
+ORG_MODE_REFLINK = "reflink"
+ORG_MODE_SYMLINK = "symlink"
+ORG_MODE_MOVE = "move"
+
+ORG_MODES = [ ORG_MODE_COPY, ORG_MODE_HARDLINK, ORG_MODE_REFLINK, 
+             ORG_MODE_SYMLINK, ORG_MODE_MOVE ]
+
+# Modes where the files organized share their data with the source files, so
+# the changes of their headers are written in a sidecar file.
+ORG_MODES_WITH_SIDECAR = [ ORG_MODE_HARDLINK, ORG_MODE_REFLINK, 
+                          ORG_MODE_SYMLINK ]
+
+# Methods to calculate the FWHM of the images.
+FWHM_METHOD_SEXTRACTOR = "sextractor"
+FWHM_METHOD_NATIVE = "native"
+
+FWHM_METHODS = [ FWHM_METHOD_SEXTRACTOR, FWHM_METHOD_NATIVE ]
+
+# Backends to calculate the photometry.
+PHOT_BACKEND_IRAF = "iraf"
+PHOT_BACKEND_NATIVE = "native"
+
+PHOT_BACKENDS = [ PHOT_BACKEND_IRAF, PHOT_BACKEND_NATIVE ]
+
 # File extensions.
 FIT_FILE_EXT = "fit"
 CATALOG_FILE_EXT = 'cat'
@@ -26,10 +53,12 @@ MAGNITUDE_FILE_EXT = "mag"
 CSV_FILE_EXT = "csv"
 TSV_FILE_EXT = "tsv"
 RDLS_FILE_EXT = "rdls"
+WCS_FILE_EXT = "wcs"
 INDEX_FILE_PATTERN = '-indx.xyls'
 DATA_FINAL_PATTERN = "_final.fit"
 DATA_ALIGN_PATTERN = "_align.fit"
-MAG_CSV_PATTERN = "_mag.csv"
+MAG_NPY_PATTERN = "_mag.npy"
+HEADER_SIDECAR_SUFFIX = ".hdr"
 
 # File name parts delimited.
 FILE_NAME_PARTS_DELIM = "_"
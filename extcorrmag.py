@@ -23,7 +23,6 @@ correction when possible, this is, when there are enough standard stars.
 """
 
 import logging
-import locale
 import numpy as np
 from scipy import stats
 from astropy.time.core import MJD_ZERO
@@ -66,13 +65,13 @@ class ExtinctionCoefficient(object):
 class ExtinctionCoefficientNotCalculated(Exception):
     """To raise when a extinction coefficient could not be calculated."""
     
-    def __init__(self, star_name, filter):
-        self._star_name = star_name
+    def __init__(self, day, filter):
+        self._day = day
         self._filter = filter
         
     def __str__(self):
-        return "No extinction coefficient calculated for star %s and filter %s"\
-                % (self._star_name, self._filter)      
+        return "No extinction coefficient calculated for day %d and filter %s"\
+                % (self._day, self._filter)      
     
 class ExtinctionCoefficientNotFound(Exception):
     """To raise when a extinction coefficient does not exist for a day 
@@ -95,12 +94,7 @@ class ExtCorrMagnitudes(object):
     def __init__(self, inst_mag):
         self._inst_mag = inst_mag
         
-        self._star_names = []     
-        
         self._ec = []     
-
-        for s in inst_mag.stars:            
-            self._star_names.append(s.name)       
         
     def extinction_coefficient(self, day, filter):
         """Returns parameters of the extinction coefficient for a day 
@@ -135,72 +129,86 @@ class ExtCorrMagnitudes(object):
         
         return slope, intercept
     
-    def calc_one_ext_coeff(self, ins_mag_for_std):
+    def get_std_mags(self, rows, filter):
+        """Returns the standard magnitudes of the stars of the rows received.
+        
+        Args:
+            rows: Rows of the table of magnitudes.
+            filter: The filter of the magnitudes.
+            
+        Returns:
+            The standard magnitude for each row, NaN if it is not known.
+        
+        """
+        
+        std_mags = np.empty(len(rows))
+        std_mags[:] = np.nan
+        
+        table = self._inst_mag.magnitudes
+        
+        for star in self._inst_mag.std_stars:
+            star_rows = np.in1d(rows, table.select(star.name))
+            
+            if star_rows.any():
+                try:
+                    std_mags[star_rows] = \
+                        float(self._inst_mag.get_std_mag(star.name, filter))
+                except starsset.NoStdStarException as nsse:
+                    logging.error(nsse)
+                except starsset.NoFilterFoundForStdStarException as nffse:         
+                    logging.error(nffse)
+                    
+        return std_mags
+    
+    def calc_one_ext_coeff(self, rows, day, filter):
         """Calculates the extinction coefficient using the data received.
         
         Args:
-            ins_mag_for_std: Instrumental magnitudes of standard stars used
+            rows: Rows of the table of magnitudes of the standard stars used
             to calculate the linear regression for the extinction coefficient.
+            day: The day of the magnitudes.
+            filter: The filter of the magnitudes.
         
         Returns:        
             The extinction coefficient calculated.
         
         """
         
-        star_name = None
-        filter = None
+        table = self._inst_mag.magnitudes
         
-        # Get the standard standard magnitudes for this instrumental ones.
-        for m in ins_mag_for_std:
-            
-            # These values are the same for all the iterations.
-            star_name = m.star_name
-            filter = m.filter
-                                
-            try:
-                m.std_mag = self._inst_mag.get_std_mag(star_name, filter)
-            except starsset.NoStdStarException as nsse:
-                logging.error(nsse)
-            except starsset.NoFilterFoundForStdStarException as nffse:         
-                logging.error(nffse)
-    
-        # Create a numpy array with the data received.
-        a = np.array([[locale.atof(m.mjd), \
-                       locale.atof(m.mag), \
-                       locale.atof(m.airmass), \
-                       m.std_mag] \
-                      for m in ins_mag_for_std \
-                      if m.mag != INDEF_VALUE])
-        
-        # Sort the data by MJD time.
-        na = a[a[:,0].argsort()]        
-        
-        # Extract the columns necessary to calculate the linear regression.
-        inst_mag = na[:,1]
-        airmass = na[:,2]        
-        std_mag = na[:,3]
+        std_mag = self.get_std_mags(rows, filter)
+        
+        inst_mag = table.column(table.MAG_FIELD, rows)
+        airmass = table.column(table.AIRMASS_FIELD, rows)
+        
+        valid = np.isfinite(inst_mag) & np.isfinite(std_mag) & \
+            np.isfinite(airmass)
+        
+        if np.sum(valid) < 2:
+            raise ExtinctionCoefficientNotCalculated(day, filter)
         
         # The calculation is:
         # Minst = m + K * airmass
         # Where K is the regression coefficient    
         
         # So, subtract these columns to get the y.
-        y = inst_mag.astype(np.float) - std_mag.astype(np.float)
+        y = inst_mag[valid] - std_mag[valid]
     
         # Calculate a linear regression.
         slope, intercept, r_value, p_value, std_err = \
-            stats.linregress(airmass.astype(np.float), y)
+            stats.linregress(airmass[valid], y)
             
         # Check if the calculation returns invalid values.
         if np.isnan(slope) or np.isnan(intercept) or \
             np.isnan(r_value) or np.isnan(p_value): 
                
-            raise ExtinctionCoefficientNotCalculated(star_name, filter)
+            raise ExtinctionCoefficientNotCalculated(day, filter)
         else:                    
-            logging.info("Linear regression for day: %.10g star: %s with filter: %s slope: %.10g intercept %.10g r-value: %.10g p-value: %.10g std_err: %.10g air mass min: %.10g air mass max: %.10g using %d values" %
-                         (a[0][0], star_name, filter, 
+            logging.info("Linear regression for day: %d with filter: %s slope: %.10g intercept %.10g r-value: %.10g p-value: %.10g std_err: %.10g air mass min: %.10g air mass max: %.10g using %d values" %
+                         (day, filter, 
                           slope, intercept, r_value, p_value, std_err, 
-                          np.min(na[:,2]), np.max(na[:,2]), na.size))       
+                          np.min(airmass[valid]), np.max(airmass[valid]), 
+                          len(y)))       
             
         return slope, intercept
     
@@ -208,21 +216,13 @@ class ExtCorrMagnitudes(object):
         """Collect the data necessary to calculate extinction coefficients,
         this is, the magnitudes for the standard stars.
         
-        """
-        
-        # To store all the data necessary to calculate extinction coefficients.
-        magnitudes_collected = []
+        Returns:
+            The rows of the table of magnitudes of the standard stars.
         
-        # Process each standard star.
-        for star in self._inst_mag.std_stars:  
-                        
-            # Retrieve the instrumental magnitudes of current star.
-            mag_of_star = self._inst_mag.get_mags_of_star(star.name)
-                
-            # Add the magnitudes to the set.
-            magnitudes_collected.extend(mag_of_star)
+        """
         
-        return magnitudes_collected
+        return self._inst_mag.magnitudes.select([s.name for s in 
+                                                 self._inst_mag.std_stars])
 
     def calculate_extinction_coefficients(self):
         """Get the extinction coefficient using the standard stars.
@@ -235,6 +235,8 @@ class ExtCorrMagnitudes(object):
             calculation and the filters. 
         """
         
+        table = self._inst_mag.magnitudes
+        
         mag_to_calc_ext_coef = self.collect_mag_to_calc_ext_coef()
     
         # If there is any data to calculate extinction coefficient.
@@ -245,13 +247,14 @@ class ExtCorrMagnitudes(object):
                               % (d, len(mag_to_calc_ext_coef)))
                 
                 for f in self._inst_mag.filters:
-                    mag = [m for m in mag_to_calc_ext_coef \
-                           if m.day == d and  m.filter == f]
+                    mag = np.intersect1d(mag_to_calc_ext_coef, 
+                                         table.select(filter_name=f, day=d))
                     
                     # Check there is enough data for calculation.
                     if len(mag) > ExtinctionCoefficient.MIN_NUM_STD_MEASURES:
                         try:
-                            slope, intercept = self.calc_one_ext_coeff(mag)
+                            slope, intercept = \
+                                self.calc_one_ext_coeff(mag, d, f)
                             
                             # Check that relation between magnitude and air 
                             # mass is direct, otherwise the calculation has 
@@ -268,8 +271,8 @@ class ExtCorrMagnitudes(object):
                             logging.error(ecnc)         
                             print ecnc         
                     else:
-                        logging.warning("There is not enough  data to calculate extinction coefficient on day %s for filter "
-                                        % (f))
+                        logging.warning("There is not enough  data to calculate extinction coefficient on day %s for filter %s"
+                                        % (d, f))
         else:
             logging.warning("There is not enough data to " +
                             "calculate extinction coefficients")      
@@ -278,42 +281,20 @@ class ExtCorrMagnitudes(object):
         """Apply the extinction coefficients calculated to the stars to 
         calculate its corrected magnitudes.      
         
-        Returns:
-            The magnitudes that could be corrected for extinction using the 
-            coefficients previously calculated.        
+        The magnitudes without extinction coefficient for their day and 
+        filter, or undefined, are not corrected.
         
         """   
         
-        # Process the instrumental magnitudes measured for each star.
-        for star in self._inst_mag.stars:
+        table = self._inst_mag.magnitudes
+        
+        for ec in self._ec:
+            rows = table.select(filter_name=ec.filter, day=ec.day)
             
-            # Walk instrumental magnitudes of current star.
-            for im in self._inst_mag.get_mags_of_star(star.name):
-                
-                star_index = self._star_names.index(star.name)
-                
-                # Check if the instrumental magnitude is defined.
-                if im.mag != INDEF_VALUE :
-                
-                    # Find the coefficients by day and filter.
-                    day = get_day_from_mjd(im.mjd)
-                    filter = im.filter
-                    
-                    try:
-                        slope, intercept = \
-                            self.extinction_coefficient(day, filter)
-
-                        # Calculate the extinction corrected magnitude.
-                        # Mo = Minst - intercept - slope * airmass
-                        ext_corr_mag = (float(im.mag) - 
-                                        intercept - 
-                                        slope * float(im.airmass))
-                        
-                        im.ext_cor_mag = ext_corr_mag
-                        
-                    except ExtinctionCoefficientNotFound as e:
-                        logging.debug(e)
+            # Calculate the extinction corrected magnitude, it is undefined 
+            # if the instrumental magnitude is undefined.
+            # Mo = Minst - intercept - slope * airmass
+            ext_corr_mag = table.column(table.MAG_FIELD, rows) - \
+                ec.intercept - ec.slope * table.column(table.AIRMASS_FIELD, rows)
                         
-                else:
-                    logging.debug("Found an instrumental magnitude undefined for star %s"
-                                  % (star.name))       
\ No newline at end of file
+            table.set_column(table.EXT_COR_MAG_FIELD, rows, ext_corr_mag)
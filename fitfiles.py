@@ -23,6 +23,7 @@ import os
 import logging
 import pyfits
 import fitsheader
+import headerindex
 from constants import *
 
 # First index for a FIT table.
@@ -31,6 +32,25 @@ FIT_FIRST_TABLE_INDEX = 1
 XBINNING_FIELD_NAME = "XBINNING"
 YBINNING_FIELD_NAME = "YBINNING"
 
+# Keywords of the header related to the scaling of the data.
+SCALING_KEYWORDS = [ "BZERO", "BSCALE" ]
+
+# Structure of the header of a FIT file.
+FIT_BLOCK_SIZE = 2880
+FIT_CARD_SIZE = 80
+FIT_KEYWORD_SIZE = 8
+FIT_VALUE_INDICATOR = "= "
+FIT_FIRST_KEYWORD = "SIMPLE"
+FIT_END_KEYWORD = "END"
+FIT_HIERARCH_KEYWORD = "HIERARCH"
+FIT_STRING_QUOTE = "'"
+FIT_COMMENT_SEPARATOR = "/"
+FIT_TRUE_VALUE = "T"
+FIT_FALSE_VALUE = "F"
+
+# Character to separate the keyword from its value in a header sidecar file.
+HEADER_SIDECAR_SEP = "="
+
 BIAS_TYPE = "BIAS"
 FLAT_TYPE = "FLAT"
 
@@ -61,6 +81,254 @@ def search_filter_from_set_in_file_name(filename):
     
     return filtername 
 
+def parse_card_value(value_field):
+    """Returns the value of a card of a FIT header.
+    
+    Args:
+        value_field: The text of the card after the value indicator.
+        
+    Returns:
+        The value of the card as string, boolean, integer or float, or None 
+        if the value is undefined or of other type.
+        
+    """
+    
+    value = None
+    
+    text = value_field.lstrip()
+    
+    if text.startswith(FIT_STRING_QUOTE):
+        
+        # Two consecutive quotes represent a quote inside the string.
+        chars = []
+        i = 1
+        
+        while i < len(text):
+            if text[i] == FIT_STRING_QUOTE:
+                if text[i + 1:i + 2] == FIT_STRING_QUOTE:
+                    chars.append(FIT_STRING_QUOTE)
+                    i += 1
+                else:
+                    break
+            else:
+                chars.append(text[i])
+                
+            i += 1
+            
+        # The trailing spaces of a string are not significant.
+        value = "".join(chars).rstrip()
+    else:
+        text = text.split(FIT_COMMENT_SEPARATOR)[0].strip()
+        
+        if text == FIT_TRUE_VALUE:
+            value = True
+        elif text == FIT_FALSE_VALUE:
+            value = False
+        elif text:
+            try:
+                value = int(text)
+            except ValueError:
+                try:
+                    value = float(text.replace("D", "E"))
+                except ValueError:
+                    logging.debug("Value of header card not supported: %s" %
+                                  (text))
+                
+    return value
+
+def parse_card(card):
+    """Returns the keyword and the value of a card of a FIT header.
+    
+    Args:
+        card: The text of the card.
+        
+    Returns:
+        The keyword and the value of the card, the value is None if the card
+        has not a value.
+        
+    """
+    
+    keyword = card[:FIT_KEYWORD_SIZE].strip()
+    value = None
+    
+    if keyword == FIT_HIERARCH_KEYWORD:
+        # The keyword is the text until the value indicator.
+        index = card.find(FIT_VALUE_INDICATOR.strip(), FIT_KEYWORD_SIZE)
+        
+        if index > 0:
+            keyword = card[FIT_KEYWORD_SIZE:index].strip()
+            value = parse_card_value(card[index + 1:])
+            
+    elif card[FIT_KEYWORD_SIZE:FIT_KEYWORD_SIZE + \
+              len(FIT_VALUE_INDICATOR)] == FIT_VALUE_INDICATOR:
+        value = parse_card_value(card[FIT_KEYWORD_SIZE + \
+                                      len(FIT_VALUE_INDICATOR):])
+        
+    return keyword, value
+
+def read_header_from_file(fit_file_name):
+    """Reads the header of the first hdu of the fit file indicated.
+    
+    Only the blocks of the header are read, until the END card is found, so
+    the data of the image is not read. The cards without value, as COMMENT 
+    or HISTORY, are not returned.
+    
+    Args:
+        fit_file_name: Name of the fit file.
+        
+    Returns:
+        A dictionary with the values of the header.
+        
+    Raises:
+        IOError if the file cannot be read or it is not a fit file.
+        
+    """
+    
+    header = {}
+    
+    end_found = False
+    
+    with open(fit_file_name, "rb") as fit_file:
+        
+        block = fit_file.read(FIT_BLOCK_SIZE)
+        
+        if not block.startswith(FIT_FIRST_KEYWORD):
+            raise IOError("File %s is not a fit file." % (fit_file_name))
+        
+        while len(block) == FIT_BLOCK_SIZE and not end_found:
+            
+            for i in range(0, FIT_BLOCK_SIZE, FIT_CARD_SIZE):
+                keyword, value = parse_card(block[i:i + FIT_CARD_SIZE])
+                
+                if keyword == FIT_END_KEYWORD:
+                    end_found = True
+                    break
+                
+                # If a keyword is repeated its first value is used.
+                if value is not None and not keyword in header:
+                    header[keyword] = value
+                    
+            if not end_found:
+                block = fit_file.read(FIT_BLOCK_SIZE)
+            
+    if not end_found:
+        raise IOError("Header of file %s is not complete." % (fit_file_name))
+            
+    return header
+
+def read_header(fit_file_name):
+    """Returns the header of the first hdu of the fit file indicated.
+    
+    If there is an index of headers, the header is taken from the index when
+    the file has not changed, otherwise the header is read from the file and
+    stored in the index.
+    
+    Args:
+        fit_file_name: Name of the fit file.
+        
+    Returns:
+        A dictionary with the values of the header.
+        
+    Raises:
+        IOError if the file cannot be read.
+        
+    """
+    
+    header = None
+    
+    header_index = headerindex.get_header_index()
+    
+    if header_index is not None:
+        header = header_index.get_header(fit_file_name)
+        
+    if header is None:
+        header = read_header_from_file(fit_file_name)
+        
+        if header_index is not None:
+            header_index.put_header(fit_file_name, header)
+            
+    # The values of the sidecar file, if any, replace those of the file.
+    header.update(read_header_sidecar(fit_file_name))
+            
+    return header
+
+def header_sidecar_name(fit_file_name):
+    """Returns the name of the sidecar file with the changes of the header of
+    the fit file indicated.
+    
+    Args:
+        fit_file_name: Name of the fit file.
+        
+    Returns:
+        The name of the sidecar file.
+        
+    """
+    
+    return fit_file_name + HEADER_SIDECAR_SUFFIX
+
+def read_header_sidecar(fit_file_name):
+    """Reads the changes of the header of the fit file indicated that are
+    stored in its sidecar file.
+    
+    The sidecar file contains a keyword and its value in each line, separated
+    by an equal character. The values are strings.
+    
+    Args:
+        fit_file_name: Name of the fit file.
+        
+    Returns:
+        A dictionary with the values of the sidecar, empty if there is not a
+        sidecar file.
+        
+    """
+    
+    values = {}
+    
+    sidecar_name = header_sidecar_name(fit_file_name)
+    
+    if os.path.exists(sidecar_name):
+        try:
+            with open(sidecar_name, "r") as fr:
+                for line in fr:
+                    keyword, sep, value = line.partition(HEADER_SIDECAR_SEP)
+                    
+                    if sep:
+                        values[keyword.strip()] = value.strip()
+                        
+        except IOError as ioe:
+            logging.error("Error reading header sidecar file: %s" % 
+                          (sidecar_name))
+            logging.error("Error is: %s" % (ioe))
+            
+    return values
+
+def write_header_sidecar(fit_file_name, values):
+    """Writes in the sidecar file of the fit file indicated the changes of 
+    its header, keeping those written previously.
+    
+    Args:
+        fit_file_name: Name of the fit file.
+        values: Dictionary with the keywords and values to write.
+        
+    """
+    
+    sidecar_values = read_header_sidecar(fit_file_name)
+    
+    sidecar_values.update(values)
+    
+    sidecar_name = header_sidecar_name(fit_file_name)
+    
+    try:
+        with open(sidecar_name, "w") as fw:
+            for keyword in sorted(sidecar_values.keys()):
+                fw.write("%s %s %s\n" % (keyword, HEADER_SIDECAR_SEP, 
+                                         sidecar_values[keyword]))
+                
+    except IOError as ioe:
+        logging.error("Error writing header sidecar file: %s" % 
+                      (sidecar_name))
+        logging.error("Error is: %s" % (ioe))
+
 def get_fit_fields(fit_file_name, fields):
     """Retrieves the fields of the fit header from the file indicated.
     
@@ -80,21 +348,16 @@ def get_fit_fields(fit_file_name, fields):
     header_fields = {}        
     
     try:
-        # Open FIT file.
-        hdulist = pyfits.open(fit_file_name)
-        
         # Get header of first hdu, only one hdu is used.
-        header = hdulist[0].header
+        header = read_header(fit_file_name)
         
         # For all the header fields of interest.
         for f in fields:
             
             # Retrieve and store the value of this field if possible.
-            if f in header.keys():
+            if f in header:
                 header_fields[f] = header[f]
         
-        hdulist.close()
-        
     except IOError as ioe:
         logging.error("Error reading fit file: '%s'. Error is: %s." % 
                       (fit_file_name, ioe))
@@ -269,18 +532,14 @@ def get_file_binning(fit_file_name):
     header_fields = {}        
     
     try:
-        # Open FIT file.
-        hdulist = pyfits.open(fit_file_name)
-        
         # Get header of first hdu, only one hdu is used.
-        header = hdulist[0].header
+        header = read_header(fit_file_name)
         
         xbin = header[XBINNING_FIELD_NAME]
         ybin = header[YBINNING_FIELD_NAME]    
         
         bin = str(xbin) + "x" + str(ybin)    
         
-        hdulist.close() 
     except IOError as ioe:
         logging.error("Error reading fit file '%s'. Error is: %s" % 
                       (fit_file_name, ioe))
@@ -293,42 +552,38 @@ def get_file_binning(fit_file_name):
     return bin
 
 def get_fit_table_data(fit_table_file_name):
-    """Get the data of a the first table contained in the fit file indicated.
+    """Get the data of the first two columns of the first table contained in 
+    the fit file indicated.
+    
+    The columns are returned as the arrays of the table, memory mapped when
+    possible, without copying the data.
     
     Args:
         fit_table_file_name: File name of the fit file that contains the table.
     
     Returns:
-        The table contained in the fit file.
+        A tuple with the arrays of the first two columns of the table.
         
     """
     
-    ldata = None
+    columns = None
     
     try:
         # Open the FITS file received.
-        fit_table_file = pyfits.open(fit_table_file_name) 
+        fit_table_file = pyfits.open(fit_table_file_name, memmap=True) 
     
         # Assume the first extension is a table.
         table_data = fit_table_file[FIT_FIRST_TABLE_INDEX].data    
         
-        fit_table_file.close()
-        
-        # Convert data from fits table to a list.
-        ldata = list()
+        columns = (table_data.field(0), table_data.field(1))
         
-        # To add an index to the rows.
-        n = 1
-        
-        # Read the table data and save it in a list.
-        for row in table_data:
-            ldata.append([row[0], row[1]])
-            n += 1
+        # The arrays remain valid after closing the file.
+        fit_table_file.close()
         
     except IOError as ioe:
         logging.error("Opening file: '%s'." % fit_table_file_name)            
     
-    return ldata
+    return columns
 
 def get_header_value(file_name, field):
     """Returns the value of a field in the header of a FIT file.
@@ -346,12 +601,7 @@ def get_header_value(file_name, field):
     
     # Get value of the field.
     try:
-        # Open FIT file.
-        hdulist = pyfits.open(file_name)   
-             
-        value = hdulist[0].header[field].strip()
-        
-        hdulist.close()  
+        value = read_header(file_name)[field].strip()
         
         logging.debug("Star %s identified for file %s." %
                       (value, file_name))
@@ -382,4 +632,23 @@ def get_star_name_from_file_name(file_name):
     
     # Get the star name from the filename, the name is at 
     # the beginning and separated by a special character.
-    return file.split(DATANAME_CHAR_SEP)[0]    
\ No newline at end of file
+    return file.split(DATANAME_CHAR_SEP)[0]    
+
+def write_image_data(file_name, data, header):
+    """Writes the data of an image to a new fit file using the header received.
+    
+    The data is written as is, so the keywords of the header related to the 
+    scaling of the data are removed.
+    
+    Args:
+        file_name: Name of the file to write.
+        data: The data of the image.
+        header: The header for the image.
+        
+    """
+    
+    for keyword in SCALING_KEYWORDS:
+        if keyword in header:
+            del header[keyword]
+            
+    pyfits.writeto(file_name, data, header)
\ No newline at end of file
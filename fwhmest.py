@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module estimates the FWHM of an astronomical image without executing
+sextractor.
+
+The stars are taken from the positions of the catalog of the image. For each
+position the peak is searched in a small box around it and a cutout centered
+on the peak is extracted. A gaussian profile is fitted to the pixels of the
+cutout over the noise, fitting a line to the logarithm of the values as a
+function of the square of the distance to the centroid, whose slope gives the
+width of the gaussian.
+
+The FWHM of the image is calculated from the FWHM of the stars using the same
+statistics used for the FWHM calculated by sextractor.
+
+"""
+
+import logging
+import numpy as np
+import pyfits
+from astromatics import get_fwhm_of_values
+from constants import *
+
+# Half size in pixels of the box to search the peak around a position.
+PEAK_SEARCH_HALF_SIZE = 3
+
+# Half size in pixels of the cutout around each peak.
+CUTOUT_HALF_SIZE = 7
+
+# Number of standard deviations over the background of the pixels fitted.
+FIT_NUM_SIGMAS = 5.0
+
+# Minimum signal to noise ratio of the peak of a star to be fitted.
+MIN_PEAK_SNR = 10.0
+
+# Minimum number of pixels to fit the profile of a star.
+MIN_PIXELS_TO_FIT = 5
+
+# Resolution in pixels of the FWHM of the stars, so a mode could be found.
+FWHM_RESOLUTION = 0.1
+
+# Ratio between the FWHM and the standard deviation of a gaussian.
+GAUSSIAN_FWHM_FACTOR = 2.0 * np.sqrt(2.0 * np.log(2.0))
+
+# Columns of the positions in the catalog files.
+CATALOG_X_COL = 0
+CATALOG_Y_COL = 1
+
+def read_catalog_positions(catalog_file_name):
+    """Reads the positions of the stars of a catalog file.
+
+    Args:
+        catalog_file_name: Name of the catalog file.
+
+    Returns:
+        The x and y coordinates of the stars, using the FIT convention where
+        the first pixel is 1.
+
+    Raises:
+        IOError if the catalog cannot be read.
+
+    """
+
+    positions = np.loadtxt(catalog_file_name,
+                           usecols=(CATALOG_X_COL, CATALOG_Y_COL), ndmin=2)
+
+    return positions[:, 0], positions[:, 1]
+
+def get_boxes(data, rows, cols, half_size):
+    """Returns the boxes of the data centered on the pixels received.
+
+    Args:
+        data: The data of the image.
+        rows: Rows of the centers of the boxes.
+        cols: Columns of the centers of the boxes.
+        half_size: Half size of the boxes.
+
+    Returns:
+        An array with a box for each center and the offsets of the rows and
+        columns of the boxes from their centers.
+
+    """
+
+    offsets = np.arange(-half_size, half_size + 1)
+
+    boxes = data[rows[:, np.newaxis, np.newaxis] +
+                 offsets[np.newaxis, :, np.newaxis],
+                 cols[:, np.newaxis, np.newaxis] +
+                 offsets[np.newaxis, np.newaxis, :]]
+
+    return boxes, offsets
+
+def find_peaks(data, x, y):
+    """Returns the pixels of the peaks near the positions received.
+
+    The positions too close to the borders of the image are discarded.
+
+    Args:
+        data: The data of the image.
+        x: X coordinates of the positions, the first pixel is 1.
+        y: Y coordinates of the positions, the first pixel is 1.
+
+    Returns:
+        The rows and columns of the peaks, empty if no position is inside
+        the image.
+
+    """
+
+    rows = np.round(np.asarray(y) - 1.0).astype(int)
+    cols = np.round(np.asarray(x) - 1.0).astype(int)
+
+    margin = PEAK_SEARCH_HALF_SIZE + CUTOUT_HALF_SIZE
+
+    inside = (rows >= margin) & (rows < data.shape[0] - margin) & \
+        (cols >= margin) & (cols < data.shape[1] - margin)
+
+    rows = rows[inside]
+    cols = cols[inside]
+
+    if len(rows) > 0:
+        boxes, offsets = get_boxes(data, rows, cols, PEAK_SEARCH_HALF_SIZE)
+
+        max_pos = boxes.reshape(len(rows), -1).argmax(axis=1)
+
+        rows = rows + offsets[max_pos // len(offsets)]
+        cols = cols + offsets[max_pos % len(offsets)]
+
+    return rows, cols
+
+def fit_stars_fwhm(data, rows, cols):
+    """Calculates the FWHM of the stars whose peaks are received fitting a
+    gaussian profile to a cutout around each one.
+
+    Args:
+        data: The data of the image.
+        rows: Rows of the peaks of the stars.
+        cols: Columns of the peaks of the stars.
+
+    Returns:
+        The FWHM of the stars whose profile could be fitted.
+
+    """
+
+    cutouts, offsets = get_boxes(data, rows, cols, CUTOUT_HALF_SIZE)
+
+    cutouts = cutouts.astype(np.float64)
+
+    # The background and the noise are estimated from the border pixels.
+    border = np.ones((len(offsets), len(offsets)), dtype=bool)
+    border[1:-1, 1:-1] = False
+
+    border_values = cutouts[:, border]
+
+    background = np.median(border_values, axis=1)
+
+    noise = 1.4826 * np.median(np.abs(border_values -
+                                      background[:, np.newaxis]), axis=1)
+
+    values = cutouts - background[:, np.newaxis, np.newaxis]
+
+    fitted = values > FIT_NUM_SIGMAS * noise[:, np.newaxis, np.newaxis]
+
+    valid = (fitted.sum(axis=2).sum(axis=1) >= MIN_PIXELS_TO_FIT) & \
+        (values.max(axis=2).max(axis=1) > MIN_PEAK_SNR * noise)
+
+    values = values[valid]
+    fitted = fitted[valid]
+
+    weights = np.where(fitted, values, 0.0)
+
+    # Centroid of the pixels fitted.
+    total = weights.sum(axis=2).sum(axis=1)
+
+    row_offsets = offsets[np.newaxis, :, np.newaxis]
+    col_offsets = offsets[np.newaxis, np.newaxis, :]
+
+    center_row = (weights * row_offsets).sum(axis=2).sum(axis=1) / total
+    center_col = (weights * col_offsets).sum(axis=2).sum(axis=1) / total
+
+    r2 = (row_offsets - center_row[:, np.newaxis, np.newaxis]) ** 2 + \
+        (col_offsets - center_col[:, np.newaxis, np.newaxis]) ** 2
+
+    # Weighted least squares of the logarithm of the values against r2,
+    # the weights compensate the noise amplified by the logarithm.
+    log_values = np.log(np.where(fitted, values, 1.0))
+
+    w = weights ** 2
+
+    sw = w.sum(axis=2).sum(axis=1)
+    sx = (w * r2).sum(axis=2).sum(axis=1)
+    sy = (w * log_values).sum(axis=2).sum(axis=1)
+    sxx = (w * r2 * r2).sum(axis=2).sum(axis=1)
+    sxy = (w * r2 * log_values).sum(axis=2).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (sw * sxy - sx * sy) / (sw * sxx - sx * sx)
+
+        fwhm = GAUSSIAN_FWHM_FACTOR * np.sqrt(-0.5 / slope)
+
+    return fwhm[np.isfinite(fwhm)]
+
+def estimate_fwhm(image_file_name, catalog_file_name):
+    """Estimates the FWHM of an image from the stars of its catalog.
+
+    Args:
+        image_file_name: Name of the file of the image.
+        catalog_file_name: Name of the catalog with the positions of the stars.
+
+    Returns:
+        The FWHM of the image, or None if it cannot be estimated.
+
+    """
+
+    fwhm = None
+
+    try:
+        x, y = read_catalog_positions(catalog_file_name)
+
+        data = pyfits.getdata(image_file_name)
+
+        rows, cols = find_peaks(data, x, y)
+
+        if len(rows) == 0:
+            logging.warning("No stars of catalog %s inside the image %s to estimate its FWHM." %
+                            (catalog_file_name, image_file_name))
+        else:
+            stars_fwhm = fit_stars_fwhm(data, rows, cols)
+
+            # Round the values so the mode could be found.
+            stars_fwhm = np.round(stars_fwhm / FWHM_RESOLUTION) * \
+                FWHM_RESOLUTION
+
+            fwhm = get_fwhm_of_values(stars_fwhm)
+
+            logging.debug("FWHM estimated for %s from %d stars is: %s" %
+                          (image_file_name, len(stars_fwhm), fwhm))
+
+    except IOError as ioe:
+        logging.error("Error estimating FWHM of %s: %s" %
+                      (image_file_name, ioe))
+
+    except (IndexError, ValueError) as e:
+        logging.error("Invalid catalog %s: %s" % (catalog_file_name, e))
+
+    return fwhm
+
+def get_fwhm_of_images(images_and_catalogs):
+    """Estimates the FWHM of the images received.
+
+    Args:
+        images_and_catalogs: List of pairs of the name of the file of an
+        image and the name of its catalog.
+
+    Returns:
+        A dictionary with the FWHM of each image, None for the images whose
+        FWHM cannot be estimated.
+
+    """
+
+    fwhms = {}
+
+    for image_file_name, catalog_file_name in images_and_catalogs:
+        fwhms[image_file_name] = estimate_fwhm(image_file_name,
+                                               catalog_file_name)
+
+    return fwhms
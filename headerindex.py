@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module stores the headers of the FIT files read in a persistent
+index, so the header of a file is only parsed again when the file changes.
+
+The index is a SQLite database where each header is stored with the path,
+the time of modification and the size of the file. A header stored is used
+only if the time of modification and the size of the file have not changed.
+
+The statistics of the images are also stored in the index in the same way,
+so they are only calculated again when the file changes.
+
+"""
+
+import os
+import logging
+import sqlite3
+import json
+import threading
+
+# Name of the file of the index when no other name is indicated.
+DEFAULT_HEADER_INDEX_FILE_NAME = "headers.db"
+
+# Number of headers stored before committing them to the database.
+HEADERS_PER_COMMIT = 100
+
+CREATE_TABLE_SQL = "CREATE TABLE IF NOT EXISTS headers (" + \
+    "path TEXT PRIMARY KEY, mtime REAL, size INTEGER, header TEXT)"
+
+SELECT_HEADER_SQL = "SELECT mtime, size, header FROM headers WHERE path = ?"
+
+INSERT_HEADER_SQL = "INSERT OR REPLACE INTO headers " + \
+    "(path, mtime, size, header) VALUES (?, ?, ?, ?)"
+
+CREATE_STATS_TABLE_SQL = "CREATE TABLE IF NOT EXISTS statistics (" + \
+    "path TEXT, clipped INTEGER, mtime REAL, size INTEGER, stats TEXT, " + \
+    "PRIMARY KEY (path, clipped))"
+
+SELECT_STATS_SQL = "SELECT mtime, size, stats FROM statistics " + \
+    "WHERE path = ? AND clipped = ?"
+
+INSERT_STATS_SQL = "INSERT OR REPLACE INTO statistics " + \
+    "(path, clipped, mtime, size, stats) VALUES (?, ?, ?, ?, ?)"
+
+# Index used by the current process, if any.
+_header_index = None
+
+class HeaderIndex(object):
+    """Persistent index of the headers of FIT files.
+
+    The same index could be used by several threads, but not shared among
+    processes.
+
+    """
+
+    def __init__(self, file_name):
+        """Constructor.
+
+        Args:
+            file_name: The name of the file of the database.
+
+        Raises:
+            sqlite3.Error if the database cannot be opened.
+
+        """
+
+        self._file_name = file_name
+
+        self._pid = os.getpid()
+
+        self._lock = threading.Lock()
+
+        self._pending = 0
+
+        self._connection = sqlite3.connect(file_name,
+                                           check_same_thread=False)
+
+        self._connection.execute(CREATE_TABLE_SQL)
+
+        self._connection.execute(CREATE_STATS_TABLE_SQL)
+
+        self._connection.commit()
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def pid(self):
+        return self._pid
+
+    def get_header(self, file_name):
+        """Returns the header stored for the file, if the file has not changed
+        since the header was stored.
+
+        Args:
+            file_name: The name of the FIT file.
+
+        Returns:
+            A dictionary with the header of the file, or None if the header
+            is not in the index or the file has changed.
+
+        """
+
+        header = None
+
+        path = os.path.abspath(file_name)
+
+        try:
+            stat = os.stat(path)
+
+            with self._lock:
+                row = self._connection.execute(SELECT_HEADER_SQL,
+                                               (path,)).fetchone()
+
+            if row is not None and row[0] == stat.st_mtime and \
+                row[1] == stat.st_size:
+                header = decode_header(json.loads(row[2]))
+
+        except OSError as oe:
+            logging.debug("Cannot access file %s: %s" % (path, oe))
+
+        except sqlite3.Error as sqle:
+            logging.error("Error reading header of %s from index: %s" %
+                          (path, sqle))
+
+        return header
+
+    def put_header(self, file_name, header):
+        """Stores the header of a file in the index.
+
+        Args:
+            file_name: The name of the FIT file.
+            header: A dictionary with the header of the file.
+
+        """
+
+        path = os.path.abspath(file_name)
+
+        try:
+            stat = os.stat(path)
+
+            with self._lock:
+                self._connection.execute(INSERT_HEADER_SQL,
+                                         (path, stat.st_mtime, stat.st_size,
+                                          json.dumps(header)))
+
+                self._pending += 1
+
+                if self._pending >= HEADERS_PER_COMMIT:
+                    self._connection.commit()
+                    self._pending = 0
+
+        except OSError as oe:
+            logging.debug("Cannot access file %s: %s" % (path, oe))
+
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error("Error storing header of %s in index: %s" %
+                          (path, e))
+
+    def get_statistics(self, file_name, clipped):
+        """Returns the statistics stored for the image of a file, if the file
+        has not changed since the statistics were stored.
+
+        Args:
+            file_name: The name of the FIT file.
+            clipped: Number of standard deviations of the sigma clipping of
+            the statistics, 0 without clipping.
+
+        Returns:
+            A dictionary with the statistics of the image, or None if they
+            are not in the index or the file has changed.
+
+        """
+
+        stats = None
+
+        path = os.path.abspath(file_name)
+
+        try:
+            stat = os.stat(path)
+
+            with self._lock:
+                row = self._connection.execute(SELECT_STATS_SQL,
+                                               (path, clipped)).fetchone()
+
+            if row is not None and row[0] == stat.st_mtime and \
+                row[1] == stat.st_size:
+                stats = decode_header(json.loads(row[2]))
+
+        except OSError as oe:
+            logging.debug("Cannot access file %s: %s" % (path, oe))
+
+        except sqlite3.Error as sqle:
+            logging.error("Error reading statistics of %s from index: %s" %
+                          (path, sqle))
+
+        return stats
+
+    def put_statistics(self, file_name, clipped, stats):
+        """Stores the statistics of the image of a file in the index.
+
+        Args:
+            file_name: The name of the FIT file.
+            clipped: Number of standard deviations of the sigma clipping of
+            the statistics, 0 without clipping.
+            stats: A dictionary with the statistics of the image.
+
+        """
+
+        path = os.path.abspath(file_name)
+
+        try:
+            stat = os.stat(path)
+
+            with self._lock:
+                self._connection.execute(INSERT_STATS_SQL,
+                                         (path, clipped, stat.st_mtime,
+                                          stat.st_size, json.dumps(stats)))
+
+                self._pending += 1
+
+                if self._pending >= HEADERS_PER_COMMIT:
+                    self._connection.commit()
+                    self._pending = 0
+
+        except OSError as oe:
+            logging.debug("Cannot access file %s: %s" % (path, oe))
+
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error("Error storing statistics of %s in index: %s" %
+                          (path, e))
+
+    def close(self):
+        """Commits the headers pending and closes the index."""
+
+        with self._lock:
+            try:
+                self._connection.commit()
+
+            except sqlite3.Error as sqle:
+                logging.error("Error saving header index %s: %s" %
+                              (self._file_name, sqle))
+
+            self._connection.close()
+
+def decode_header(header):
+    """Converts the unicode strings of a header loaded from the index to the
+    type of string used by pyfits.
+
+    Args:
+        header: The dictionary loaded from the index.
+
+    Returns:
+        The header with the strings converted.
+
+    """
+
+    decoded_header = {}
+
+    for key, value in header.items():
+        if isinstance(value, unicode):
+            value = value.encode("ascii", "replace")
+
+        decoded_header[key.encode("ascii", "replace")] = value
+
+    return decoded_header
+
+def open_header_index(file_name):
+    """Opens the index of headers to be used by the current process.
+
+    If the index cannot be opened the headers are read from the files.
+
+    Args:
+        file_name: The name of the file of the index.
+
+    """
+
+    global _header_index
+
+    close_header_index()
+
+    try:
+        _header_index = HeaderIndex(file_name)
+
+        logging.debug("Using header index: %s" % (file_name))
+
+    except sqlite3.Error as sqle:
+        logging.warning("Header index %s cannot be opened, headers will be read from files: %s" %
+                        (file_name, sqle))
+
+def close_header_index():
+    """Closes the index of headers used by the current process, if any."""
+
+    global _header_index
+
+    if _header_index is not None:
+        if _header_index.pid == os.getpid():
+            _header_index.close()
+
+        _header_index = None
+
+def get_header_index():
+    """Returns the index of headers of the current process.
+
+    A process created from the process that opened the index does not use it.
+
+    Returns:
+        The index of headers, or None if there is no index opened.
+
+    """
+
+    header_index = None
+
+    if _header_index is not None and _header_index.pid == os.getpid():
+        header_index = _header_index
+
+    return header_index
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module calculates the statistics of the images.
+
+The statistics calculated are those of imstat: the number of pixels, the
+mean, the standard deviation, the median, the mode, the minimum and the 
+maximum of the finite values of the image. Optionally the values out of a
+number of standard deviations from the mean are rejected iteratively before
+calculating them.
+
+The mode is calculated as imstat does, from a histogram of the values with
+bins of a tenth of the standard deviation, refining the position of the 
+highest bin with a parabola through it and its neighbours.
+
+The statistics of the images are stored in the index of headers, so they are
+calculated only once for each image while it does not change. The worker
+processes do not use the index, the statistics they calculate must be stored
+by the main process.
+
+"""
+
+import logging
+import numpy as np
+import pyfits
+import headerindex
+
+# Names of the statistics.
+STAT_MEAN = "mean"
+STAT_STDDEV = "stddev"
+STAT_MEDIAN = "median"
+STAT_MODE = "mode"
+STAT_MIN = "min"
+STAT_MAX = "max"
+STAT_NPIX = "npix"
+
+# Number of standard deviations from the mean to reject a value, and the
+# maximum number of iterations of the rejection.
+SIGCLIP_NUM_SIGMAS = 3.0
+SIGCLIP_MAX_ITERATIONS = 5
+
+# Width of the bins of the histogram of the mode in standard deviations, and
+# the maximum number of bins.
+MODE_BIN_WIDTH = 0.1
+MODE_MAX_BINS = 1000000
+
+def calculate_mode(values, mean, stddev, min_value, max_value):
+    """Calculates the mode of some values as imstat does.
+
+    When the histogram would have less than three bins, the mode is the mean.
+
+    Args:
+        values: The values.
+        mean: The mean of the values.
+        stddev: The standard deviation of the values.
+        min_value: The minimum of the values.
+        max_value: The maximum of the values.
+
+    Returns:
+        The mode of the values.
+
+    """
+
+    mode = mean
+
+    if stddev > 0.0:
+        nbins = min(int((max_value - min_value) / (MODE_BIN_WIDTH * stddev))
+                    + 1, MODE_MAX_BINS)
+
+        if nbins >= 3:
+            bin_width = (max_value - min_value) / (nbins - 1)
+
+            bins = ((values - min_value) / bin_width).astype(int)
+
+            histogram = np.bincount(np.minimum(bins, nbins - 1),
+                                    minlength=nbins)
+
+            peak = int(histogram.argmax())
+
+            position = float(peak)
+
+            if 0 < peak < nbins - 1:
+                dh1 = histogram[peak] - histogram[peak - 1]
+                dh2 = histogram[peak] - histogram[peak + 1]
+
+                if dh1 + dh2 != 0:
+                    position += 0.5 * (dh1 - dh2) / float(dh1 + dh2)
+
+            mode = min_value + bin_width * position
+
+    return mode
+
+def calculate_statistics(data, clip=False, nsigma=SIGCLIP_NUM_SIGMAS):
+    """Calculates the statistics of the data of an image.
+
+    Args:
+        data: The data of the image.
+        clip: True to reject the values far from the mean.
+        nsigma: Number of standard deviations from the mean to reject a 
+        value.
+
+    Returns:
+        A dictionary with the statistics.
+
+    """
+
+    values = np.ravel(data).astype(np.float64)
+
+    values = values[np.isfinite(values)]
+
+    if clip:
+        for i in range(SIGCLIP_MAX_ITERATIONS):
+            if len(values) == 0:
+                break
+
+            mean = np.mean(values)
+            stddev = np.std(values)
+
+            kept = np.abs(values - mean) <= nsigma * stddev
+
+            if kept.all():
+                break
+
+            values = values[kept]
+
+    stats = { STAT_NPIX: int(len(values)) }
+
+    if len(values) > 0:
+        mean = float(np.mean(values))
+        stddev = float(np.std(values))
+        min_value = float(np.min(values))
+        max_value = float(np.max(values))
+
+        stats[STAT_MEAN] = mean
+        stats[STAT_STDDEV] = stddev
+        stats[STAT_MEDIAN] = float(np.median(values))
+        stats[STAT_MODE] = float(calculate_mode(values, mean, stddev,
+                                                min_value, max_value))
+        stats[STAT_MIN] = min_value
+        stats[STAT_MAX] = max_value
+
+    return stats
+
+def get_clipping_key(clip, nsigma):
+    """Returns the value that identifies the clipping of the statistics in
+    the index.
+
+    Args:
+        clip: True for the statistics calculated rejecting values.
+        nsigma: Number of standard deviations to reject a value.
+
+    Returns:
+        The number of standard deviations, 0 without clipping.
+
+    """
+
+    return nsigma if clip else 0
+
+def get_cached_statistics(file_name, clip=False, nsigma=SIGCLIP_NUM_SIGMAS):
+    """Returns the statistics of the image of a file stored in the index.
+
+    Args:
+        file_name: The name of the file.
+        clip: True for the statistics calculated rejecting values.
+        nsigma: Number of standard deviations to reject a value.
+
+    Returns:
+        A dictionary with the statistics, or None if they are not stored.
+
+    """
+
+    stats = None
+
+    header_index = headerindex.get_header_index()
+
+    if header_index is not None:
+        stats = header_index.get_statistics(file_name, 
+                                            get_clipping_key(clip, nsigma))
+
+    return stats
+
+def store_statistics(file_name, stats, clip=False, nsigma=SIGCLIP_NUM_SIGMAS):
+    """Stores the statistics of the image of a file in the index, if there
+    is an index.
+
+    Args:
+        file_name: The name of the file.
+        stats: A dictionary with the statistics.
+        clip: True for the statistics calculated rejecting values.
+        nsigma: Number of standard deviations to reject a value.
+
+    """
+
+    header_index = headerindex.get_header_index()
+
+    if header_index is not None:
+        header_index.put_statistics(file_name, get_clipping_key(clip, nsigma),
+                                    stats)
+
+def read_image_statistics(file_name, clip=False, nsigma=SIGCLIP_NUM_SIGMAS):
+    """Returns the statistics of the image of a file.
+
+    The statistics are taken from the index if the file has not changed,
+    otherwise they are calculated and stored in the index.
+
+    Args:
+        file_name: The name of the file.
+        clip: True to reject the values far from the mean.
+        nsigma: Number of standard deviations to reject a value.
+
+    Returns:
+        A dictionary with the statistics, or None if the file cannot be read.
+
+    """
+
+    stats = get_cached_statistics(file_name, clip, nsigma)
+
+    if stats is None:
+        try:
+            stats = calculate_statistics(pyfits.getdata(file_name), clip,
+                                         nsigma)
+
+            store_statistics(file_name, stats, clip, nsigma)
+
+        except IOError as ioe:
+            logging.error("Error reading image %s to get its statistics: %s" %
+                          (file_name, ioe))
+
+    return stats
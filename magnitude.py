@@ -34,17 +34,24 @@ import numpy as np
 from constants import *
 from textfiles import *
 import starsset
+import photstore
 from starmag import StarMagnitudes
 from extcorrmag import ExtCorrMagnitudes
 from calibmag import get_calibrated_magnitudes
 
-def get_instrumental_magnitudes(stars, target_dir, data_directoy_name):
+def get_instrumental_magnitudes(stars, target_dir, data_directoy_name, 
+                                nights=None):
     """Receives a list of star and compiles the magnitudes for each star.
     
+    The magnitudes are read from the store of photometry, if there is no 
+    store they are read from the files of photometry of each image.
+    
     Args:
         stars: Features of the stars.
         target_dir: Directory that contains the files to process.
         data_directoy_name: Name of the directories that contains data images.     
+        nights: The nights of the store to read, all if None. The magnitudes
+        of these nights are appended to those already saved.
     
     Returns:        
         A list containing the magnitudes found for each star.
@@ -52,39 +59,47 @@ def get_instrumental_magnitudes(stars, target_dir, data_directoy_name):
     """
     
     star_mags = StarMagnitudes(stars)
+    
+    store = photstore.PhotometryStore(target_dir)
+    
+    if store.exists:
+        logging.debug("Reading magnitudes from the store: %s" % 
+                      (store.store_dir))
         
-    # Walk directories searching for files containing magnitudes.
-    for path,dirs,files in os.walk(target_dir):
+        star_mags.read_store_magnitudes(store, nights)
+    else:
+        # Walk directories searching for files containing magnitudes.
+        for path,dirs,files in os.walk(target_dir):
 
-        # Inspect only directories without subdirectories.
-        if len(dirs) == 0:
-            split_path = path.split(os.sep)
+            # Inspect only directories without subdirectories.
+            if len(dirs) == 0:
+                split_path = path.split(os.sep)
 
-            # Check if current directory is for data.
-            if split_path[-2] == data_directoy_name:
+                # Check if current directory is for data.
+                if split_path[-2] == data_directoy_name:
                
-                logging.debug("Found a directory for data images: %s" % (path))
+                    logging.debug("Found a directory for data images: %s" % (path))
 
-                # Get the list of RDLS files ignoring hidden files 
-                # (starting with dot).
-                mag_files_full_path = \
-                    [f for f in glob.glob(os.path.join(path, "*%s" %
-                                                       (MAG_CSV_PATTERN))) \
-                    if not os.path.basename(f).startswith('.')]
+                    # Get the list of RDLS files ignoring hidden files 
+                    # (starting with dot).
+                    mag_files_full_path = \
+                        [f for f in glob.glob(os.path.join(path, "*%s" %
+                                                           (MAG_NPY_PATTERN))) \
+                        if not os.path.basename(f).startswith('.')]
                     
-                logging.debug("Found %d files with magnitudes." % 
-                              (len(mag_files_full_path)))    
+                    logging.debug("Found %d files with magnitudes." % 
+                                  (len(mag_files_full_path)))    
                 
-                # Sort the list of files to ensure a right processing of MJD.
-                mag_files_full_path.sort()               
+                    # Sort the list of files to ensure a right processing of MJD.
+                    mag_files_full_path.sort()               
                 
-                # Process the images of each star that has a RDLS file.
-                for mag_file in mag_files_full_path:
+                    # Process the images of each star that has a RDLS file.
+                    for mag_file in mag_files_full_path:
                     
-                    # Get the magnitudes for this star in current path.
-                    star_mags.read_inst_magnitudes(mag_file, path)
+                        # Get the magnitudes for this star in current path.
+                        star_mags.read_inst_magnitudes(mag_file, path)
                             
-    star_mags.save_all_mag(target_dir)                            
+    star_mags.save_all_mag(target_dir, nights is not None)
                         
     return star_mags
 
@@ -111,25 +126,96 @@ def correct_extinction_in_magnitudes(inst_mag):
     # coefficients calculated.
     ecm.correct_magnitudes()
                                        
-def process_magnitudes(stars, target_dir, data_directoy_name):
+def get_nights_to_process(target_dir, incremental):
+    """Returns the nights of the store of photometry whose magnitudes must
+    be calculated.
+    
+    Args:
+        target_dir: Directory that contains the files to process.
+        incremental: True to calculate only the magnitudes of the new nights.
+        
+    Returns:
+        The nights to process, or None to process all the nights.
+    
+    """
+    
+    nights = None
+    
+    if incremental:
+        store = photstore.PhotometryStore(target_dir)
+        
+        if store.exists:
+            manifest = photstore.StoreManifest(
+                os.path.join(target_dir, photstore.MANIFEST_FILE_NAME))
+            
+            try:
+                nights = manifest.get_new_nights(store)
+            except (IOError, OSError) as e:
+                logging.error("Error checking the store of photometry: %s" % 
+                              (e))
+            
+            if nights is None:
+                logging.info("Calculating the magnitudes of all the nights.")
+            else:
+                logging.info("Calculating the magnitudes of %d new nights." % 
+                             (len(nights)))
+        else:
+            logging.warning("There is no store of photometry, calculating " +
+                            "the magnitudes of all the images.")
+            
+    return nights
+
+def update_manifest(target_dir):
+    """Updates the manifest with the partitions of the store of photometry
+    whose magnitudes have been calculated.
+    
+    Args:
+        target_dir: Directory that contains the files to process.
+    
+    """
+    
+    store = photstore.PhotometryStore(target_dir)
+    
+    if store.exists:
+        manifest = photstore.StoreManifest(
+            os.path.join(target_dir, photstore.MANIFEST_FILE_NAME))
+        
+        try:
+            manifest.update(store)
+            
+            manifest.save()
+        except (IOError, OSError) as e:
+            logging.error("Error updating the manifest %s: %s" % 
+                          (manifest.file_name, e))
+
+def process_magnitudes(stars, target_dir, data_directoy_name, 
+                       incremental=False):
     """Collect the instrumental magnitudes of all the stars of interest.
     Correct the magnitudes taking into account the atmospheric extinction.
     Get a calibrated magnitude for the stars of interest according to the
     standard magnitudes of the Landolt catalog.
+    
+    In incremental mode only the magnitudes of the nights added to the store
+    of photometry since the last calculation are calculated and appended to
+    the files of magnitudes. The coefficients are calculated by day, so 
+    they are only calculated for the new nights.
 
     Args:
         stars: The list of stars.     
         target_dir: Directory that contains the files to process.
         data_directoy_name: Name of the directories that contains data images. 
+        incremental: True to calculate only the magnitudes of the new nights.
         
     Returns:
         magnitudes: The magnitudes calculated.
     
     """
     
+    nights = get_nights_to_process(target_dir, incremental)
+    
     # Get the instrumental magnitudes for the stars indicated.
     magnitudes = get_instrumental_magnitudes(stars, target_dir, 
-                                             data_directoy_name)
+                                             data_directoy_name, nights)
     
     old_settings = np.seterr(all='ignore', over='warn')
     
@@ -150,6 +236,8 @@ def process_magnitudes(stars, target_dir, data_directoy_name):
     np.seterr(**old_settings)
     
     # Save magnitudes.
-    magnitudes.save_magnitudes(target_dir)
+    magnitudes.save_magnitudes(target_dir, nights is not None)
+    
+    update_manifest(target_dir)
     
     return magnitudes
\ No newline at end of file
@@ -37,13 +37,77 @@ import os
 import logging
 import yargparser
 import shutil
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
 import pyfits
-from astropy.time import Time
 import textfiles
+import imgstats
+from utility import get_nights_from_dates
 from fitsheader import *
 from fitfiles import *
 from constants import *
 
+# Maximum number of files of a directory organized in the same task.
+FILES_PER_TASK = 64
+
+# scandir is provided by os since Python 3.5, previous versions could use the
+# scandir package, without any of them os.walk is used.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+def scan_leaf_directories(source_dir):
+    """Returns the directories without subdirectories found from the source
+    directory, and the files contained in each one.
+    
+    The directories are scanned as the results are requested, so the 
+    processing of a directory could start before the scanning ends.
+    
+    Args:
+        source_dir: The directory to scan.
+        
+    Returns:
+        A generator of tuples with the path of a directory and the names of 
+        its files.
+    
+    """
+    
+    if scandir is None:
+        for path, dirs, files in os.walk(source_dir):
+            if len(dirs) == 0:
+                yield path, files
+    else:
+        has_subdirs = False
+        dirs = []
+        files = []
+        
+        try:
+            for entry in scandir(source_dir):
+                if entry.is_dir():
+                    has_subdirs = True
+                    
+                    # As os.walk, links to directories are not followed.
+                    if not entry.is_symlink():
+                        dirs.append(entry.path)
+                else:
+                    files.append(entry.name)
+                    
+        except OSError as oe:
+            logging.error("Error scanning directory: %s" % (source_dir))
+            logging.error("Error is: %s" % (oe))
+            
+        if not has_subdirs:
+            yield source_dir, files
+        else:
+            for d in dirs:
+                for leaf in scan_leaf_directories(d):
+                    yield leaf
+
 class Filters(object):
     """Stores the filters that should be taking into account when processing
     images.
@@ -140,12 +204,21 @@ class OrganizeFIT(object):
         self._stars = stars
         self._header_fields = header_fields
         self._filters = filters
+        
+        # Directories already created or found, the same directory could be
+        # requested at the same time by several threads.
+        self._directories = set()
+        self._directories_lock = threading.Lock()
+        
+        # Source of each file moved, to return the images discarded.
+        self._moved_files = {}
                 
     def create_directory(self, dir_name):
         """ Create a directory with the given name. 
         
         This function creates a directory with the given name located in the
-        path received.
+        path received. The directories created are remembered to not check
+        them again.
         
         Args: 
             dir_name: Directory to create.
@@ -155,16 +228,21 @@ class OrganizeFIT(object):
         
         """
     
-        # Check if the directory exists.
-        if not os.path.exists(dir_name):
-            
-            try: 
-                logging.debug("Creating directory: %s" % (dir_name))
-                os.makedirs(dir_name)
+        with self._directories_lock:
+            if not dir_name in self._directories:
                 
-            except OSError:
-                if not os.path.isdir(dir_name):
-                    raise                
+                # Check if the directory exists.
+                if not os.path.exists(dir_name):
+                    
+                    try: 
+                        logging.debug("Creating directory: %s" % (dir_name))
+                        os.makedirs(dir_name)
+                        
+                    except OSError:
+                        if not os.path.isdir(dir_name):
+                            raise
+                        
+                self._directories.add(dir_name)
                 
     def get_star_name(self, full_file_name, file_header):
         """Returns the name of the star, from the header if possible, otherwise
@@ -216,6 +294,64 @@ class OrganizeFIT(object):
             logging.error("Error updating fit file '%s'. Error is: %s." % 
                           (file_name, ioe))            
         
+    def place_file(self, source_file_name, file_destination):
+        """Places a file in its destination according to the mode of 
+        organization requested.
+        
+        If a hard link or a reflink cannot be created, the file is copied.
+        
+        Args:
+            source_file_name: The name of the file to place.
+            file_destination: The name of the destination of the file.
+            
+        """
+        
+        org_mode = self._progargs.organization_mode
+        
+        source_file_name = os.path.abspath(source_file_name)
+        file_destination = os.path.abspath(file_destination)
+        
+        # Remove the file placed by a previous run and its header changes.
+        for f in [ file_destination, header_sidecar_name(file_destination) ]:
+            if os.path.lexists(f):
+                os.remove(f)
+        
+        logging.debug("Placing '%s' to '%s' using %s" % 
+                      (source_file_name, file_destination, org_mode))
+        
+        if org_mode == ORG_MODE_HARDLINK:
+            try:
+                os.link(source_file_name, file_destination)
+                
+            except OSError as oe:
+                logging.warning("Hard link cannot be created for '%s', copying it. Error is: %s" %
+                                (source_file_name, oe))
+                
+                shutil.copy(source_file_name, file_destination)
+                
+        elif org_mode == ORG_MODE_REFLINK:
+            with open(os.devnull, "w") as devnull:
+                result = subprocess.call(["cp", "--reflink=always",
+                                          source_file_name, file_destination], 
+                                         stderr=devnull)
+                
+            if result != 0:
+                logging.warning("Reflink cannot be created for '%s', copying it." %
+                                (source_file_name))
+                
+                shutil.copy(source_file_name, file_destination)
+                
+        elif org_mode == ORG_MODE_SYMLINK:
+            os.symlink(source_file_name, file_destination)
+            
+        elif org_mode == ORG_MODE_MOVE:
+            shutil.move(source_file_name, file_destination)
+            
+            self._moved_files[file_destination] = source_file_name
+            
+        else:
+            shutil.copy(source_file_name, file_destination)
+        
     def update_image_type(self, file_name, file_header):
         """ Try to fill the image type from the name of the file using the
         convention used in OSN (Observatorio de Sierra Nevada).
@@ -295,7 +431,7 @@ class OrganizeFIT(object):
             
         return file_header    
 
-    def analyze_and_copy_file(self, path, filename):
+    def analyze_and_copy_file(self, path, filename, file_header, mjd_at_noon):
         """Establish the type of the file and copies it to the appropriate 
         directory. 
         
@@ -308,6 +444,8 @@ class OrganizeFIT(object):
         Args:     
             path: Path where is the file.         
             filename: Name of the file to analyze.  
+            file_header: The fields of the header of the file.
+            mjd_at_noon: The number of the night of the file.
             
         Returns:
             The name of the target directory created, if any.
@@ -318,19 +456,15 @@ class OrganizeFIT(object):
         
         star_name = None
         
+        is_flat = False
+        
         # Some file names have suffixes delimited by dots that will be ignored 
         # to save the destiny file.    
         destiny_filename = remove_prefixes(filename)            
     
         full_file_name = os.path.join(path, filename)
-    
-        # Get the headers of the file.  
-        file_header = get_fit_fields(full_file_name, 
-                                     self._header_fields.header_fields_names)
         
         # Get the name for the target directory where to copy the file.
-        mjd_at_noon = self.get_mjd_from_noon(full_file_name, file_header)   
-        
         target_dir = os.path.join(self._progargs.target_dir, str(mjd_at_noon))        
         
         logging.debug("Analyzing file %s to be copied to %s" % 
@@ -389,6 +523,8 @@ class OrganizeFIT(object):
                         file_destination = os.path.join(flat_dir, 
                                                         destiny_filename)
                         
+                        is_flat = True
+                        
                 else:
                     logging.error("File identified as flat hasn't FILTER field: %s" %
                                   full_file_name)
@@ -432,18 +568,26 @@ class OrganizeFIT(object):
             logging.debug("Image type undefined for file '%s', discarded."
                           % (full_file_name))
     
-        # Determines if the file must be copied.
+        # Determines if the file must be placed in the target directory.
         if file_destination:
             
-            logging.debug("Copying '%s' to '%s'" % 
-                          (full_file_name, file_destination))
-    
-            shutil.copy(os.path.abspath(full_file_name),
-                        os.path.abspath(file_destination))
+            self.place_file(full_file_name, file_destination)
             
-            # Update the name of the star in header of the file if necessary.
+            # Update the name of the star in header of the file if necessary,
+            # the header of a file that shares its data with the source file
+            # is not modified, the change is written in a sidecar file.
             if star_name is not None:
-                self.update_star_name(file_destination, star_name)
+                if self._progargs.organization_mode in ORG_MODES_WITH_SIDECAR:
+                    write_header_sidecar(file_destination, 
+                                         {self._header_fields.object: star_name})
+                else:
+                    self.update_star_name(file_destination, star_name)
+                    
+            # The statistics of the flats are stored in the index while the
+            # file is recently placed, the masterflat takes their means from
+            # the index to normalize them.
+            if is_flat:
+                imgstats.read_image_statistics(file_destination)
                 
         return target_dir
             
@@ -497,17 +641,17 @@ class OrganizeFIT(object):
             # Inspect only directories without subdirectories.
             if len(dirs) == 0:
                 
-                # Get the binning of each file in the directory.
-                for f in files:
+                # Get the binning of each fit file in the directory.
+                for f in [f for f in files if f.endswith(FIT_FILE_EXT)]:
                     path_file = os.path.join(path,f)
                     
                     bin = get_file_binning(path_file)
         
-                # If the binning has been read.
-                if bin is not None:
-                    # If this binning has not been found yet, add it.
-                    if not bin in binnings:
-                        binnings.extend([bin])
+                    # If the binning has been read.
+                    if bin is not None:
+                        # If this binning has not been found yet, add it.
+                        if not bin in binnings:
+                            binnings.extend([bin])
                         
         if len(binnings) > 1:
             logging.warning("Images with different %s binning in '%s'" %
@@ -530,8 +674,8 @@ class OrganizeFIT(object):
             # Inspect only directories without subdirectories.
             if len(dirs) == 0:
                 
-                # Get the binning of each file in the directory.
-                for f in files:
+                # Get the binning of each fit file in the directory.
+                for f in [f for f in files if f.endswith(FIT_FILE_EXT)]:
                     path_file = os.path.join(path, f)
                     
                     bin = get_file_binning(path_file)
@@ -544,10 +688,48 @@ class OrganizeFIT(object):
                             logging.debug("Removing file '%s' with binning %s not used" % 
                                           (path_file, bin))
                                                     
-                            os.remove(path_file) 
+                            self.discard_image(path_file)
                     else:
                         logging.warning("Binning not read for: %s" % (path_file))  
     
+    def discard_image(self, file_name):
+        """Remove an image organized that is not needed.
+        
+        When the files are moved, the organized image is the only copy of 
+        the source image, so it is returned to the source instead of being
+        removed. If the source is not known, the image is kept.
+        
+        Args:
+            file_name: Name of the image to discard.
+            
+        """
+        
+        if self._progargs.organization_mode == ORG_MODE_MOVE:
+            source_file_name = self._moved_files.get(os.path.abspath(file_name))
+            
+            if source_file_name is not None and \
+                not os.path.lexists(source_file_name):
+                
+                logging.debug("Returning file '%s' to '%s'" % 
+                              (file_name, source_file_name))
+                
+                source_dir = os.path.dirname(source_file_name)
+                
+                if not os.path.exists(source_dir):
+                    os.makedirs(source_dir)
+                
+                shutil.move(file_name, source_file_name)
+            else:
+                logging.warning("Image '%s' not needed kept, its source is not known." % 
+                                (file_name))
+        else:
+            os.remove(file_name) 
+                            
+            sidecar_name = header_sidecar_name(file_name)
+            
+            if os.path.exists(sidecar_name):
+                os.remove(sidecar_name)
+    
     def remove_dir_if_empty(self, source_path):
         """Check if the directory is empty and in that case is removed.
         
@@ -727,84 +909,174 @@ class OrganizeFIT(object):
                 
                 self.remove_not_empty_dir(dir_to_rm)
                 
-    def get_mjd_from_noon(self, file_name, file_header):
+    def get_mjd_from_noon(self, file_names, file_headers):
         """Get the Modified Julian Day minus 0.5, this is, the day begining at 
         noon, as in JD, so all the observations of a night have the same number.
         
+        The MJD is taken from the header, if not present it is calculated from
+        the observation date, the dates of all the files are converted at 
+        once.
+        
         Args:
-            file_name: Name of the file
-            file_header: Header of the fit file.
+            file_names: Names of the files.
+            file_headers: Headers of the fit files.
         
         Returns:
-            The Julian Day of the files in the path indicated.
+            The list of the Julian Days of the files.
         """
         
-        mjd_at_noon = 0
+        mjds_at_noon = []
         
-        if self._header_fields.mjd in file_header.keys():
-            
-            mjd_f = float(file_header[self._header_fields.mjd])
+        # Files whose MJD must be calculated from the observation date.
+        dates_obs = []
+        dates_index = []
+        
+        for i, file_header in enumerate(file_headers):
+        
+            mjd_at_noon = 0
             
-            mjd_at_noon = int(mjd_f - 0.5)
+            if self._header_fields.mjd in file_header:
+                
+                mjd_f = float(file_header[self._header_fields.mjd])
                 
-        if mjd_at_noon == 0:
+                mjd_at_noon = int(mjd_f - 0.5)
+                    
             # Try to get the MJD from the observation date.
-            if self._header_fields.date_obs in file_header.keys():
+            if mjd_at_noon == 0 and \
+                self._header_fields.date_obs in file_header:
                 
-                date_obs = file_header[self._header_fields.date_obs]
-                times = [date_obs.strip(), '2010-01-01T00:00:00']
-                t = Time(times, format='isot', scale='utc')
+                dates_obs.append(file_header[self._header_fields.date_obs])
+                dates_index.append(i)
                 
-                mjd_at_noon = int(t.mjd[0] - 0.5)    
+            mjds_at_noon.append(mjd_at_noon)
+            
+        for i, mjd_at_noon in zip(dates_index, 
+                                  get_nights_from_dates(dates_obs)):
+            mjds_at_noon[i] = mjd_at_noon
             
+        for file_name, mjd_at_noon in zip(file_names, mjds_at_noon):
             if mjd_at_noon == 0:
                 logging.warning("MJD cannot be determined for file: %s" % 
                                 file_name)         
                 
-        return mjd_at_noon
+        return mjds_at_noon
+            
+    def get_files_to_organize(self):
+        """Walks the directories from the source directory searching for image
+        files to organize.
+        
+        Returns:
+            A generator of tuples with a path and the names of a group of 
+            files of that path.
+        
+        """
+        
+        # Inspect only directories without subdirectories.
+        for path, files in scan_leaf_directories(self._progargs.source_dir):
+            
+            # Check if current directory was created previously
+            # to contain bias, flat or light, in that case the directory 
+            # is ignored.        
+            if self.ignore_current_directory(path):
+                logging.debug("Ignoring directory '%s', already organized."
+                              % (path))
+            else:              
+                fit_files = []
+                
+                # Sort to get a processing easy to follow.
+                files.sort()
+                
+                for fn in files:
+                    # The extension is the final string of the list 
+                    # without the initial dot.
+                    filext = os.path.splitext(fn)[-1][1:]
+        
+                    if filext == FIT_FILE_EXT:
+                        fit_files.append(fn)
+                    else:
+                        logging.debug("Ignoring file: %s" % (fn))
+                        
+                for i in range(0, len(fit_files), FILES_PER_TASK):
+                    yield path, fit_files[i:i + FILES_PER_TASK]
+                        
+    def organize_files(self, files_to_organize):
+        """Analyzes a group of files of a directory and places each one in the 
+        proper directory.
+        
+        Args:
+            files_to_organize: A tuple with the path and the names of the 
+            files.
+            
+        Returns:
+            The set of the target directories of the files.
+            
+        """
+        
+        path, file_names = files_to_organize
+        
+        target_dirs = set()
+        
+        full_file_names = [os.path.join(path, fn) for fn in file_names]
+        
+        # Get the headers of the files.  
+        file_headers = [get_fit_fields(ffn, 
+                                       self._header_fields.header_fields_names)
+                        for ffn in full_file_names]
+        
+        mjds_at_noon = self.get_mjd_from_noon(full_file_names, file_headers)
+        
+        for fn, file_header, mjd_at_noon in \
+            zip(file_names, file_headers, mjds_at_noon):
+        
+            logging.debug("Analyzing: %s" % (os.path.join(path, fn)))
+            
+            try:
+                target_dirs.add(self.analyze_and_copy_file(path, fn, 
+                                                           file_header,
+                                                           mjd_at_noon))
+                
+            except (IOError, OSError, shutil.Error) as e:
+                logging.error("Error organizing file: %s" % 
+                              (os.path.join(path, fn)))
+                logging.error("Error is: %s" % (e))
+            
+        return target_dirs
             
     def process_directories(self):
         """This function walks the directories searching for image files,
         when a directory with image files is found the directory contents
         are analyzed and organized.
         
+        The files are organized in a pool of threads when more than one 
+        process is requested, so the scanning of the directories, the reading
+        of the headers and the copies overlap. Once all the files are 
+        organized, the images with a binning not needed are removed from the
+        target directories.
+        
         """          
-
-        # Walk from source directory.
-        for path, dirs, files in os.walk(self._progargs.source_dir):
+        
+        target_dirs = set()
+        
+        num_threads = self._progargs.number_of_processes
+        
+        if num_threads > 1:
+            logging.debug("Organizing files using %d threads." % (num_threads))
             
-            # Inspect only directories without subdirectories.
-            if len(dirs) == 0:       
-                 
-                # Check if current directory was created previously
-                # to contain bias, flat or light, in that case the directory 
-                # is ignored.        
-                if self.ignore_current_directory(path):
-                    logging.debug("Ignoring directory '%s', already organized."
-                                  % (path))
-                else:              
-                    target_dir = ""
-                          
-                    # Sort to get a processing easy to follow.
-                    files.sort()
-                    
-                    # For each file move it to he proper directory.
-                    for fn in files:
-                        # The extension is the final string of the list 
-                        # without the initial dot.
-                        filext = os.path.splitext(fn)[-1][1:]
+            pool = ThreadPool(num_threads)
             
-                        if filext == FIT_FILE_EXT:
-                            
-                            logging.debug("Analyzing: %s" %
-                                          (os.path.join(path, fn)))
-                            
-                            target_dir = self.analyze_and_copy_file(path, fn)
-                        else:
-                            logging.debug("Ignoring file: %s" % (fn))   
-                            
-                    if target_dir:
-                        self.remove_images_according_to_binning(target_dir)
+            try:
+                for dirs in pool.imap_unordered(self.organize_files,
+                                                self.get_files_to_organize()):
+                    target_dirs.update(dirs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for files_to_organize in self.get_files_to_organize():
+                target_dirs.update(self.organize_files(files_to_organize))
+                    
+        for target_dir in sorted(target_dirs):
+            self.remove_images_according_to_binning(target_dir)
 
         # Remove directories with files that are incomplete to get data reduced,
         #self.remove_dir_with_incomplete_data(self._progargs.target_dir)     
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module reads and writes the files with the photometry of an image.
+
+The photometry of an image is stored in a NumPy record array with a record
+for each star and the fields id, xc, yc, otime, mag, xairmass and merr, the
+fields extracted previously with txdump. When several apertures are measured,
+the magnitude and the error of each additional aperture are added as the
+fields mag_2, merr_2, mag_3, merr_3 and so on. The undefined values are NaN.
+
+The files written by iraf phot are also parsed in this module to convert them
+to this format.
+
+"""
+
+import os
+import numpy as np
+from constants import *
+
+# Fields of the photometry of each star.
+PHOT_ID_FIELD = "id"
+PHOT_XC_FIELD = "xc"
+PHOT_YC_FIELD = "yc"
+PHOT_OTIME_FIELD = "otime"
+PHOT_MAG_FIELD = "mag"
+PHOT_AIRMASS_FIELD = "xairmass"
+PHOT_MERR_FIELD = "merr"
+
+PHOT_FIELDS = [ (PHOT_ID_FIELD, np.int32),
+                (PHOT_XC_FIELD, np.float64),
+                (PHOT_YC_FIELD, np.float64),
+                (PHOT_OTIME_FIELD, np.float64),
+                (PHOT_MAG_FIELD, np.float64),
+                (PHOT_AIRMASS_FIELD, np.float64),
+                (PHOT_MERR_FIELD, np.float64) ]
+
+# Fields of the additional apertures.
+PHOT_APERTURE_MAG_FIELD = "mag_%d"
+PHOT_APERTURE_MERR_FIELD = "merr_%d"
+
+# Fields of the files of iraf phot.
+IRAF_FIELD_NAMES_PREFIX = "#N"
+IRAF_LINE_CONTINUATION = "\\"
+IRAF_APERTURE_LINE_MARK = "*"
+IRAF_ID_FIELD = "ID"
+IRAF_XC_FIELD = "XCENTER"
+IRAF_YC_FIELD = "YCENTER"
+IRAF_OTIME_FIELD = "OTIME"
+IRAF_AIRMASS_FIELD = "XAIRMASS"
+IRAF_MAG_FIELD = "MAG"
+IRAF_MERR_FIELD = "MERR"
+
+# First field of the fields repeated for each aperture.
+IRAF_APERTURE_FIRST_FIELD = "RAPERT"
+
+class PhotFileException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+
+        return self._msg
+
+def get_phot_dtype(num_apertures=1):
+    """Returns the type of the records of the photometry.
+
+    Args:
+        num_apertures: Number of apertures measured.
+
+    Returns:
+        The type of the records.
+
+    """
+
+    fields = list(PHOT_FIELDS)
+
+    for i in range(2, num_apertures + 1):
+        fields.extend([(PHOT_APERTURE_MAG_FIELD % (i), np.float64),
+                       (PHOT_APERTURE_MERR_FIELD % (i), np.float64)])
+
+    return np.dtype(fields)
+
+def get_num_apertures(phot_data):
+    """Returns the number of apertures of the photometry received.
+
+    Args:
+        phot_data: The records of the photometry.
+
+    Returns:
+        The number of apertures.
+
+    """
+
+    return 1 + (len(phot_data.dtype.names) - len(PHOT_FIELDS)) // 2
+
+def get_phot_file_name(mag_file_name):
+    """Returns the name of the file of the photometry related to the file of
+    magnitudes of iraf phot.
+
+    Args:
+        mag_file_name: Name of the magnitudes file.
+
+    Returns:
+        The name of the file of the photometry.
+
+    """
+
+    return mag_file_name.replace(".%s" % (MAGNITUDE_FILE_EXT),
+                                 MAG_NPY_PATTERN)
+
+def create_phot_data(xc, yc, otime, mag, xairmass, merr):
+    """Creates the records of the photometry of the stars of an image.
+
+    Args:
+        xc: X coordinates of the centers.
+        yc: Y coordinates of the centers.
+        otime: Time of the observation.
+        mag: Magnitudes, a column for each aperture.
+        xairmass: Airmass of the observation.
+        merr: Errors of the magnitudes, a column for each aperture.
+
+    Returns:
+        The records of the photometry.
+
+    """
+
+    phot_data = np.empty(len(xc), dtype=get_phot_dtype(mag.shape[1]))
+
+    phot_data[PHOT_ID_FIELD] = np.arange(1, len(xc) + 1)
+    phot_data[PHOT_XC_FIELD] = xc
+    phot_data[PHOT_YC_FIELD] = yc
+    phot_data[PHOT_OTIME_FIELD] = np.nan if otime is None else otime
+    phot_data[PHOT_MAG_FIELD] = mag[:, 0]
+    phot_data[PHOT_AIRMASS_FIELD] = np.nan if xairmass is None else xairmass
+    phot_data[PHOT_MERR_FIELD] = merr[:, 0]
+
+    for i in range(1, mag.shape[1]):
+        phot_data[PHOT_APERTURE_MAG_FIELD % (i + 1)] = mag[:, i]
+        phot_data[PHOT_APERTURE_MERR_FIELD % (i + 1)] = merr[:, i]
+
+    return phot_data
+
+def write_phot_file(phot_file_name, phot_data):
+    """Writes the records of the photometry of an image to a file.
+
+    The file is written with a temporary name and renamed when it is
+    complete, so a file of photometry is never left incomplete.
+
+    Args:
+        phot_file_name: Name of the file.
+        phot_data: The records of the photometry.
+
+    Raises:
+        IOError if the file cannot be written.
+
+    """
+
+    temp_file_name = phot_file_name + ".tmp"
+
+    with open(temp_file_name, "wb") as phot_file:
+        np.save(phot_file, phot_data)
+
+    os.rename(temp_file_name, phot_file_name)
+
+def read_phot_file(phot_file_name):
+    """Reads the records of the photometry of an image.
+
+    Args:
+        phot_file_name: Name of the file.
+
+    Returns:
+        The records of the photometry.
+
+    Raises:
+        IOError if the file cannot be read.
+
+    """
+
+    return np.load(phot_file_name)
+
+def to_number(text):
+    """Converts a value of a file of iraf to a number.
+
+    Args:
+        text: The value.
+
+    Returns:
+        The number, NaN for INDEF.
+
+    """
+
+    if text == INDEF_VALUE:
+        value = np.nan
+    else:
+        value = float(text)
+
+    return value
+
+def read_iraf_mag_file(mag_file_name):
+    """Reads the photometry of the file written by iraf phot.
+
+    The names of the fields are taken from the header of the file. The
+    fields from RAPERT are repeated in a line for each aperture, these lines
+    are marked with an asterisk at the end.
+
+    Args:
+        mag_file_name: Name of the magnitudes file.
+
+    Returns:
+        The records of the photometry.
+
+    Raises:
+        IOError if the file cannot be read.
+        PhotFileException if the file has not the format expected.
+
+    """
+
+    field_names = []
+    records = []
+    record = []
+
+    with open(mag_file_name, "r") as mag_file:
+        for line in mag_file:
+            line = line.strip()
+
+            if line.startswith(IRAF_FIELD_NAMES_PREFIX):
+                field_names.extend([f for f in line.split()[1:]
+                                    if f != IRAF_LINE_CONTINUATION])
+
+            elif len(line) > 0 and line[0] != COMMENT_CHARACTER:
+                continued = line.endswith(IRAF_LINE_CONTINUATION)
+
+                if continued:
+                    line = line[:-1].rstrip()
+
+                # The lines of the apertures are marked at the end.
+                if line.endswith(IRAF_APERTURE_LINE_MARK):
+                    line = line[:-1]
+
+                record.extend(line.split())
+
+                if not continued:
+                    records.append(record)
+                    record = []
+
+    try:
+        first_aperture_field = field_names.index(IRAF_APERTURE_FIRST_FIELD)
+
+        star_fields = field_names[:first_aperture_field]
+        aperture_fields = field_names[first_aperture_field:]
+
+        num_apertures = 1
+
+        if len(records) > 0:
+            num_apertures = (len(records[0]) - len(star_fields)) // \
+                len(aperture_fields)
+
+        phot_data = np.empty(len(records), dtype=get_phot_dtype(num_apertures))
+
+        mag_pos = aperture_fields.index(IRAF_MAG_FIELD)
+        merr_pos = aperture_fields.index(IRAF_MERR_FIELD)
+
+        for i, values in enumerate(records):
+            star = dict(zip(star_fields, values[:first_aperture_field]))
+
+            apertures = values[first_aperture_field:]
+
+            phot_data[i][PHOT_ID_FIELD] = int(star[IRAF_ID_FIELD])
+            phot_data[i][PHOT_XC_FIELD] = to_number(star[IRAF_XC_FIELD])
+            phot_data[i][PHOT_YC_FIELD] = to_number(star[IRAF_YC_FIELD])
+            phot_data[i][PHOT_OTIME_FIELD] = to_number(star[IRAF_OTIME_FIELD])
+            phot_data[i][PHOT_AIRMASS_FIELD] = \
+                to_number(star[IRAF_AIRMASS_FIELD])
+
+            for j in range(num_apertures):
+                first = j * len(aperture_fields)
+
+                mag = to_number(apertures[first + mag_pos])
+                merr = to_number(apertures[first + merr_pos])
+
+                if j == 0:
+                    phot_data[i][PHOT_MAG_FIELD] = mag
+                    phot_data[i][PHOT_MERR_FIELD] = merr
+                else:
+                    phot_data[i][PHOT_APERTURE_MAG_FIELD % (j + 1)] = mag
+                    phot_data[i][PHOT_APERTURE_MERR_FIELD % (j + 1)] = merr
+
+    except (ValueError, KeyError, IndexError) as e:
+        raise PhotFileException("Invalid format of magnitudes file %s: %s" %
+                                (mag_file_name, e))
+
+    return phot_data
+
+def format_phot_value(value, value_format):
+    """Returns the text of a value of the photometry.
+
+    Args:
+        value: The value.
+        value_format: Format of the value.
+
+    Returns:
+        The value formatted, or INDEF if the value is not defined.
+
+    """
+
+    if value is None or not np.isfinite(value):
+        text = INDEF_VALUE
+    else:
+        text = value_format % (value)
+
+    return text
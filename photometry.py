@@ -21,14 +21,22 @@
 
 This module calculates the photometry of the objects detected previously
 by the astrometry in the data images.
-The photometry values calculated are stored in a text file that contains
-all the measures for the objects of an image.
+The photometry values calculated are stored in a file of photometry that 
+contains all the measures for the objects of an image.
 """
 
 import sys
 import os
 import glob
+import shutil
+import tempfile
 import astromatics
+import procpool
+import imgstats
+import fwhmest
+import aperphot
+import photfile
+import photstore
 from pyraf import iraf
 from pyraf.iraf import noao, digiphot, apphot
 from constants import *
@@ -38,7 +46,8 @@ from photpars import *
 
 phot_progargs = None
 
-TXDUMP_FIELDS = "id,xc,yc,otime,mag,xairmass,merr"
+# Prefix of the temporary directory with the iraf parameters of the workers.
+UPARM_DIR_PREFIX = "ycas_uparm_"
     
 def init_iraf():
     """Initializes the pyraf environment. """
@@ -96,7 +105,8 @@ def set_image_specific_phot_pars(fwhm, phot_params):
     
     # Set photometry parameters.
     iraf.datapars.fwhmpsf = fwhm
-    iraf.photpars.apertures = fwhm * phot_params.aperture
+    iraf.photpars.apertures = ",".join(["%g" % (fwhm * a) 
+                                        for a in phot_params.apertures])
     iraf.fitskypars.annulus = fwhm * phot_params.annulus_mult
     
     # Name of the fields FITS that contains these values.
@@ -112,45 +122,32 @@ def save_parameters():
     iraf.photpars.saveParList(filename='phot.par') 
 
 
-def calculate_datamin(image_file_name, phot_params):
-    """ Calculate a datamin value for the image received using imstat. 
+def calculate_datamin(image_file_name, phot_params, stats=None):
+    """ Calculate a datamin value for the image received from its statistics. 
     
     Args: 
         image_file_name: Name of the file with the image.
         phot_params: Parameters for phot.
+        stats: The statistics of the image, if they are known.
     
     """
     
     # Set a default value for datamin.
     datamin = phot_params.datamin
     
-    try:
-        imstat_output = iraf.imstat(image_file_name, fields='mean,stddev', \
-                                    Stdout=1)
-        imstat_values = imstat_output[IMSTAT_FIRST_VALUE]
-        values = imstat_values.split()
-        
-        # Set a calculated value for datamin.
-        datamin = float(values[0]) - phot_params.datamin_mult * float(values[1])
-        
-    except iraf.IrafError as exc:
-        logging.error("Error executing imstat: Stats for data image: %s" %
-                      (image_file_name))
-        logging.error("Iraf error is: %s" % (exc))
-        
-    except ValueError as ve:
-        logging.error("Value Error calculating datamin for image: %s" %
+    if stats is None:
+        stats = imgstats.read_image_statistics(image_file_name)
+    
+    if stats is not None and imgstats.STAT_MEAN in stats:
+        datamin = aperphot.calculate_datamin(stats, phot_params)
+    else:
+        logging.error("Statistics not available for data image: %s" %
                       (image_file_name))
-        logging.error("mean is: %s stddev is: %s" % (values[0], values[1]))
-        logging.error("Value Error is: %s" % (ve))
-        
-    if datamin < phot_params.datamin:
-        datamin = phot_params.datamin
         
     return datamin
 
 def do_phot(image_file_name, catalog_file_name, output_mag_file_name, 
-            sextractor_cfg_path, phot_params):
+            fwhm, phot_params, stats=None):
     """Calculates the photometry of the images.
     
     Receives the image to use, a catalog with the position of the objects
@@ -160,8 +157,9 @@ def do_phot(image_file_name, catalog_file_name, output_mag_file_name,
         image_file_name: Name of the file with the image. 
         catalog_file_name: File with the X, Y coordinates to do phot.
         output_mag_file_name: Name of the output file with the magnitudes.
-        sextractor_cfg_path: Path to the sextractor configuration files.
+        fwhm: The FWHM of the image.
         phot_params: Parameters for phot.
+        stats: The statistics of the image, if they are known.
     
     """
     
@@ -173,10 +171,7 @@ def do_phot(image_file_name, catalog_file_name, output_mag_file_name,
                   (image_file_name, output_mag_file_name))
     
     # Calculate datamin for this image.   
-    datamin = calculate_datamin(image_file_name, phot_params)                         
-           
-    # Calculate FWHM for this image.
-    fwhm = astromatics.get_fwhm(sextractor_cfg_path, image_file_name)
+    datamin = calculate_datamin(image_file_name, phot_params, stats)                         
            
     # Set the parameters for the photometry that depends on the image.
     set_image_specific_phot_pars(fwhm, phot_params)                
@@ -189,6 +184,88 @@ def do_phot(image_file_name, catalog_file_name, output_mag_file_name,
         logging.error("Error executing phot on : %s" % (image_file_name)) 
         logging.error( "Iraf error is: %s" % (exc))
 
+def init_photometry_worker(uparm_root, phot_params):
+    """Initializes a worker process of the photometry.
+    
+    Each worker uses its own directory for the iraf parameters, so the 
+    parameters set by a worker for an image do not interfere with those of 
+    the rest of workers.
+    
+    Args:
+        uparm_root: Directory where the directory of the worker is created.
+        phot_params: Parameters for phot.
+        
+    """
+    
+    uparm_dir = os.path.join(uparm_root, str(os.getpid()))
+    
+    os.mkdir(uparm_dir)
+    
+    # iraf requires the separator at the end of the name of a directory.
+    iraf.set(uparm=uparm_dir + os.sep)
+    
+    init_iraf()
+    
+    set_common_phot_pars(phot_params)
+
+def phot_image(image_file_name, catalog_file_name, output_mag_file_name, 
+               fwhm, phot_params, phot_backend, stats):
+    """Calculates the photometry of an image with the backend indicated.
+    
+    The native backend writes the file of photometry directly. The magnitudes
+    file written by iraf is converted to a file of photometry, the magnitudes
+    file is kept so iraf is not executed again if only the conversion fails.
+    
+    Args:     
+        image_file_name: Name of the file with the image. 
+        catalog_file_name: File with the X, Y coordinates to do phot.
+        output_mag_file_name: Name of the output file with the magnitudes.
+        fwhm: The FWHM of the image.
+        phot_params: Parameters for phot.
+        phot_backend: The backend of the photometry.
+        stats: The statistics of the image, None if they are not known.
+        
+    """
+    
+    phot_file_name = photfile.get_phot_file_name(output_mag_file_name)
+    
+    if phot_backend == PHOT_BACKEND_NATIVE:
+        try:
+            aperphot.do_aperture_photometry(image_file_name, catalog_file_name, 
+                                            phot_file_name, fwhm, 
+                                            phot_params, stats)
+        except aperphot.AperturePhotometryException as ape:
+            logging.error(ape)
+            
+    else:
+        if not os.path.exists(output_mag_file_name):
+            do_phot(image_file_name, catalog_file_name, output_mag_file_name,
+                    fwhm, phot_params, stats)
+            
+        convert_mag_file(output_mag_file_name, phot_file_name)
+
+def convert_mag_file(mag_file_name, phot_file_name):
+    """Converts the magnitudes file written by iraf phot to a file of 
+    photometry.
+    
+    Args:    
+        mag_file_name: Name of the magnitudes file.
+        phot_file_name: Name of the file of photometry.
+        
+    """
+    
+    try:
+        photfile.write_phot_file(phot_file_name, 
+                                 photfile.read_iraf_mag_file(mag_file_name))
+        
+    except IOError as ioe:
+        logging.error("Error converting magnitudes file %s to %s" % 
+                      (mag_file_name, phot_file_name))
+        logging.error("Error is: %s" % (ioe))
+        
+    except photfile.PhotFileException as pfe:
+        logging.error(pfe)
+
 def do_photometry(progargs, phot_params):   
     """Walk the directories searching for image to calculate its photometry.
     
@@ -199,12 +276,32 @@ def do_photometry(progargs, phot_params):
     along with the catalog to a function that calculates the photometry
     of the objects in the catalog file.
     
+    The FWHM of all the images is calculated before doing the photometry,
+    so sextractor could be executed for several images at the same time.
+    The FWHM could be also estimated from the stars of the catalogs without
+    executing sextractor.
+    
+    With the native backend the photometry is calculated without iraf, 
+    otherwise the magnitudes file written by iraf is converted to the file of
+    photometry. The images that already have a file of photometry are 
+    skipped. Finally, the photometry of the images not stored yet is appended
+    to the store of photometry.
+    
+    The images are distributed among the number of processes requested, when
+    iraf is used each process has its own iraf parameters.
+    
     Args:     
         progargs: Program arguments. 
         phot_params: Photometry parameters.  
     
     """
     
+    # The images pending of photometry with their catalog and magnitudes file.
+    images_to_phot = []
+    
+    # The file of photometry, the catalog and the filter of all the images.
+    images_to_store = []
+    
     # Walk from current directory.
     for path,dirs,files in os.walk(progargs.target_dir):
         
@@ -217,8 +314,8 @@ def do_photometry(progargs, phot_params):
                 logging.debug("Found a directory for data: %s" % (path))
 
                 # Get the list of catalog files.
-                catalog_files = glob.glob(os.path.join(path, "*.%s" %
-                                                       (CATALOG_FILE_EXT)))
+                catalog_files = sorted(glob.glob(os.path.join(path, "*.%s" %
+                                                              (CATALOG_FILE_EXT))))
                 
                 logging.debug("Found %d catalog files" % (len(catalog_files)))
                 
@@ -239,78 +336,69 @@ def do_photometry(progargs, phot_params):
                     output_mag_file_name = \
                         image_file_name.replace(FIT_FILE_EXT, \
                                                 MAGNITUDE_FILE_EXT)
+                        
+                    phot_file_name = \
+                        photfile.get_phot_file_name(output_mag_file_name)
+                        
+                    images_to_store.append((phot_file_name, cat_file,
+                                            os.path.basename(path)))
                  
-                    # If magnitude file exists, skip.
-                    if not os.path.exists(output_mag_file_name):
-                        do_phot(image_file_name, cat_file,
-                                output_mag_file_name,
-                                progargs.sextractor_cfg_path,
-                                phot_params)  
+                    # If photometry file exists, skip.
+                    if not os.path.exists(phot_file_name):
+                        images_to_phot.append((image_file_name, cat_file,
+                                               output_mag_file_name))
                     else:
                         logging.debug("Skipping phot for: %s, already done." %
-                                      (output_mag_file_name))
-                    
-def txdump_photometry_info(target_dir, data_dir_name):
-    """Extract the results of photometry from files to save them to a text file.
-    
-    This function search files containing the results of photometry
-    and using txdump extracts the coordinates and photometric measure
-    to save it to a text file. 
-    
-    Args:    
-        target_dir: Directory that contains the files to process.
-        data_dir_name: Name for the directories with data.    
-    
-    """
+                                      (phot_file_name))
+                        
+    # The images are always processed in the same order.
+    images_to_phot.sort()
+    
+    # Calculate FWHM for all the images.
+    if progargs.fwhm_method == FWHM_METHOD_NATIVE:
+        fwhms = fwhmest.get_fwhm_of_images([(i[0], i[1]) 
+                                            for i in images_to_phot])
+    else:
+        fwhms = astromatics.get_fwhm_of_images(progargs.sextractor_cfg_path,
+                                               [i[0] for i in images_to_phot],
+                                               os.path.join(progargs.target_dir,
+                                                            astromatics.FWHM_CACHE_FILE_NAME),
+                                               progargs.number_of_processes)
+    
+    phot_tasks = []
+    
+    for image_file_name, cat_file, output_mag_file_name in images_to_phot:
+        if fwhms[image_file_name] is None:
+            logging.error("Skipping phot for: %s, FWHM not calculated." %
+                          (image_file_name))
+        else:
+            # The statistics stored when the image was reduced.
+            phot_tasks.append((image_file_name, cat_file, output_mag_file_name,
+                               fwhms[image_file_name], phot_params, 
+                               progargs.phot_backend,
+                               imgstats.get_cached_statistics(image_file_name)))
+            
+    initializer = None
+    initargs = ()
+    uparm_root = None
     
-    # Walk from current directory.
-    for path,dirs,files in os.walk(target_dir):
+    if progargs.phot_backend != PHOT_BACKEND_NATIVE and \
+        progargs.number_of_processes > 1:
+        uparm_root = tempfile.mkdtemp(prefix=UPARM_DIR_PREFIX)
         
-        # Process only directories without subdirectories.
-        if len(dirs) == 0:
-            split_path = path.split(os.sep) 
+        initializer = init_photometry_worker
+        initargs = (uparm_root, phot_params)
+    
+    try:
+        procpool.run_tasks(phot_image, phot_tasks, 
+                           progargs.number_of_processes, initializer, initargs)
+    finally:
+        if uparm_root is not None:
+            shutil.rmtree(uparm_root, ignore_errors=True)
             
-            # Check if current directory is for data images.
-            if split_path[-2] == data_dir_name:
-                logging.debug("Found a directory for data: %s" % (path))
-
-                # Get the list of magnitude files.
-                mag_files = glob.glob(os.path.join(path, "*.%s" %
-                                                   MAGNITUDE_FILE_EXT))
-                
-                logging.debug("Found %d magnitude files" % (len(mag_files)))    
-                
-                # Reduce each data file one by one.
-                for mfile in mag_files:                  
-    
-                    # Get the name of the file where the magnitude data will 
-                    # be saved.
-                    mag_dest_file_name = \
-                        mfile.replace(".%s" %(MAGNITUDE_FILE_EXT), 
-                                      "%s%s.%s" %
-                                      (FILE_NAME_PARTS_DELIM,
-                                      MAGNITUDE_FILE_EXT, CSV_FILE_EXT))
+    # Add the photometry of the new images to the store.
+    photstore.store_photometry(progargs.target_dir, images_to_store)
                     
-                    # Remove the destiny file if exists.
-                    if os.path.exists(mag_dest_file_name):
-                        os.remove(mag_dest_file_name)
-                        
-                    try:                                            
-                        mag_dest_file = open(mag_dest_file_name, 'w' )
-                    
-                        iraf.txdump(mfile, fields=TXDUMP_FIELDS, expr='yes', \
-                                    Stdout=mag_dest_file)
-                        
-                        mag_dest_file.close()
-                        
-                    except iraf.IrafError as exc:
-                        logging.error("Error executing txdump to get: %s" %
-                                      (mag_dest_file_name))
-                        logging.error("Iraf error is: %s" % (exc)) 
-                        
-                    except IOError as ioe:
-                        logging.error("Reading file: %s" % (mag_dest_file_name))                                           
-                           
 def calculate_photometry(progargs):
     """Calculates the photometry for all the data images found.
     
@@ -319,8 +407,11 @@ def calculate_photometry(progargs):
        
     """
 
+    use_iraf = progargs.phot_backend != PHOT_BACKEND_NATIVE
+
     # Init iraf package.
-    init_iraf()
+    if use_iraf:
+        init_iraf()
     
     # Get the paramters for the protometry.
     try:
@@ -328,13 +419,14 @@ def calculate_photometry(progargs):
                                      progargs.intrument_file_name)
         
         # Set photometry parameters that do not depend on each image.
-        set_common_phot_pars(phot_params)
+        if use_iraf:
+            set_common_phot_pars(phot_params)
     
         # Calculate the photometry.
         do_photometry(progargs, phot_params)
         
-        # Export photometry info to a text file with only the columns needed.
-        txdump_photometry_info(progargs.target_dir, progargs.light_directory)        
+        if use_iraf and phot_params.curve_of_growth:
+            logging.warning("The curve of growth is only applied by the native photometry.")
     except PhotParamNotFound as ppnf:
         logging.error(ppnf)
         
@@ -54,6 +54,8 @@ class PhotParameters(object):
     
     # Names of the parameters of phot.
     __APERTURE_PAR_NAME = "APERTURE"
+    __APERTURES_PAR_NAME = "APERTURES"
+    __CURVE_OF_GROWTH_PAR_NAME = "CURVE_OF_GROWTH"
     __ANNULUS_MULT_PAR_NAME = "ANNULUS_MULT"
     __DANNULUS_PAR_NAME = "DANNULUS"
     
@@ -67,6 +69,8 @@ class PhotParameters(object):
     __CALGORI_PAR_NAME = "CALGORI"
     __SKY_PAR_NAME = "SKY"   
     
+    __YES_VALUE = "YES"
+    
     def __init__(self, phot_params_file_name, instrument_params_file_name):
         
         # Initialize attributes.
@@ -75,6 +79,8 @@ class PhotParameters(object):
         self.__epadu = 1
         
         self.__aperture_mult = 1
+        self.__apertures = []
+        self.__curve_of_growth = False
         self.__annulus_mult = 1    
         self.__dannulus = 1    
             
@@ -106,6 +112,13 @@ class PhotParameters(object):
             self.calgori = phot_params[PhotParameters.__CALGORI_PAR_NAME]
             self.sky = phot_params[PhotParameters.__SKY_PAR_NAME]
             
+            # The list of apertures is optional, by default only the 
+            # aperture is measured.
+            self.apertures = phot_params.get(PhotParameters.__APERTURES_PAR_NAME,
+                                             self.aperture)
+            self.curve_of_growth = \
+                phot_params.get(PhotParameters.__CURVE_OF_GROWTH_PAR_NAME, "")
+            
         except IOError as ioe:  
             self.__file_error.append(phot_params_file_name)
         
@@ -169,6 +182,26 @@ class PhotParameters(object):
         except KeyError as ke:
             self.__par_error.append(aperture)
         
+    @property
+    def apertures(self):
+        return self.__apertures
+    
+    @apertures.setter
+    def apertures(self, apertures):
+        try:
+            self.__apertures = [float(a) for a in str(apertures).split(",")]
+        except ValueError as ve:
+            self.__par_error.append(apertures)
+            
+    @property
+    def curve_of_growth(self):
+        return self.__curve_of_growth
+    
+    @curve_of_growth.setter
+    def curve_of_growth(self, curve_of_growth):
+        self.__curve_of_growth = \
+            str(curve_of_growth).strip().upper() == PhotParameters.__YES_VALUE
+        
     @property
     def annulus(self):
         return self.__annulus
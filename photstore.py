@@ -0,0 +1,685 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module manages the store of the photometry of all the images.
+
+The photometry of the images is appended to a store in the target directory,
+so the magnitudes are read from the store instead of from the files of
+photometry of each image. The store is partitioned by night and filter, each
+partition is a NumPy record array in a file with a record for each star of
+each image, and the star of interest of each image is that of its row 0.
+
+Only the photometry of the first aperture is stored. The appending of an
+image only rewrites the partition of its night and filter. The names of the
+images stored are kept in a text file next to the partitions, so the images
+already stored are known without reading the partitions.
+
+A manifest keeps the partitions whose magnitudes have been calculated, with
+the modification time and the hash of their files, so the magnitudes could be
+calculated only for the nights added to the store since the last time.
+
+"""
+
+import os
+import glob
+import json
+import logging
+import numpy as np
+import photfile
+from astromatics import get_file_hash
+from starcat import StarCatalog, StarCatalogException
+from utility import get_day_from_mjd
+from constants import *
+
+# Name of the directory of the store in the target directory.
+PHOT_STORE_DIR_NAME = "phot_store"
+
+# Extension of the files of the partitions.
+PARTITION_FILE_EXT = "npy"
+
+# Name of the file of the names of the images in the directory of the store.
+IMAGES_INDEX_FILE_NAME = "images.txt"
+
+# Name of the file of the manifest in the target directory.
+MANIFEST_FILE_NAME = "magnitudes_manifest.json"
+
+# Positions of the values of each partition in the manifest.
+MANIFEST_MTIME_POS = 0
+MANIFEST_HASH_POS = 1
+
+# Format of the time to calculate the night.
+TIME_FORMAT = "%.6f"
+
+# Fields of the records of the store.
+STORE_IMAGE_FIELD = "image"
+STORE_STAR_FIELD = "star"
+STORE_FILTER_FIELD = "filter"
+STORE_NIGHT_FIELD = "night"
+STORE_ROW_FIELD = "row"
+STORE_CAT_ID_FIELD = "cat_id"
+
+# Maximum length of the texts of the records.
+STORE_IMAGE_LEN = 128
+STORE_STAR_LEN = 64
+STORE_FILTER_LEN = 16
+
+STORE_DTYPE = np.dtype([ (STORE_IMAGE_FIELD, "S%d" % (STORE_IMAGE_LEN)),
+                         (STORE_STAR_FIELD, "S%d" % (STORE_STAR_LEN)),
+                         (STORE_FILTER_FIELD, "S%d" % (STORE_FILTER_LEN)),
+                         (STORE_NIGHT_FIELD, np.int32),
+                         (STORE_ROW_FIELD, np.int32),
+                         (STORE_CAT_ID_FIELD, np.int32),
+                         (photfile.PHOT_XC_FIELD, np.float64),
+                         (photfile.PHOT_YC_FIELD, np.float64),
+                         (photfile.PHOT_OTIME_FIELD, np.float64),
+                         (photfile.PHOT_MAG_FIELD, np.float64),
+                         (photfile.PHOT_AIRMASS_FIELD, np.float64),
+                         (photfile.PHOT_MERR_FIELD, np.float64) ])
+
+class PhotometryStoreException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+
+        return self._msg
+
+def get_star_name(file_name):
+    """Returns the name of the star of a file of an image.
+
+    Args:
+        file_name: Name of the file.
+
+    Returns:
+        The name of the star.
+
+    """
+
+    return os.path.basename(file_name).split(DATANAME_CHAR_SEP)[0]
+
+def check_text_length(text, max_length, description):
+    """Checks that a text fits in a field of the records of the store.
+
+    Args:
+        text: The text.
+        max_length: The maximum length of the field.
+        description: Description of the text for the error.
+
+    Raises:
+        PhotometryStoreException if the text is too long.
+
+    """
+
+    if len(text) > max_length:
+        raise PhotometryStoreException("The %s '%s' is longer than %d characters, it cannot be stored." %
+                                       (description, text, max_length))
+
+def get_image_records(image_name, phot_file_name, catalog_file_name,
+                      filter_name):
+    """Returns the records for the store of the photometry of an image.
+
+    The stars whose time of observation is not defined are discarded, the
+    rest are related in order to the identifiers of the stars of the catalog.
+
+    Args:
+        image_name: Name that identifies the image in the store.
+        phot_file_name: Name of the file of photometry of the image.
+        catalog_file_name: Name of the catalog of the image.
+        filter_name: Name of the filter of the image.
+
+    Returns:
+        The records of the image.
+
+    Raises:
+        IOError if the file of photometry cannot be read.
+        StarCatalogException if the catalog cannot be read.
+        PhotometryStoreException if a name is too long to be stored.
+
+    """
+
+    star_name = get_star_name(phot_file_name)
+
+    check_text_length(image_name, STORE_IMAGE_LEN, "image name")
+    check_text_length(star_name, STORE_STAR_LEN, "star name")
+    check_text_length(filter_name, STORE_FILTER_LEN, "filter name")
+
+    phot_data = photfile.read_phot_file(phot_file_name)
+
+    star_catalog = StarCatalog(catalog_file_name)
+
+    star_catalog.read()
+
+    defined = np.isfinite(phot_data[photfile.PHOT_OTIME_FIELD])
+
+    if not defined.all():
+        logging.warning("Found INDEF value for the observation " +
+                        "in file: '%s'" % (phot_file_name))
+
+    phot_data = phot_data[defined]
+
+    cat_ids = []
+
+    for row in range(len(phot_data)):
+        try:
+            cat_ids.append(star_catalog.id(row))
+        except StarCatalogException as sce:
+            logging.error(sce)
+
+            break
+
+    records = np.zeros(len(cat_ids), dtype=STORE_DTYPE)
+
+    if len(records) > 0:
+        phot_data = phot_data[:len(records)]
+
+        records[STORE_IMAGE_FIELD] = image_name
+        records[STORE_STAR_FIELD] = star_name
+        records[STORE_FILTER_FIELD] = filter_name
+        records[STORE_NIGHT_FIELD] = [get_day_from_mjd(TIME_FORMAT % (t))
+                                      for t in phot_data[photfile.PHOT_OTIME_FIELD]]
+        records[STORE_ROW_FIELD] = np.arange(len(records))
+        records[STORE_CAT_ID_FIELD] = cat_ids
+
+        for field in [ photfile.PHOT_XC_FIELD, photfile.PHOT_YC_FIELD,
+                       photfile.PHOT_OTIME_FIELD, photfile.PHOT_MAG_FIELD,
+                       photfile.PHOT_AIRMASS_FIELD, photfile.PHOT_MERR_FIELD ]:
+            records[field] = phot_data[field]
+
+    return records
+
+class PhotometryStore(object):
+    """The store of the photometry of the images of a target directory.
+
+    """
+
+    def __init__(self, target_dir):
+        """Constructor.
+
+        Args:
+            target_dir: The directory of the store.
+
+        """
+
+        self._target_dir = target_dir
+
+        self._store_dir = os.path.join(target_dir, PHOT_STORE_DIR_NAME)
+
+        self._images = None
+
+    @property
+    def store_dir(self):
+        return self._store_dir
+
+    @property
+    def exists(self):
+        return os.path.isdir(self._store_dir)
+
+    @property
+    def images_index_file_name(self):
+        return os.path.join(self._store_dir, IMAGES_INDEX_FILE_NAME)
+
+    @property
+    def images(self):
+        """The names of the images stored."""
+
+        if self._images is None:
+            self._images = self.read_images_index()
+
+            if self._images is None:
+                self._images = self.read_images()
+
+                if self.exists:
+                    try:
+                        self.write_images_index()
+                    except (IOError, OSError) as e:
+                        logging.warning("Error writing the index of images %s: %s" %
+                                        (self.images_index_file_name, e))
+
+        return self._images
+
+    def get_image_name(self, phot_file_name):
+        """Returns the name that identifies an image in the store.
+
+        The same file name is used for the images of several nights, so the
+        images are identified by the path of their file of photometry
+        relative to the target directory.
+
+        Args:
+            phot_file_name: Name of the file of photometry of the image.
+
+        Returns:
+            The name of the image.
+
+        """
+
+        return os.path.relpath(os.path.abspath(phot_file_name),
+                               os.path.abspath(self._target_dir))
+
+    def get_partition_file_name(self, night, filter_name):
+        """Returns the name of the file of a partition.
+
+        Args:
+            night: The night of the partition.
+            filter_name: The filter of the partition.
+
+        Returns:
+            The name of the file.
+
+        """
+
+        return os.path.join(self._store_dir, "%d%s%s.%s" %
+                            (night, FILE_NAME_PARTS_DELIM, filter_name,
+                             PARTITION_FILE_EXT))
+
+    def get_partitions(self):
+        """Returns the partitions of the store.
+
+        Returns:
+            A sorted list with the night and the filter of each partition.
+
+        """
+
+        partitions = []
+
+        for file_name in glob.glob(os.path.join(self._store_dir, "*.%s" %
+                                                (PARTITION_FILE_EXT))):
+
+            name = os.path.splitext(os.path.basename(file_name))[0]
+
+            night, filter_name = name.split(FILE_NAME_PARTS_DELIM, 1)
+
+            partitions.append((int(night), filter_name))
+
+        return sorted(partitions)
+
+    def read_partition(self, night, filter_name):
+        """Returns the records of a partition.
+
+        Args:
+            night: The night of the partition.
+            filter_name: The filter of the partition.
+
+        Returns:
+            The records of the partition, empty if it does not exist.
+
+        """
+
+        file_name = self.get_partition_file_name(night, filter_name)
+
+        if os.path.exists(file_name):
+            records = np.load(file_name)
+        else:
+            records = np.zeros(0, dtype=STORE_DTYPE)
+
+        return records
+
+    def read(self, nights=None, filters=None):
+        """Returns the records of the store, sorted by night, filter, image
+        and row.
+
+        Args:
+            nights: The nights to read, all if None.
+            filters: The filters to read, all if None.
+
+        Returns:
+            The records.
+
+        """
+
+        partitions = [ self.read_partition(n, f)
+                       for n, f in self.get_partitions()
+                       if (nights is None or n in nights) and
+                       (filters is None or f in filters) ]
+
+        records = np.concatenate([np.zeros(0, dtype=STORE_DTYPE)] +
+                                 partitions)
+
+        return np.sort(records, order=[STORE_NIGHT_FIELD, STORE_FILTER_FIELD,
+                                       STORE_IMAGE_FIELD, STORE_ROW_FIELD])
+
+    def read_images(self):
+        """Returns the names of the images of the partitions of the store.
+
+        Only the column of the names of the images of each partition is read.
+
+        Returns:
+            A set with the names of the images.
+
+        """
+
+        images = set()
+
+        for night, filter_name in self.get_partitions():
+            partition = np.load(self.get_partition_file_name(night,
+                                                             filter_name),
+                                mmap_mode="r")
+
+            images.update(np.unique(partition[STORE_IMAGE_FIELD]))
+
+        return images
+
+    def read_images_index(self):
+        """Returns the names of the images of the index of images.
+
+        The index is not used if it does not exist, it cannot be read or any
+        partition has been written after it.
+
+        Returns:
+            A set with the names of the images, None if the index is not
+            valid.
+
+        """
+
+        images = None
+
+        file_name = self.images_index_file_name
+
+        if os.path.exists(file_name):
+            try:
+                index_mtime = os.path.getmtime(file_name)
+
+                partition_mtimes = [ os.path.getmtime(
+                                        self.get_partition_file_name(n, f))
+                                     for n, f in self.get_partitions() ]
+
+                if len(partition_mtimes) == 0 or \
+                    max(partition_mtimes) <= index_mtime:
+
+                    with open(file_name, "r") as index_file:
+                        images = set([ line.rstrip("\n")
+                                       for line in index_file if len(line) > 1 ])
+                else:
+                    logging.debug("Index of images %s older than the store." %
+                                  (file_name))
+
+            except (IOError, OSError) as e:
+                logging.warning("Index of images %s cannot be read: %s" %
+                                (file_name, e))
+
+        return images
+
+    def write_images_index(self):
+        """Writes the names of the images to the index of images.
+
+        Raises:
+            IOError or OSError if the index cannot be written.
+
+        """
+
+        file_name = self.images_index_file_name
+
+        temp_file_name = file_name + ".tmp"
+
+        with open(temp_file_name, "w") as index_file:
+            for image_name in sorted(self._images):
+                index_file.write("%s\n" % (image_name))
+
+        # Replace the previous file only when the new one is complete.
+        os.rename(temp_file_name, file_name)
+
+    def append(self, records):
+        """Appends records to the store.
+
+        Each partition is written with a temporary name and renamed when it
+        is complete, so the partitions are never left incomplete. The index
+        of images is written after the partitions.
+
+        Args:
+            records: The records to append.
+
+        Raises:
+            IOError or OSError if a partition or the index of images cannot be
+            written.
+
+        """
+
+        if not self.exists:
+            os.makedirs(self._store_dir)
+
+        images = self.images
+
+        partitions = set(zip(records[STORE_NIGHT_FIELD],
+                             records[STORE_FILTER_FIELD]))
+
+        for night, filter_name in partitions:
+            in_partition = (records[STORE_NIGHT_FIELD] == night) & \
+                (records[STORE_FILTER_FIELD] == filter_name)
+
+            file_name = self.get_partition_file_name(night, filter_name)
+
+            temp_file_name = file_name + ".tmp"
+
+            with open(temp_file_name, "wb") as partition_file:
+                np.save(partition_file,
+                        np.concatenate([self.read_partition(night, filter_name),
+                                        records[in_partition]]))
+
+            os.rename(temp_file_name, file_name)
+
+        images.update(records[STORE_IMAGE_FIELD])
+
+        self.write_images_index()
+
+def store_photometry(target_dir, images):
+    """Appends to the store the photometry of the images not stored yet.
+
+    Args:
+        target_dir: The directory of the store.
+        images: List of the file of photometry, the catalog and the filter of
+        each image.
+
+    """
+
+    store = PhotometryStore(target_dir)
+
+    records = []
+
+    for phot_file_name, catalog_file_name, filter_name in images:
+        image_name = store.get_image_name(phot_file_name)
+
+        if os.path.exists(phot_file_name) and \
+            not image_name in store.images:
+
+            try:
+                records.append(get_image_records(image_name,
+                                                 phot_file_name,
+                                                 catalog_file_name,
+                                                 filter_name))
+
+            except IOError as ioe:
+                logging.error("Error reading photometry file %s: %s" %
+                              (phot_file_name, ioe))
+
+            except StarCatalogException as sce:
+                logging.error(sce)
+
+            except PhotometryStoreException as pse:
+                logging.error(pse)
+
+    if len(records) > 0:
+        try:
+            store.append(np.concatenate(records))
+
+            logging.info("Photometry of %d images added to the store." %
+                         (len(records)))
+
+        except (IOError, OSError) as e:
+            logging.error("Error writing the photometry store in %s: %s" %
+                          (store.store_dir, e))
+
+class StoreManifest(object):
+    """Stores the modification time and the hash of the files of the
+    partitions of the store whose magnitudes have been calculated.
+
+    """
+
+    def __init__(self, file_name):
+        """Constructor.
+
+        Args:
+            file_name: The name of the file of the manifest.
+
+        """
+
+        self._file_name = file_name
+
+        self._values = {}
+
+        if os.path.exists(file_name):
+            try:
+                with open(file_name, "r") as manifest_file:
+                    self._values = json.load(manifest_file)
+
+            except (IOError, ValueError) as e:
+                logging.warning("Manifest %s cannot be read, it is ignored: %s" %
+                                (file_name, e))
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    @property
+    def nights(self):
+        """The nights of the partitions of the manifest."""
+
+        return set([int(name.split(FILE_NAME_PARTS_DELIM, 1)[0])
+                    for name in self._values])
+
+    def is_unchanged(self, partition_file_name):
+        """Returns if the file of a partition is that of the manifest.
+
+        The hash is only calculated when the modification time differs.
+
+        Args:
+            partition_file_name: Name of the file of the partition.
+
+        Returns:
+            True if the partition is in the manifest and it has not changed.
+
+        Raises:
+            IOError if the file cannot be read.
+
+        """
+
+        unchanged = False
+
+        values = self._values.get(os.path.basename(partition_file_name))
+
+        if values is not None:
+            unchanged = values[MANIFEST_MTIME_POS] == \
+                os.path.getmtime(partition_file_name) or \
+                values[MANIFEST_HASH_POS] == get_file_hash(partition_file_name)
+
+        return unchanged
+
+    def get_new_nights(self, store):
+        """Returns the nights of the store added since the manifest was
+        updated.
+
+        The magnitudes of the new nights could be appended to those already
+        calculated only if there are magnitudes calculated, the partitions of
+        the manifest have not changed and the new nights are after those of
+        the manifest.
+
+        Args:
+            store: The store of photometry.
+
+        Returns:
+            The new nights, or None if all the magnitudes must be calculated
+            again.
+
+        """
+
+        new_nights = set()
+
+        file_names = []
+
+        for night, filter_name in store.get_partitions():
+            file_name = store.get_partition_file_name(night, filter_name)
+
+            file_names.append(os.path.basename(file_name))
+
+            if not self.is_unchanged(file_name):
+                new_nights.add(night)
+
+        old_nights = self.nights
+
+        if len(self._values) == 0:
+            logging.info("No magnitudes calculated before for the store.")
+
+            new_nights = None
+
+        elif len(set(self._values) - set(file_names)) > 0:
+            logging.info("Partitions removed from the store since the last " +
+                         "calculation of magnitudes.")
+
+            new_nights = None
+
+        elif len(new_nights) > 0 and len(old_nights) > 0 and \
+            min(new_nights) <= max(old_nights):
+
+            logging.info("Nights already processed changed in the store " +
+                         "since the last calculation of magnitudes.")
+
+            new_nights = None
+
+        return new_nights
+
+    def update(self, store):
+        """Sets the partitions of the manifest to those of the store.
+
+        Args:
+            store: The store of photometry.
+
+        """
+
+        values = {}
+
+        for night, filter_name in store.get_partitions():
+            file_name = store.get_partition_file_name(night, filter_name)
+
+            name = os.path.basename(file_name)
+
+            mtime = os.path.getmtime(file_name)
+
+            if name in self._values and \
+                self._values[name][MANIFEST_MTIME_POS] == mtime:
+                values[name] = self._values[name]
+            else:
+                values[name] = [mtime, get_file_hash(file_name)]
+
+        self._values = values
+
+    def save(self):
+        """Writes the manifest to its file. """
+
+        temp_file_name = self._file_name + ".tmp"
+
+        try:
+            with open(temp_file_name, "w") as manifest_file:
+                json.dump(self._values, manifest_file)
+
+            # Replace the previous file only when the new one is complete.
+            os.rename(temp_file_name, self._file_name)
+
+        except (IOError, OSError) as e:
+            logging.error("Error writing manifest %s: %s" %
+                          (self._file_name, e))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module runs a set of independent tasks in a pool of processes.
+
+The results of the tasks are returned in the same order the tasks are
+received. The messages logged by each task are collected in the worker process
+and logged by the main process when the result of the task is received, so
+the log file keeps the order of the tasks regardless of the order in which
+the tasks are actually executed.
+
+"""
+
+import logging
+import multiprocessing
+
+class LogRecordsCollector(logging.Handler):
+    """A logging handler that stores the level and message of the records
+    logged, to be logged later by the main process.
+
+    """
+
+    def __init__(self):
+
+        logging.Handler.__init__(self)
+
+        self._records = []
+
+    @property
+    def records(self):
+        return self._records
+
+    def emit(self, record):
+
+        try:
+            self._records.append((record.levelno, record.getMessage()))
+        except (TypeError, ValueError):
+            self.handleError(record)
+
+def init_worker(logging_level, initializer, initargs):
+    """Initializes a worker process of the pool.
+
+    The handlers inherited from the main process are removed, so the worker
+    does not write directly to the log file.
+
+    Args:
+        logging_level: Level of logging of the main process.
+        initializer: Function to call to initialize the worker, if any.
+        initargs: Arguments for the initializer.
+
+    """
+
+    root_logger = logging.getLogger()
+
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+
+    root_logger.setLevel(logging_level)
+
+    if initializer is not None:
+        initializer(*initargs)
+
+def run_task(task):
+    """Runs a task in a worker process collecting the messages logged.
+
+    Args:
+        task: A tuple with the function to call and its arguments.
+
+    Returns:
+        The result of the function and the records logged by it.
+
+    """
+
+    function, args = task
+
+    collector = LogRecordsCollector()
+
+    root_logger = logging.getLogger()
+
+    root_logger.addHandler(collector)
+
+    try:
+        result = function(*args)
+    finally:
+        root_logger.removeHandler(collector)
+
+    return result, collector.records
+
+def run_tasks(function, list_of_args, num_processes, initializer=None,
+              initargs=()):
+    """Calls the function received once for each item of the list of
+    arguments using a pool of processes.
+
+    If only one process is requested, or there is only one task, the tasks
+    are executed sequentially in the current process, and in this case the
+    initializer is not called.
+
+    Args:
+        function: Function to call, it must be defined at module level.
+        list_of_args: List of tuples, each one with the arguments of a call.
+        num_processes: Maximum number of processes to use.
+        initializer: Function to call when each worker process starts.
+        initargs: Arguments for the initializer.
+
+    Returns:
+        The list of the results of the calls in the order of the arguments.
+
+    """
+
+    results = []
+
+    if num_processes > 1 and len(list_of_args) > 1:
+
+        num_workers = min(num_processes, len(list_of_args))
+
+        logging.debug("Running %d tasks in %d processes." %
+                      (len(list_of_args), num_workers))
+
+        pool = multiprocessing.Pool(num_workers, init_worker,
+                                    (logging.getLogger().getEffectiveLevel(),
+                                     initializer, initargs))
+
+        try:
+            tasks = [(function, args) for args in list_of_args]
+
+            # imap returns the results in the order of the tasks.
+            for result, records in pool.imap(run_task, tasks):
+
+                for level, msg in records:
+                    logging.log(level, msg)
+
+                results.append(result)
+
+            pool.close()
+
+        except:
+            pool.terminate()
+            raise
+
+        finally:
+            pool.join()
+    else:
+        for args in list_of_args:
+            results.append(function(*args))
+
+    return results
@@ -35,23 +35,23 @@ import sys
 import os
 import logging
 import glob
-import shutil
-from pyraf import iraf
+import numpy as np
+import pyfits
+import procpool
+import combine
+import imgstats
+from fitfiles import write_image_data, read_header_sidecar
 from constants import *
 
-# File patterns.
+# File patterns, the work and normalized files were temporary files used by
+# previous versions.
 WORK_FILE_SUFFIX = "_work.fit"
-WORK1_FILE_SUFFIX = "_work1.fit"
-WORK2_FILE_SUFFIX = "_work2.fit"
 NORM_FILE_SUFFIX = "_norm.fit"
 WILDCARD_FIT_FILE = "*.fit"
 
-# Imstat operations.
-IMSTAT_MEAN = "mean"
+# Master images used in the last reduction performed by this process.
+_last_master_images = None
 
-# Imarith operations.
-IMARITH_SUBTRACT = "-"
-IMARITH_DIVIDE = "/"
 
 def is_light_directory(current_dir, light_dir_name):
     """Determines if the directory has a name identified as containing images
@@ -147,35 +147,55 @@ def get_masterflat_file_name(data_path, flat_dir_name):
 def show_bias_files_statistics(list_of_files):
     """ Show the statistics for the bias files received.
     
-    This function applies imstat to the files received and print the results.
+    This function gets the statistics of the files received and print the 
+    results.
     
     Args: 
         list_of_files: List of files to get their statistics.   
     
     """
     
-    # Control pyraf exception.
-    try:
-        # Get statistics for the list of bias files using imstat.
-    	means = iraf.imstat(list_of_files, fields='mean', Stdout=1)
-    	means = means[IMSTAT_FIRST_VALUE:]
-    	mean_strings = [str(m).translate(None, ",\ ") for m in means]
-    	mean_values = [float(m) for m in mean_strings]
-    	
+    mean_values = []
+    
+    for bias_file in list_of_files:
+        stats = imgstats.read_image_statistics(bias_file)
+        
+        if stats is not None and imgstats.STAT_MEAN in stats:
+            mean_values.append(stats[imgstats.STAT_MEAN])
+    
+    if len(mean_values) > 0:
         # Print the stats results.
-    	logging.debug("Bias images stats: Max. mean: %d Min. mean: %d" %
+        logging.debug("Bias images stats: Max. mean: %d Min. mean: %d" %
                       (max(mean_values), min(mean_values)))	
+
+def generate_masterbias(bias_files, masterbias_name, combine_method):
+    """Generates a masterbias from the bias files received.
+    
+    Args:
+        bias_files: List of bias files.
+        masterbias_name: The name of the masterbias file.
+        combine_method: Method to combine the bias images.
         
-    except iraf.IrafError as exc:
-    	logging.error("Error executing imstat: Stats for bias images: %s" %
-                      (list_of_files))
-    	logging.error("Iraf error is: %s" % (exc))  
+    """
+    
+    # Combine all the bias files.
+    try:
+        logging.debug("Creating bias file: %s" % masterbias_name)
         
-    except ValueError as ve: 	
-        logging.error("Error calculating mean values: %s" % (mean_strings))
-        logging.error("Error is: %s" % (ve))          	
+        data, header = combine.combine_images(bias_files, combine_method)
+        
+        write_image_data(masterbias_name, data, header)
+                                
+    except combine.CombineException as ce:
+        logging.error("Error combining bias with: %s" % (bias_files))  
+        logging.error("Error is: %s" % (ce))
+        
+    except IOError as ioe:
+        logging.error("Error writing masterbias: %s" % (masterbias_name))  
+        logging.error("Error is: %s" % (ioe))
 
-def generate_all_masterbias(target_dir, bias_dir_name):
+def generate_all_masterbias(target_dir, bias_dir_name, num_processes=1,
+                            combine_method=combine.DEFAULT_COMBINE_METHOD):
     """ Calculation of all the masterbias files.
     
     This function search for bias files from current directory.
@@ -188,11 +208,16 @@ def generate_all_masterbias(target_dir, bias_dir_name):
     Args:
         target_dir: Directory of the files.
         bias_dir_name: Name of the directories that contain bias images.     
+        num_processes: Number of processes to use.
+        combine_method: Method to combine the bias images.
     
     """
 
     logging.info("Generating all masterbias files from %s ..." % target_dir)
     
+    # Arguments to generate each masterbias.
+    masterbias_to_generate = []
+    
     # Walk from current directory.
     for path, dirs, files in os.walk(target_dir):
     	
@@ -215,105 +240,66 @@ def generate_all_masterbias(target_dir, bias_dir_name):
                 if os.path.exists(masterbias_name) == True:
                     logging.debug("Masterbias file exists '%s', so resume to next directory." % 
                                   (masterbias_name))
-                else:                                        
-                    # Put the files list in a string.
-                    list_of_files = ",".join(files)
+                else:
+                    masterbias_to_generate.append((files, masterbias_name,
+                                                   combine_method))
                     
-                    #show_bias_files_statistics(list_of_files)
-                        	
-                    # Combine all the bias files.
-                    try:
-                        logging.debug("Creating bias file: %s" % 
-                                    masterbias_name)
-                                    
-                        iraf.imcombine(list_of_files, masterbias_name, Stdout=1)
-                                                
-                    except iraf.IrafError as exc:
-                        logging.error("Error executing imcombine combining " + \
-                                      "bias with: %s" %
-                                      (list_of_files))  
-                        logging.error("Iraf error is: %s" % (exc))                        
-
-def generate_masterdark(logging, dark_files, masterdark_name, dark_dir_name):
+    procpool.run_tasks(generate_masterbias, masterbias_to_generate, 
+                       num_processes)
+
+def generate_masterdark(path, dark_files, masterdark_name, bias_dir_name,
+                        combine_method):
     """Generates a masterdark from the dark files received.
     
+    The dark images are combined and the masterbias, if it exists, is 
+    subtracted from the result, the same as subtracting it from each dark
+    image before combining them.
+    
     Args:
-        path: Full source path of the flat files.
+        path: Full path of the directory that contains the dark directory.
         dark_files: List of dark files.
         masterdark_name: The name of the masterdark file.
-        dark_dir_name: Name of the directories that contain dark images
+        bias_dir_name: Name of the directories that contain bias images.
+        combine_method: Method to combine the dark images.
         
     """
     
-    # Check that there is not any work file in the list, it could exists if a
-    # previous execution was terminated just before removing a work file.
-    work_files_to_remove = \
-        [f for f in dark_files if f.find(WORK_FILE_SUFFIX) > 0 ]
-    
-    # The files to use are those that are not previous work files.    
-    files = [f for f in dark_files if f.find(WORK_FILE_SUFFIX) < 0 ]   
-    
-    # Create list of names of the work flat files.
-    work_files = [s.replace("." + FIT_FILE_EXT, WORK_FILE_SUFFIX) for s in files]
-    
-    # Put the work files list in a string to be used with imarith.
-    string_of_work_dark_files = ",".join(work_files)
-    
-    # Put the dark files list in a string to be used with imarith.
-    string_of_dark_files = ",".join(files)  
+    # Ignore the temporary files that previous versions could have left.
+    files = [f for f in dark_files if not is_temporary_file(f)]
     
     # Get the masterbias file name.
-    masterbias_name = os.path.join(path, 
-                                   os.path.join("..", bias_dir_name),
-                                   MASTERBIAS_FILENAME)
+    masterbias_name = os.path.join(path, bias_dir_name, MASTERBIAS_FILENAME)
     
     try:
-        # Check if masterbias exists.
-        if os.path.exists(masterbias_name):
-            
-            # Create the work files subtracting bias from dark.
-            iraf.imarith(string_of_dark_files, IMARITH_SUBTRACT, masterbias_name,
-                         string_of_work_dark_files)
-        else:
-            for i in range(len(files)):
-                # If there is not a masterbias create the work files as a 
-                # copy of dark files.
-                shutil.copyfile(files[i], work_files[i])
-        
         logging.debug("Creating masterdark file: %s" % (masterdark_name))    
         
-        # Put the work dark files list in a string to be used with imcombine.
-        string_of_work_dark_files = ",".join(work_files)
+        data, header = combine.combine_images(files, combine_method)
         
-        try:
-            iraf.imcombine(string_of_work_dark_files, masterdark_name, Stdout=1)
+        # Check if masterbias exists.
+        if os.path.exists(masterbias_name):
             
-            # After calculating the masterdark, remove the work files
-            # to save storage space.
-            for wf in work_files:
-                os.remove(wf)
-                
-            # If there was any previous work file in the directory.
-            for wf in work_files_to_remove:
-                os.remove(wf)
-                
-        except OSError as oe:            
-            logging.error("OSError removing file while creating masterdark: %s" 
-                          % (oe))
-        
-        except iraf.IrafError as exc:
-            logging.error("Error executing imcombine combining darks with: %s" %
-                          (string_of_work_dark_files))
+            # Subtract the bias from the dark.
+            data -= pyfits.getdata(masterbias_name).astype(np.float32)
             
-            logging.error("Iraf error is: %s" % (exc))
+        write_image_data(masterdark_name, data, header)
             
-    except iraf.IrafError as exc:
-        logging.error("Error in imarith. Subtracting masterbias %s to %s" %
-                      (masterbias_name, string_of_dark_files))
-        
-        logging.error("Iraf error is: %s" % (exc))
-
-def generate_all_masterdark(target_dir, dark_dir_name, bias_dir_name):
+    except combine.CombineException as ce:
+        logging.error("Error combining darks with: %s" % (files))
+        logging.error("Error is: %s" % (ce))
+        
+    except IOError as ioe:
+        logging.error("Error creating masterdark %s using masterbias %s" %
+                      (masterdark_name, masterbias_name))
+        logging.error("Error is: %s" % (ioe))
+        
+    except ValueError as ve:
+        logging.error("Error subtracting masterbias %s to %s, size of images do not match." %
+                      (masterbias_name, masterdark_name))
+        logging.error("Error is: %s" % (ve))
+
+def generate_all_masterdark(target_dir, dark_dir_name, bias_dir_name,
+                            num_processes=1,
+                            combine_method=combine.DEFAULT_COMBINE_METHOD):
     """ Calculation of all the masterdark files.
     
     This function search for bias files from current directory.
@@ -328,11 +314,16 @@ def generate_all_masterdark(target_dir, dark_dir_name, bias_dir_name):
         target_dir: Directory of the files.
         dark_dir_name: Name of the directories that contain dark images.
         bias_dir_name: Name of the directories that contain bias images.     
+        num_processes: Number of processes to use.
+        combine_method: Method to combine the dark images.
     
     """
 
     logging.info("Generating all masterdark files from %s ..." % target_dir)
     
+    # Arguments to generate each masterdark.
+    masterdark_to_generate = []
+    
     # Walk from current directory.
     for path, dirs, files in os.walk(target_dir):
         
@@ -356,138 +347,171 @@ def generate_all_masterdark(target_dir, dark_dir_name, bias_dir_name):
                     logging.debug("Masterdark file exists '%s', so resume to next directory." % 
                                   (masterdark_name))
                 else:
-                    generate_masterdark(path, files, masterdark_name,
-                                        bias_dir_name)                        
+                    masterdark_to_generate.append((path, files, 
+                                                   masterdark_name,
+                                                   bias_dir_name, 
+                                                   combine_method))
+                    
+    procpool.run_tasks(generate_masterdark, masterdark_to_generate, 
+                       num_processes)
                         
-def normalize_flats(files):
-    """ Normalize a set of flat files. 
-    
-    This function receives a list of flat files and returns a list of
-    files of the flat files after normalize them.
-    The normalization is performed dividing the flat image by the mean
-    value of the flat image. This mean is the result of applying imstat
-    to each image.
-    
-    Args: 
-        files: The names of the files corresponding to the flat images.
-    
-    """
-    	
-    for fl in files:
-        # Get the 'work' and 'normalized' names for the flat files to process.
-        work_file = fl.replace("." + FIT_FILE_EXT, WORK_FILE_SUFFIX)
-        
-        norm_file = fl.replace("." + FIT_FILE_EXT, NORM_FILE_SUFFIX)
-        
-        # Getting statistics for flat file.
-        try:
-            flat_stats = iraf.imstat(work_file, fields=IMSTAT_MEAN, Stdout=1)
-            flat_stats = flat_stats[IMSTAT_FIRST_VALUE]    
-            
-            try:
-                mean_value = float(flat_stats)
-                                
-                # Normalize flat dividing flat by its mean value.
-                iraf.imarith(work_file, '/', mean_value, norm_file)
-    			
-            except iraf.IrafError as exc:
-                logging.error("Error executing imarith: normalizing flat image: %s" %
-                              (fl))
-                logging.error("Iraf error is: %s" % (exc))
-                
-            except ValueError as ve:     
-                logging.error("Error calculating mean value for: %s" % 
-                              (flat_stats))
-                logging.error("Error is: %s" % (ve))                      
-    	
-        except iraf.IrafError as exc:
-            logging.error("Error executing imstat: getting stats for flat image: %s" %
-                          (fl))
-            logging.error("Iraf error is: %s" % (exc))       
-
-def reduce_flats(flat_files, masterbias_name):
-    """Reduce the flat files received subtracting the masterbias indicated.
+def is_temporary_file(file_name):
+    """Determines if the file is a temporary file created by a previous version
+    of the reduction, these files are not used as source images.
     
     Args:
-        flat_files: The flat files to reduce
+        file_name: Name of the file.
         
-    """
-    
-    for ff in flat_files: 
+    Returns:
+        True if the file is a temporary file, False otherwise.
         
-        work_file = ff.replace(".fit", WORK_FILE_SUFFIX)
+    """
     
-        try:
-            # Create the work file subtracting the masterbias from the flat.
-            iraf.imarith(ff, IMARITH_SUBTRACT, masterbias_name, work_file)
-                
-        except iraf.IrafError as exc:
-            logging.error("Error in imarith. Subtracting masterbias to %s" % ff)
+    return file_name.endswith(WORK_FILE_SUFFIX) or \
+        file_name.endswith(NORM_FILE_SUFFIX)
 
-def remove_temporary_files(path):
-    """Remove the work files in the path indicated.
+def get_flats_scales(flat_files, bias_mean, flats_stats):
+    """Returns the scales to normalize the flat images received after 
+    subtracting the bias.
+    
+    The scale of each flat is the inverse of its mean value once the bias is
+    subtracted, that is the mean of the flat minus the mean of the bias. The
+    mean of a flat is taken from its statistics, calculated when the flats
+    are organized. Only when they are not known, as for the flats organized
+    without an index of headers, the flat is read to calculate them.
     
     Args:
-        path: Path where to look for work files to remove.
+        flat_files: The names of the flat files.
+        bias_mean: The mean of the masterbias.
+        flats_stats: The statistics already known of the flats.
         
+    Returns:
+        The flat files that could be normalized, the scale for each one and 
+        the statistics calculated for the flats.
+    
     """
     
-    for file in os.listdir(path):
+    files_normalized = []
+    scales = []
+    new_stats = {}
+    
+    for ff in flat_files:
+        stats = flats_stats.get(ff)
         
-        if file.endswith(WORK_FILE_SUFFIX) or file.endswith(NORM_FILE_SUFFIX):
+        try:
+            if stats is None:
+                stats = imgstats.calculate_statistics(pyfits.getdata(ff))
+                
+                new_stats[ff] = stats
             
-            try:
-                full_file_name = os.path.join(path, file)
-                os.remove(full_file_name)            
-                                
-            except OSError as oe:            
-                logging.error("OSError removing temporary file: %s" % 
-                              (full_file_name)) 
+            mean_value = stats[imgstats.STAT_MEAN] - bias_mean
+            
+            if mean_value != 0.0:
+                files_normalized.append(ff)
+                scales.append(1.0 / mean_value)
+            else:
+                logging.error("Flat image %s discarded, its mean is zero." % 
+                              (ff))
+                
+        except IOError as ioe:
+            logging.error("Error reading flat image: %s" % (ff))
+            logging.error("Error is: %s" % (ioe))
+            
+        except KeyError as ke:
+            logging.error("Flat image %s discarded, it has not valid values." % 
+                          (ff))
+            
+    return files_normalized, scales, new_stats
+
+def generate_masterflat(path, flat_files, masterflat_name, masterbias_name,
+                        combine_method, images_stats):
+    """Generates a master flat from the flat files received.
     
-def generate_masterflat(path, flat_files, masterflat_name, masterbias_name):
-    """Generates a master flat from the flat files_to_flat received.
+    The bias subtraction, the normalization and the combination of the flats
+    are performed in memory, without writing any intermediate file.
     
     Args:
-        path: Full source path of the flat files_to_flat.
-        files_to_flat: List of flat files_to_flat.
+        path: Full source path of the flat files.
+        flat_files: List of flat files.
         masterflat_name: The name of the masterflat file.
         masterbias_name: The name of the masterbias file.
+        combine_method: Method to combine the flat images.
+        images_stats: The statistics already known of the flats and the 
+        masterbias.
+        
+    Returns:
+        The statistics calculated for the flats and the masterbias.
         
     """
     
     logging.debug("Creating masterflat: %s" % (masterflat_name))   
     
-    # Check that there is not any previous temporary file in the path, 
-    # it could exists if a previous execution was terminated just before 
-    # removing them.
-    remove_temporary_files(path) 
-    
-    # Get the fit files in the directory, those should be only the flat ones.
-    flat_files = glob.glob(os.path.join(path, "*." + FIT_FILE_EXT))
+    # Ignore the temporary files that previous versions could have left.
+    files = [f for f in flat_files if not is_temporary_file(f)]
     
-    reduce_flats(flat_files, masterbias_name)
+    new_stats = {}
     
-    # Normalize the flats passing the list of flat files, 
-    normalize_flats(flat_files) 
+    try:
+        bias_data = pyfits.getdata(masterbias_name).astype(np.float32)
+        
+        bias_stats = images_stats.get(masterbias_name)
+        
+        if bias_stats is None:
+            bias_stats = imgstats.calculate_statistics(bias_data)
+            
+            new_stats[masterbias_name] = bias_stats
+        
+        files_normalized, scales, flats_stats = \
+            get_flats_scales(files, bias_stats[imgstats.STAT_MEAN], 
+                             images_stats)
+            
+        new_stats.update(flats_stats)
+        
+        data, header = combine.combine_images(files_normalized, 
+                                              combine_method, 
+                                              bias_data, scales)
+        
+        write_image_data(masterflat_name, data, header)
     
-    norm_files = [os.path.join(path,f) for f in os.listdir(path) if f.endswith(NORM_FILE_SUFFIX)]
+    except combine.CombineException as ce:
+        logging.error("Error combining flats with: %s" % (files))
+        logging.error("Error is: %s" % (ce))
+        
+    except IOError as ioe:
+        logging.error("Error creating masterflat %s using masterbias %s" % 
+                      (masterflat_name, masterbias_name))  
+        logging.error("Error is: %s" % (ioe))
+        
+    except KeyError as ke:
+        logging.error("Masterbias %s has not valid values." % 
+                      (masterbias_name))  
+        
+    return new_stats
 
-    # Put the normalized flat files list in a string to be used with 
-    # imcombine. 
-    string_of_norm_files = ",".join(norm_files)
+def get_cached_statistics(file_names):
+    """Returns the statistics stored of the images of the files received.
     
-    try:
-        iraf.imcombine(string_of_norm_files, masterflat_name, Stdout=1)
+    Args:
+        file_names: The names of the files.
+        
+    Returns:
+        A dictionary with the statistics of the files that have them stored.
+        
+    """
+    
+    images_stats = {}
     
-    except iraf.IrafError as exc:
-        logging.error("Error executing imcombine combining flats with: %s" %
-                      (string_of_norm_files))
+    for fn in file_names:
+        stats = imgstats.get_cached_statistics(fn)
         
-    finally:                
-        remove_temporary_files(path)
+        if stats is not None:
+            images_stats[fn] = stats
+            
+    return images_stats
 
 def generate_all_masterflats(target_dir, flat_dir_name, dark_dir_name,
-                             bias_dir_name):
+                             bias_dir_name, num_processes=1,
+                             combine_method=combine.DEFAULT_COMBINE_METHOD):
     """Calculation of all the masterflat files.
     
     This function search for flat files from current directory.
@@ -503,10 +527,15 @@ def generate_all_masterflats(target_dir, flat_dir_name, dark_dir_name,
         flat_dir_name: Name of the directories containing flat images.    
         dark_dir_name: Name of the directories containing dark images.   
         bias_dir_name: Name of the directories containing bias images. 
+        num_processes: Number of processes to use.
+        combine_method: Method to combine the flat images.
         
     """
     
     logging.info("Generating all masterflats files from %s ..." % (target_dir))
+    
+    # Arguments to generate each masterflat.
+    masterflats_to_generate = []
 
     # Walk from current directory.
     for path, dirs, files in os.walk(target_dir):
@@ -538,110 +567,225 @@ def generate_all_masterflats(target_dir, flat_dir_name, dark_dir_name,
                     
                         logging.debug("Found %d flat files" % (len(files)))
                                             
-                        generate_masterflat(path, files, 
-                                            masterflat_name,
-                                            masterbias_name)  
+                        masterflats_to_generate.append((path, files, 
+                                                        masterflat_name,
+                                                        masterbias_name,
+                                                        combine_method,
+                                                        get_cached_statistics(
+                                                            files + [masterbias_name])))
                 else:
                     logging.debug("There isn't a masterbias, " +
                                   "so the masterflat is not created.")                    
                     
-def reduce_image(masterdark_name, masterbias_name, masterflat_name,
-                 source_file_name, final_image_name):
-    """Reduce an image.
+    # The statistics calculated by the processes are stored by this process.
+    for new_stats in procpool.run_tasks(generate_masterflat, 
+                                        masterflats_to_generate, 
+                                        num_processes):
+        for file_name, stats in new_stats.items():
+            imgstats.store_statistics(file_name, stats)
+                    
+class MasterImages(object):
+    """Stores the data of the master images used to reduce the data images of
+    a directory.
     
-    First, if the masterdark exists is subtracted, second, if the masterbias 
-    exists is subtracted, later the image is divided by the flat if it exists.
-    These aritmethic operations on the images are performed with imarith.    
+    The master images are read only once for all the images of the directory
+    and the masterdark and masterbias are added in a single offset image, so 
+    each image is reduced with a single subtraction and a single division.
     
-    Args:
-        masterdark_name: The full name of the masterdark file.
-        masterbias_name: The full name of the masterbias file.
-        masterflat_name: The full name of the masterflat file.
-        source_file_name: Name of the file of the source image.
-        final_image_name: The name for file of the image reduced.
     """
     
-    # Get the work file name, a temporary file to store the result between bias
-    # and flat application.
-    work_file_name_1 = \
-        source_file_name.replace("." + FIT_FILE_EXT, WORK1_FILE_SUFFIX)
+    def __init__(self, masterdark_name, masterbias_name, masterflat_name):
+        """Constructor.
         
-    work_file_name_2 = \
-        source_file_name.replace("." + FIT_FILE_EXT, WORK2_FILE_SUFFIX)
+        An empty name means that there is not master image of that type, 
+        so it is not applied.
         
-    # To control when ir is necessary the removing od temporary files.
-    dark_reduction_success = False
-    bias_reduction_success = False
-    
-    # Control imarith exception.
-    try:
-        # If masterdark exists.
-        if masterdark_name:
+        Args:
+            masterdark_name: The full name of the masterdark file.
+            masterbias_name: The full name of the masterbias file.
+            masterflat_name: The full name of the masterflat file.
             
-            # Create the work files subtracting bias from flat.
-            iraf.imarith(source_file_name, IMARITH_SUBTRACT, masterdark_name, 
-                         work_file_name_1)
+        Raises:
+            IOError if a master image cannot be read.
             
-            dark_reduction_success = True
+        """
+        
+        self._offset = None
+        self._flat = None
+        self._zero_flat = None
+        
+        dark_data = read_image_data(masterdark_name)
+        bias_data = read_image_data(masterbias_name)
+        
+        if dark_data is not None and bias_data is not None:
+            self._offset = dark_data + bias_data
+        elif dark_data is not None:
+            self._offset = dark_data
         else:
+            self._offset = bias_data
             
-            # Use as work file (the input for flat step) the original file.
-            work_file_name_1 = source_file_name         
+        self._flat = read_image_data(masterflat_name)
         
-        # If masterbias exists.
-        if masterbias_name:
+        if self._flat is not None:
+            # As imarith does, pixels divided by zero are set to zero, so 
+            # these pixels of the flat are replaced to avoid the division.
+            self._zero_flat = self._flat == 0.0
+            self._flat[self._zero_flat] = 1.0
             
-            # Create the work files subtracting bias from flat.
-            iraf.imarith(work_file_name_1, IMARITH_SUBTRACT, masterbias_name, 
-                         work_file_name_2)
+    def reduce(self, data):
+        """Returns the data received reduced with the master images.
+        
+        Args:
+            data: The data of the image to reduce.
             
-            bias_reduction_success = True
-        else:
+        Returns:
+            A new array with the data reduced.
+            
+        Raises:
+            ValueError if the shape of the data does not match that of the 
+            master images.
             
-            # Use as work file (the input for flat step) the original file.
-            work_file_name_2 = work_file_name_1 
+        """
         
-        # If masterflat exists.
-        if masterflat_name: 
+        reduced_data = np.array(data, dtype=np.float32)
+        
+        if self._offset is not None:
+            reduced_data -= self._offset
             
-            # Create the final data dividing by master flat.
-            iraf.imarith(work_file_name_2, IMARITH_DIVIDE, masterflat_name, 
-                         final_image_name)
-        else:
-            # In this case the final file is the file resulting from bias 
-            # step. It could be even the original file if the masterbias 
-            # does not exist.
-            shutil.copyfile(work_file_name_2, final_image_name) 
+        if self._flat is not None:
+            reduced_data /= self._flat
+            reduced_data[self._zero_flat] = 0.0
             
-    except iraf.IrafError as exc:
-        logging.error("Error in imarith reducing: %s" % (source_file_name))
+        return reduced_data
+    
+def read_image_data(file_name):
+    """Read the data of the image contained in the file indicated as an 
+    array of float32.
+    
+    Args:
+        file_name: The name of the file with the image, could be empty.
         
-        logging.error("Iraf error is: %s" % (exc))
+    Returns:
+        The data of the image, None if the name is empty.
         
-    # Remove temporary file to save storage space.
-    try:
-        if masterdark_name and dark_reduction_success:
-            os.remove(work_file_name_1)
+    Raises:
+        IOError if the image cannot be read.
+        
+    """
+    
+    data = None
+    
+    if file_name:
+        try:
+            data = pyfits.getdata(file_name).astype(np.float32)
+            
+        except (IOError, IndexError, ValueError) as e:
+            raise IOError("Error reading image file: '%s'. Error is: %s" %
+                          (file_name, e))
             
-        if masterbias_name and bias_reduction_success:
-            os.remove(work_file_name_2)
-    except OSError as oe:
-        logging.error("Removing temporary files when reducing: '%s'." %
-                      (source_file_name))        
+    return data
+
+def get_master_images(masterdark_name, masterbias_name, masterflat_name):
+    """Returns the master images for the file names received.
+    
+    The master images are read only when they change from one call to the
+    next, the images of a directory are reduced consecutively, so the master
+    images are read once for each directory in each process and only those 
+    of a directory are kept in memory.
+    
+    Args:
+        masterdark_name: The full name of the masterdark file.
+        masterbias_name: The full name of the masterbias file.
+        masterflat_name: The full name of the masterflat file.
+        
+    Returns:
+        The master images.
+    
+    """
+    
+    global _last_master_images
+    
+    names = (masterdark_name, masterbias_name, masterflat_name)
+    
+    if _last_master_images is None or _last_master_images[0] != names:
+        _last_master_images = (names, MasterImages(masterdark_name, 
+                                                   masterbias_name, 
+                                                   masterflat_name))
+        
+    return _last_master_images[1]
+
+def reduce_image(masterdark_name, masterbias_name, masterflat_name,
+                 source_file_name, final_image_name):
+    """Reduce an image.
+    
+    The masterdark and masterbias, if they exist, are subtracted and the 
+    result is divided by the masterflat, if it exists. The arithmetic is done
+    in memory and only the final image is written. If a master image exists
+    but cannot be read, the image is not reduced.
+    
+    Args:
+        masterdark_name: The full name of the masterdark file.
+        masterbias_name: The full name of the masterbias file.
+        masterflat_name: The full name of the masterflat file.
+        source_file_name: Name of the file of the source image.
+        final_image_name: The name for file of the image reduced.
+        
+    Returns:
+        The name of the image reduced and its statistics, or None if the 
+        image has not been reduced.
+        
+    """
+    
+    result = None
+    
+    try:
+        data, header = pyfits.getdata(source_file_name, header=True)
+        
+        # The changes of the header not written in the source file.
+        for keyword, value in read_header_sidecar(source_file_name).items():
+            header[keyword] = value
+        
+        master_images = get_master_images(masterdark_name, masterbias_name, 
+                                          masterflat_name)
+        
+        reduced_data = master_images.reduce(data)
+        
+        write_image_data(final_image_name, reduced_data, header)
+        
+        # The statistics are calculated while the data is in memory, the 
+        # photometry uses them later.
+        result = (final_image_name, 
+                  imgstats.calculate_statistics(reduced_data))
+        
+    except IOError as ioe:
+        logging.error("Error reducing: %s. Error is: %s" % 
+                      (source_file_name, ioe))
+        
+    except ValueError as ve:
+        logging.error("Error reducing: %s, its size does not match " % 
+                      (source_file_name) + "that of the master images.")
+        logging.error("Error is: %s" % (ve))
+        
+    return result
 
-def reduce_list_of_images(data_files, masterdark_filename, 
-                          masterbias_filename, masterflat_filename):
-    """Reduce the images contained in the list of files received applying the
-    masterbias and masterflat also received.
+def get_images_to_reduce(data_files, masterdark_filename, 
+                         masterbias_filename, masterflat_filename):
+    """Returns the arguments to reduce the images contained in the list of 
+    files received applying the masterbias and masterflat also received.
     
     Args:
         data_files: List of file to reduce.
         masterdark_filename: Full path of the masterdark file.
         masterbias_filename: Full path of the masterbias file.
         masterflat_filename: Full path of the masterflat file.
+        
+    Returns:
+        A list with the arguments to reduce each image.
     
     """
     
+    images_to_reduce = []
+    
     # Walk the list of images to reduce them one by one.
     for source_image in data_files:
                 
@@ -657,15 +801,17 @@ def reduce_list_of_images(data_files, masterdark_filename,
                           final_image)
         elif masterbias_filename and masterflat_filename:
             # Reduce the image if there is a masterbias and a masterflat.
-            reduce_image(masterdark_filename, masterbias_filename, 
-                         masterflat_filename, source_image, final_image)
+            images_to_reduce.append((masterdark_filename, masterbias_filename, 
+                                     masterflat_filename, source_image, 
+                                     final_image))
         else:
             logging.warning("Image %s not reduced, it lacks masterbias or masterflat."
-                            % source_image)            
-
+                            % source_image)
+            
+    return images_to_reduce
 
 def reduce_data_images(target_dir, light_dir_name, dark_dir_name,
-                       bias_dir_name, flat_dir_name):
+                       bias_dir_name, flat_dir_name, num_processes=1):
     """Reduction all data images.
     
     This function search images from the source directory to reduce then. 
@@ -680,8 +826,12 @@ def reduce_data_images(target_dir, light_dir_name, dark_dir_name,
         dark_dir_name: Name of the directories containing dark images.  
         bias_dir_name: Name of the directories containing bias images.    
         flat_dir_name:Name of the directories containing flat images.
+        num_processes: Number of processes to use.
         
     """
+    
+    # Arguments to reduce each image.
+    images_to_reduce = []
 
     # Walk from current directory.
     for path, dirs, files in os.walk(target_dir):
@@ -708,8 +858,16 @@ def reduce_data_images(target_dir, light_dir_name, dark_dir_name,
                     
                 masterflat_name = get_masterflat_file_name(path, flat_dir_name)       
 
-                reduce_list_of_images(data_files, masterdark_name, 
-                                      masterbias_name, masterflat_name)
+                images_to_reduce.extend(get_images_to_reduce(data_files, 
+                                                             masterdark_name, 
+                                                             masterbias_name, 
+                                                             masterflat_name))
+                
+    # The statistics calculated by the processes are stored by this process.
+    for result in procpool.run_tasks(reduce_image, images_to_reduce, 
+                                     num_processes):
+        if result is not None:
+            imgstats.store_statistics(*result)
 
                         
 def reduce_images(progargs):
@@ -725,29 +883,33 @@ def reduce_images(progargs):
     
     logging.info("Starting the reduction of images ...")    
 
-    # Load the images package and does not show any output.
-    iraf.images(_doprint=0)
-
     # Generate all the average bias.
     generate_all_masterbias(progargs.target_dir,
-                            progargs.bias_directory)
+                            progargs.bias_directory,
+                            progargs.number_of_processes,
+                            progargs.combine_method)
 
     # Generate all the average dark.
     generate_all_masterdark(progargs.target_dir,
                             progargs.dark_directory,
-                            progargs.bias_directory)
+                            progargs.bias_directory,
+                            progargs.number_of_processes,
+                            progargs.combine_method)
 
     # Generate all the average flat.
     generate_all_masterflats(progargs.target_dir,
                              progargs.flat_directory,
                              progargs.dark_directory,
-                             progargs.bias_directory)
+                             progargs.bias_directory,
+                             progargs.number_of_processes,
+                             progargs.combine_method)
 
     # Reduce all the data images applying the average bias and flats.
     reduce_data_images(progargs.target_dir,
                        progargs.light_directory,
                        progargs.dark_directory,
                        progargs.bias_directory,
-                       progargs.flat_directory)
+                       progargs.flat_directory,
+                       progargs.number_of_processes)
     
     logging.info("Finished the reduction of images.")    
@@ -93,13 +93,19 @@ class StarCatalog(object):
                     
                 # Each line has the coordinates and the identifier of a star.
                 for lin in lines:        
-                    self._id.append(lin[StarCatalog.CAT_ID_COL])
-                    self._x_coor.append(lin[StarCatalog.CAT_X_COL])
-                    self._y_coor.append(lin[StarCatalog.CAT_Y_COL])                                            
+                    fields = lin.split()
+                    
+                    self._id.append(int(fields[StarCatalog.CAT_ID_COL]))
+                    self._x_coor.append(float(fields[StarCatalog.CAT_X_COL]))
+                    self._y_coor.append(float(fields[StarCatalog.CAT_Y_COL]))                                            
 
         except IOError as ioe:
             raise StarCatalogException("Reading coordinates file: %s" % 
                                        (self._cat_file_name))                 
+        
+        except (IndexError, ValueError) as e:
+            raise StarCatalogException("Invalid coordinates file %s: %s" % 
+                                       (self._cat_file_name, e))
     
         logging.debug("Coordinates read: %s" % (identifiers))
     
@@ -112,8 +118,8 @@ class StarCatalog(object):
         Args:
             indexes: List of indexes corresponding to the coordinates to write.
             identifiers: Identifiers of the stars found.              
-            xy_data: List of the X, Y coordinates that are referenced by X, Y
-                coordinates.      
+            xy_data: The columns of the X, Y coordinates that are referenced 
+                by the indexes.
         
         """
         
@@ -129,8 +135,8 @@ class StarCatalog(object):
                 ind = indexes[i]
                 
                 catalog_file.write("%.10g %.10g %d\n" % 
-                                   (xy_data[ind][XY_DATA_X_COL],
-                                   xy_data[ind][XY_DATA_Y_COL], 
+                                   (xy_data[XY_DATA_X_COL][ind],
+                                   xy_data[XY_DATA_Y_COL][ind], 
                                    identifiers[i]))
             
             catalog_file.close() 
@@ -26,89 +26,302 @@ the instrumental magnitudes are also stored.
 """
 
 import os
+import glob
+import logging
+import itertools
+import numpy as np
+import photfile
+import photstore
 from textfiles import *
 from constants import *
 from starcat import *
 from utility import get_day_from_mjd
 
-class Magnitude(object):
-    """ Stores a instrumental magnitude and the associated values."""
-    
-    def __init__(self, star_name, mjd, filter, mag, mag_error, airmass):
-        self._star_name = star_name
-        self._mjd = mjd
-        self._day = mjd
-        self._filter = filter
-        self._mag = mag
-        self._mag_error = mag_error          
-        self._airmass = airmass
-        # Used when calculating extinction coefficient.
-        self._std_mag = None
-        # Extinction corrected magnitude.
-        self._ext_cor_mag = None
-        # Calibrated magnitude.
-        self._calib_mag = None 
-        
-    def __str__(self):
-        return "%s %s %s %s %s %s" % \
-            (self._star_name, self._mjd, self._filter, \
-             self._mag, self._mag_error, self._airmass)
+class MagnitudeTable(object):
+    """Stores the instrumental magnitudes of the stars and the associated 
+    values in columns, with a row for each measurement.
+    
+    The names of the stars and the filters are stored as codes, the values
+    not defined are NaN.
+    
+    """
+    
+    STAR_FIELD = "star"
+    FILTER_FIELD = "filter"
+    MJD_FIELD = "mjd"
+    DAY_FIELD = "day"
+    MAG_FIELD = "mag"
+    MAG_ERROR_FIELD = "mag_error"
+    AIRMASS_FIELD = "airmass"
+    # Extinction corrected magnitude.
+    EXT_COR_MAG_FIELD = "ext_cor_mag"
+    # Calibrated magnitude.
+    CALIB_MAG_FIELD = "calib_mag"
+    
+    DTYPE = np.dtype([ (STAR_FIELD, np.int32),
+                       (FILTER_FIELD, np.int16),
+                       (MJD_FIELD, np.float64),
+                       (DAY_FIELD, np.int32),
+                       (MAG_FIELD, np.float64),
+                       (MAG_ERROR_FIELD, np.float64),
+                       (AIRMASS_FIELD, np.float64),
+                       (EXT_COR_MAG_FIELD, np.float64),
+                       (CALIB_MAG_FIELD, np.float64) ])
+    
+    def __init__(self):
         
-    @property
-    def star_name(self):
-        return self._star_name
+        self._star_names = []
+        self._filter_names = []
         
+        # Code of each name.
+        self._star_codes = {}
+        self._filter_codes = {}
+        
+        self._data = np.zeros(0, dtype=MagnitudeTable.DTYPE)
+        
+        # Rows added since the columns were joined the last time.
+        self._new_rows = []
+        
+    def __len__(self):
+        return len(self.data)
+        
+    @property
+    def data(self):
+        if len(self._new_rows) > 0:
+            self._data = np.concatenate([self._data] + self._new_rows)
+            
+            self._new_rows = []
+            
+        return self._data
+    
     @property
-    def mjd(self):
-        return self._mjd    
+    def days(self):
+        return set(np.unique(self.data[MagnitudeTable.DAY_FIELD]).tolist())
     
     @property
-    def day(self):
-        return self._day      
+    def filters(self):
+        return set([self._filter_names[c] for c in 
+                    np.unique(self.data[MagnitudeTable.FILTER_FIELD])])
     
-    @day.setter
-    def day(self, day):
-        self._day = day
+    def get_code(self, names, codes, name):
+        """Returns the code of a name, adding it if it is not found.
+        
+        Args:
+            names: The names already coded.
+            codes: The code of each name already coded.
+            name: The name.
             
-    @property
-    def filter(self):
-        return self._filter   
+        Returns:
+            The code of the name.
+            
+        """
+        
+        try:
+            code = codes[name]
+        except KeyError:
+            code = len(names)
+            
+            names.append(name)
+            codes[name] = code
+            
+        return code
+    
+    def get_filter_name(self, code):
+        return self._filter_names[code]
+    
+    def append(self, star_name, filter_name, mjd, day, mag, mag_error, 
+               airmass):
+        """Adds measurements of a star in a filter.
+        
+        Args:
+            star_name: Name of the star.
+            filter_name: Name of the filter.
+            mjd: Times of the measurements.
+            day: Days of the measurements.
+            mag: Magnitudes, NaN when not defined.
+            mag_error: Errors of the magnitudes.
+            airmass: Airmass of the measurements.
+            
+        """
+        
+        mjd = np.atleast_1d(mjd)
+        
+        rows = np.zeros(len(mjd), dtype=MagnitudeTable.DTYPE)
+        
+        rows[MagnitudeTable.STAR_FIELD] = self.get_code(self._star_names, 
+                                                        self._star_codes,
+                                                        star_name)
+        rows[MagnitudeTable.FILTER_FIELD] = self.get_code(self._filter_names, 
+                                                          self._filter_codes,
+                                                          filter_name)
+        rows[MagnitudeTable.MJD_FIELD] = mjd
+        rows[MagnitudeTable.DAY_FIELD] = day
+        rows[MagnitudeTable.MAG_FIELD] = mag
+        rows[MagnitudeTable.MAG_ERROR_FIELD] = mag_error
+        rows[MagnitudeTable.AIRMASS_FIELD] = airmass
+        rows[MagnitudeTable.EXT_COR_MAG_FIELD] = np.nan
+        rows[MagnitudeTable.CALIB_MAG_FIELD] = np.nan
+        
+        self._new_rows.append(rows)
+        
+    def select(self, star_names=None, filter_name=None, day=None):
+        """Returns the rows of the measurements that match the values 
+        received.
+        
+        Args:
+            star_names: Name or list of names of the stars, any if None.
+            filter_name: Name of the filter, any if None.
+            day: The day, any if None.
+            
+        Returns:
+            The indexes of the rows in the order they were added.
+            
+        """
+        
+        data = self.data
+        
+        selected = np.ones(len(data), dtype=bool)
+        
+        if star_names is not None:
+            if isinstance(star_names, basestring):
+                star_names = [star_names]
+                
+            codes = [self._star_codes[n] for n in star_names 
+                     if n in self._star_codes]
+                
+            selected &= np.in1d(data[MagnitudeTable.STAR_FIELD], codes)
+            
+        if filter_name is not None:
+            if filter_name in self._filter_codes:
+                selected &= data[MagnitudeTable.FILTER_FIELD] == \
+                    self._filter_codes[filter_name]
+            else:
+                selected[:] = False
+                
+        if day is not None:
+            selected &= data[MagnitudeTable.DAY_FIELD] == day
+            
+        return np.flatnonzero(selected)
+    
+    def column(self, field, rows):
+        """Returns the values of a column for some rows.
+        
+        Args:
+            field: The name of the column.
+            rows: The indexes of the rows.
+            
+        Returns:
+            The values.
+            
+        """
+        
+        return self.data[field][rows]
+    
+    def set_column(self, field, rows, values):
+        """Sets the values of a column for some rows.
+        
+        Args:
+            field: The name of the column.
+            rows: The indexes of the rows.
+            values: The values to set.
+            
+        """
+        
+        self.data[field][rows] = values
+
+class FieldMagnitudeTable(object):
+    """Stores the instrumental magnitudes of the stars of the field of a star
+    in columns, with a row for each image.
+    
+    Each row contains the time of the image followed by the magnitude and 
+    the error of each star of the field, NaN when not defined. The filter of
+    each row is stored as a code.
+    
+    """
+    
+    TIME_COL = 0
+    
+    # Number of rows added before joining them to the columns.
+    ROWS_PER_BLOCK = 1000
+    
+    def __init__(self, num_field_stars):
+        
+        self._num_field_stars = num_field_stars
+        
+        self._filter_names = []
+        self._filter_codes = {}
+        
+        self._values = np.zeros((0, 1 + 2 * num_field_stars))
+        self._filters = np.zeros(0, dtype=np.int16)
+        
+        # Rows added since the columns were joined the last time.
+        self._new_values = []
+        self._new_filters = []
+        
+    def __len__(self):
+        return len(self._values) + len(self._new_values)
     
     @property
-    def mag(self):
-        return self._mag    
+    def num_field_stars(self):
+        return self._num_field_stars
     
     @property
-    def mag_error(self):
-        return self._mag_error 
+    def values(self):
+        self.join_new_rows()
         
+        return self._values
+    
     @property
-    def airmass(self):
-        return self._airmass  
+    def filters(self):
+        self.join_new_rows()
+        
+        return self._filters
     
-    @property  
-    def std_mag(self):
-        return self._std_mag
+    def get_filter_name(self, code):
+        return self._filter_names[code]
     
-    @std_mag.setter
-    def std_mag(self, mag):
-        self._std_mag = mag
-        
-    @property  
-    def ext_cor_mag(self):
-        return self._ext_cor_mag
+    def join_new_rows(self):
+        """Joins the rows added to the columns."""
+        
+        if len(self._new_values) > 0:
+            self._values = np.vstack([self._values] + self._new_values)
+            self._filters = np.concatenate([self._filters, 
+                                            np.array(self._new_filters, 
+                                                     dtype=np.int16)])
+            
+            self._new_values = []
+            self._new_filters = []
     
-    @ext_cor_mag.setter
-    def ext_cor_mag(self, ext_cor_mag):
-        self._ext_cor_mag = ext_cor_mag
+    def append(self, time, filter_name, mag, mag_error):
+        """Adds the magnitudes of the stars of the field in an image.
         
-    @property  
-    def calib_mag(self):
-        return self._calib_mag
-    
-    @calib_mag.setter
-    def calib_mag(self, calib_mag):
-        self._calib_mag = calib_mag                
+        Args:
+            time: Time of the image.
+            filter_name: Name of the filter of the image.
+            mag: Magnitude of each star of the field.
+            mag_error: Error of the magnitude of each star of the field.
+            
+        """
+        
+        try:
+            code = self._filter_codes[filter_name]
+        except KeyError:
+            code = len(self._filter_names)
+            
+            self._filter_names.append(filter_name)
+            self._filter_codes[filter_name] = code
+        
+        row = np.empty((1, 1 + 2 * self._num_field_stars))
+        
+        row[0, FieldMagnitudeTable.TIME_COL] = time
+        row[0, 1::2] = mag
+        row[0, 2::2] = mag_error
+        
+        self._new_values.append(row)
+        self._new_filters.append(code)
+        
+        if len(self._new_values) >= FieldMagnitudeTable.ROWS_PER_BLOCK:
+            self.join_new_rows()
 
 class StarMagnitudes(object):
     """ Read and stores the values of the magnitudes of stars."""
@@ -116,14 +329,13 @@ class StarMagnitudes(object):
     # Identifier for star of interest in the coordinates list of a field.
     OBJ_OF_INTEREST_ID = 0
     
-    # Number of the column that contains the magnitude value.
-    CSV_ID_COOR_COL = 0
-    CSV_X_COOR_COL = 1
-    CSV_Y_COOR_COL = 2
-    CSV_TIME_COL = 3 
-    CSV_MAG_COL = 4
-    CSV_AIRMASS_COL = 5
-    CSV_ERROR_COL = 6
+    # Formats of the values read from the photometry files.
+    TIME_FORMAT = "%.6f"
+    MAG_FORMAT = "%.3f"
+    AIRMASS_FORMAT = "%.4f"
+    
+    # Format of the extinction corrected and calibrated magnitudes.
+    RESULT_FORMAT = "%.12g"
     
     def __init__(self, stars):
         """Constructor.
@@ -136,24 +348,22 @@ class StarMagnitudes(object):
         self._stars = stars
         
         # To store the instrumental magnitudes of the star of interest.
-        self._magnitudes = []
+        self._magnitudes = MagnitudeTable()
         
-        # To store the magnitudes of the star of interest and the stars of 
-        # reference.
+        # To store the magnitudes of the stars of the field of each no 
+        # standard star.
         self._all_magnitudes = [] 
         
         self._star_names = []   
        
-        # For each star add a list in each list to contain the data of the star.
         for s in stars:
             self._star_names.append(s.name)
             
-            self._magnitudes.append([])
-            self._all_magnitudes.append([])
-            
-        # Sets of filters and days of the magnitudes.
-        self._filter = set()
-        self._day = set()   
+            if s.is_std:
+                self._all_magnitudes.append(None)
+            else:
+                self._all_magnitudes.append(
+                    FieldMagnitudeTable(len(s.field_stars)))
         
     @property  
     def stars(self):
@@ -167,20 +377,25 @@ class StarMagnitudes(object):
     def no_std_stars(self):
         return [s for s in self._stars if not s.is_std]    
         
+    @property
+    def magnitudes(self):
+        return self._magnitudes
+        
     @property
     def days(self):
-        return self._day
+        return self._magnitudes.days
     
     @property
     def filters(self):
-        return self._filter  
+        return self._magnitudes.filters  
     
     def get_std_mag(self, name, filter):      
         std_mag = None
+        
+        star = self._stars.get_star(name)
                 
-        for s in self._stars:
-            if s.name == name:
-                std_mag = s.get_std_mag(filter)
+        if star is not None:
+            std_mag = star.get_std_mag(filter)
                 
         return std_mag
                 
@@ -195,26 +410,22 @@ class StarMagnitudes(object):
         
         """
         
-        # From the file name get the name of the star.
-        star_name_with_path = mag_file[0:mag_file.find(DATANAME_CHAR_SEP)]
-         
-        return os.path.basename(star_name_with_path)
-                
+        return photstore.get_star_name(mag_file)
 
     def get_catalog_file_name(self, mag_file):
-        """Get the catalog file name from the magnitude.csv file name.
+        """Get the catalog file name from the photometry file name.
         
         Args:
-            mag_file: Name of the magnitude csv file.
+            mag_file: Name of the photometry file.
         """
         
-        mag_csv_pattern = "%s%s" % \
-            (DATA_FINAL_SUFFIX, MAG_CSV_PATTERN)
+        mag_npy_pattern = "%s%s" % \
+            (DATA_FINAL_SUFFIX, MAG_NPY_PATTERN)
             
         cat_pattern = ".%s" % (CATALOG_FILE_EXT)
         
-        # Get the name of the catalog file from the current CSV file.
-        catalog_file_name = mag_file.replace(mag_csv_pattern, cat_pattern)
+        # Get the name of the catalog file from the current photometry file.
+        catalog_file_name = mag_file.replace(mag_npy_pattern, cat_pattern)
 
         return catalog_file_name
 
@@ -235,149 +446,74 @@ class StarMagnitudes(object):
             star_name: Name of the star whose magnitudes are requested.
             
         Returns:
-            The magnitudes of the star if available.
+            The rows of the table of magnitudes of the star.
         """
         
-        mag = None
-        
-        i = 0
-        
-        for sn in self._star_names:
-            if sn == star_name:
-                mag = self._magnitudes[i]
-                break
-            i = i + 1
-                        
-        return mag    
+        return self._magnitudes.select(star_name)
 
-    def add_all_mags(self, star_name, star_index, magnitudes, time, filter):
-        """Add all the magnitudes sorted by id.
+    def add_all_mags(self, star_index, mag, mag_error, time, filter):
+        """Add the magnitudes of the stars of the field of a no standard star.
         
         Args:
-            stgar_name: Name of the star.
             star_index: Index used to add these magnitudes.
-            magnitudes: The magnitudes with the x,y coordinate and the error.
+            mag: The magnitudes of the stars of the image.
+            mag_error: The errors of the magnitudes.
             time: The time of the measurement.
             filter: The filter used for these measurements. 
         
-        Returns:        
-            A row with the magnitudes sorted and completed with INDEF.    
-        
         """
         
-        # The row to return. Time and filter to the beginning of the row.
-        mag_row = [time, filter]
-        
-        n_mag = 0
+        table = self._all_magnitudes[star_index]
         
-        star = self._stars.get_star(star_name)
+        # Check that it is a no standard star.
+        if table is not None and len(mag) > 0:
         
-        # Check that the star has been found and it is a no standard one.
-        if star is not None and not star.is_std:
-        
-            # For each star of the field a magnitude is added to the row, 
-            # if the magnitude does not exists, INDEF values are added.
-            for sf in star.field_stars:
-               
-                # Get current magnitude to process.
-                current_mag = magnitudes[n_mag]
-                
-                mag_row.extend([current_mag[MAG_COL], \
-                                current_mag[MAG_ERR_COL]])
-                
-                # Next magnitude if there is more magnitude values.
-                if n_mag < len(magnitudes) - 1:
-                    n_mag += 1                    
+            # For each star of the field the magnitudes are taken in order,
+            # the last one is repeated if there are less magnitudes than 
+            # stars.
+            positions = np.minimum(np.arange(table.num_field_stars), 
+                                   len(mag) - 1)
             
-        self._all_magnitudes[star_index].append(mag_row)
+            table.append(time, filter, mag[positions], mag_error[positions])
 
-    def read_mag_file(self, mag_file, filter_name, star_name, star_catalog):
-        """Read the magnitudes from the file.
+    def add_image_magnitudes(self, star_name, filter_name, records):
+        """Adds the magnitudes of the stars of an image.
         
         Args:
-            mag_file: The name of the file to read.
+            star_name: Name of the star whose magnitudes are added.
             filter_name: Name of the filter for these magnitudes.
-            star_name: Name of the star whose magnitudes are read.
-            star_catalog: Catalog of X, Y coordinates of the stars in the image. 
+            records: Records of the store with the photometry of the image.
         
         """
         
-        logging.debug("Processing magnitudes file: " + mag_file)
+        star_index = self._stars.get_star_index(star_name)       
         
-        try:            
-            with open(mag_file, 'rb') as fr:
-                reader = csv.reader(fr)
-                nrow = 0
-                mag = []
-                all_mag = []
-                mjd = None
-                
-                # Process all the instrumental magnitudes in the file.
-                for row in reader:
-                    # Get a list of values from the CSV row read.
-                    fields = str(row).translate(None, "[]\'").split()                            
-                    
-                    # Check that MJD has a defined value.
-                    if fields[self.CSV_TIME_COL] != INDEF_VALUE:                
-                        
-                        # Save the mjd, it is the same for all the rows.
-                        mjd = fields[self.CSV_TIME_COL]    
-                        
-                        day = get_day_from_mjd(mjd)  
-                        
-                        # Add day and filter.
-                        self._day.add(day)
-                        self._filter.add(filter_name)  
-                        
-                        try:
-                            current_coor_id = star_catalog.id(nrow)
-                            
-                            # If it is the star of interest, add the magnitude to
-                            # the magnitudes list.
-                            if nrow == 0:                                
-                                im = Magnitude(
-                                        star_name,
-                                        mjd,
-                                        filter_name,
-                                        fields[StarMagnitudes.CSV_MAG_COL],
-                                        fields[StarMagnitudes.CSV_ERROR_COL],
-                                        fields[StarMagnitudes.CSV_AIRMASS_COL])
-                                
-                                im.day = day
-                                
-                                mag.append(im)   
-                                
-                            # Add the magnitude to the all magnitudes list.
-                            all_mag.append([fields[StarMagnitudes.CSV_MAG_COL],
-                                            fields[StarMagnitudes.CSV_ERROR_COL],
-                                            current_coor_id])                                
-                                                         
-                        except StarCatalogException as sce:
-                            logging.error(sce)               
-                        
-                        nrow += 1
-                    else:
-                        logging.warning("Found INDEF value for the observation " + 
-                                        "in file: '%s'" % (mag_file))
-                
-                star_index = self._stars.get_star_index(star_name)       
-                
-                if star_index >= 0: 
-                    self._magnitudes[star_index].extend(mag)
-    
-                    if len(all_mag) > 0:
-                        # Add all the magnitudes in the image sorted by 
-                        # identifier.
-                        self.add_all_mags(star_name, star_index, \
-                                          all_mag, mjd, filter_name)                
-                    
-                logging.info("Processed instrumental magnitudes of %d stars." % 
-                             (nrow))
-        except IOError as ioe:
-            logging.error("Reading magnitudes file: '%s'" % (mag_file))                 
+        if star_index >= 0 and len(records) > 0: 
+            
+            # The star of interest.
+            interest = records[records[photstore.STORE_ROW_FIELD] == 
+                               StarMagnitudes.OBJ_OF_INTEREST_ID]
+            
+            self._magnitudes.append(star_name, filter_name, 
+                                    interest[photfile.PHOT_OTIME_FIELD],
+                                    interest[photstore.STORE_NIGHT_FIELD],
+                                    interest[photfile.PHOT_MAG_FIELD],
+                                    interest[photfile.PHOT_MERR_FIELD],
+                                    interest[photfile.PHOT_AIRMASS_FIELD])
+            
+            # Add all the magnitudes in the image, the time is the same for 
+            # all the rows.
+            self.add_all_mags(star_index, 
+                              records[photfile.PHOT_MAG_FIELD],
+                              records[photfile.PHOT_MERR_FIELD],
+                              records[0][photfile.PHOT_OTIME_FIELD], 
+                              filter_name)                
+            
+        logging.info("Processed instrumental magnitudes of %d stars." % 
+                     (len(records)))
 
     def read_inst_magnitudes(self, mag_file, path):
-        """Searches in a given path all the magnitudes files.
+        """Reads the magnitudes of a file of photometry.
         
         Args:
             mag_file: File where to look for the magnitudes.
@@ -385,6 +521,8 @@ class StarMagnitudes(object):
         
         """         
         
+        logging.debug("Processing magnitudes file: " + mag_file)
+        
         # Filter for the magnitudes of this file.
         filter_name = self.get_filter_name(path)
         
@@ -397,22 +535,60 @@ class StarMagnitudes(object):
         if os.path.exists(catalog_file_name):
             
             try:            
-                star_catalog = StarCatalog(catalog_file_name)
-        
-                # Coordinates used to calculate the magnitudes of the image.
-                star_catalog.read()
+                records = photstore.get_image_records(
+                    os.path.basename(mag_file), mag_file, catalog_file_name, 
+                    filter_name)
+                
+                self.add_image_magnitudes(star_name, filter_name, records)
                 
-                self.read_mag_file(mag_file, filter_name, star_name, 
-                                   star_catalog)
+            except IOError as ioe:
+                logging.error("Reading magnitudes file: '%s'" % (mag_file))
                 
             except StarCatalogException as sce:
-                    logging.error(sce) 
+                logging.error(sce) 
+                
+            except photstore.PhotometryStoreException as pse:
+                logging.error(pse)
+                
+    def read_store_magnitudes(self, store, nights=None):
+        """Reads the magnitudes of the images of the store of photometry.
+        
+        Args:
+            store: The store of photometry.
+            nights: The nights to read, all if None.
+        
+        """
+        
+        records = store.read(nights)
+        
+        # The records of each image are consecutive.
+        changes = np.zeros(max(len(records) - 1, 0), dtype=bool)
+        
+        for field in [ photstore.STORE_NIGHT_FIELD, 
+                       photstore.STORE_FILTER_FIELD,
+                       photstore.STORE_IMAGE_FIELD ]:
+            values = records[field]
+            
+            changes |= values[1:] != values[:-1]
+        
+        limits = np.flatnonzero(changes) + 1
+        
+        for image_records in np.split(records, limits):
+            if len(image_records) > 0:
+                logging.debug("Processing magnitudes of image: %s" % 
+                              (image_records[0][photstore.STORE_IMAGE_FIELD]))
+                
+                self.add_image_magnitudes(
+                    image_records[0][photstore.STORE_STAR_FIELD],
+                    image_records[0][photstore.STORE_FILTER_FIELD],
+                    image_records)
     
-    def save_all_mag(self, target_dir):
+    def save_all_mag(self, target_dir, append=False):
         """ Save the magnitudes received.
         
         Args:
             target_dir: The directory for results.
+            append: True to append the magnitudes to the existing files.
         
         """
         
@@ -420,10 +596,12 @@ class StarMagnitudes(object):
         # number of stars.
         i = 0
         for s in self._stars:
+            table = self._all_magnitudes[i]
+            
             # Save only no standard stars.
-            if not s.is_std:
+            if table is not None:
                 # Check not empty.
-                if self._all_magnitudes[i]:                    
+                if len(table) > 0:                    
                     # Get the name of the output file.
                     output_file_name = "%s%s%s%s" % \
                         (s.name, ALL_INST_MAG_SUFFIX, ".", TSV_FILE_EXT)
@@ -432,16 +610,24 @@ class StarMagnitudes(object):
                                                     output_file_name)
                         
                     try:                
-                        with open(output_full_path, 'w') as fw:
+                        with open(output_full_path, 
+                                  'a' if append else 'w') as fw:
                             
                             writer = csv.writer(fw, delimiter='\t')
                     
-                            # It is a list that contains sublists, each sublist is
-                            # a different magnitude, so each one is written as a row.
-                            for imag in self._all_magnitudes[i]:
+                            # Each row contains the time, the filter and
+                            # the magnitudes of an image.
+                            for values, code in zip(table.values, 
+                                                    table.filters):
+                                row = [self.TIME_FORMAT % 
+                                       (values[FieldMagnitudeTable.TIME_COL]),
+                                       table.get_filter_name(code)]
+                                
+                                row.extend([photfile.format_phot_value(
+                                                v, self.MAG_FORMAT)
+                                            for v in values[1:]])
                             
-                                # Write each magnitude in a row.
-                                writer.writerow(imag)   
+                                writer.writerow(row)   
                                 
                     except IOError as ioe:
                         logging.error("Writing magnitudes file: '%s'" % 
@@ -449,23 +635,40 @@ class StarMagnitudes(object):
             
             i = i + 1    
             
-    def save_magnitudes(self, target_dir):
+    def format_result(self, value):
+        """Returns the text of a magnitude calculated from the instrumental
+        one, empty if it has not been calculated.
+        
+        Args:
+            value: The magnitude.
+            
+        Returns:
+            The text of the magnitude.
+            
+        """
+        
+        if np.isnan(value):
+            text = ""
+        else:
+            text = self.RESULT_FORMAT % (value)
+            
+        return text
+            
+    def save_magnitudes(self, target_dir, append=False):
         """Save the magnitudes to a text file.
         
         Args:     
             target_dir: The directory for results.
+            append: True to append the magnitudes to the existing files.
         
         """
         
-        # For each star. The two list received contains the same 
-        # number of stars.
-        i = 0
         for s in self._stars:    
             # Retrieve the magnitudes of current star.
-            mags = self._magnitudes[i]
+            mags = self.get_mags_of_star(s.name)
             
             # Check not empty.
-            if mags:                
+            if len(mags) > 0:                
                           
                 # Get the name of the output file.
                 output_file_name = "%s%s%s" % (s.name, ".", TSV_FILE_EXT)  
@@ -473,17 +676,32 @@ class StarMagnitudes(object):
                 output_full_path = os.path.join(target_dir, output_file_name)                    
                     
                 try:              
-                    with open(output_full_path, 'w') as fw:
+                    with open(output_full_path, 
+                              'a' if append else 'w') as fw:
                         
                         writer = csv.writer(fw, delimiter='\t')
     
-                        # It is a list that contains sublists, each sublist is
-                        # a different magnitude, so each one is written as a row.
-                        for m in mags:
+                        # Each magnitude is written as a row.
+                        for m in self._magnitudes.data[mags]:
                             
-                            m_to_row = [m.mjd, m.filter, m.airmass, \
-                                        m.mag, m.mag_error, \
-                                        m.ext_cor_mag, m.calib_mag]                  
+                            m_to_row = [
+                                self.TIME_FORMAT % 
+                                (m[MagnitudeTable.MJD_FIELD]), 
+                                self._magnitudes.get_filter_name(
+                                    m[MagnitudeTable.FILTER_FIELD]),
+                                photfile.format_phot_value(
+                                    m[MagnitudeTable.AIRMASS_FIELD], 
+                                    self.AIRMASS_FORMAT),
+                                photfile.format_phot_value(
+                                    m[MagnitudeTable.MAG_FIELD], 
+                                    self.MAG_FORMAT),
+                                photfile.format_phot_value(
+                                    m[MagnitudeTable.MAG_ERROR_FIELD], 
+                                    self.MAG_FORMAT),
+                                self.format_result(
+                                    m[MagnitudeTable.EXT_COR_MAG_FIELD]), 
+                                self.format_result(
+                                    m[MagnitudeTable.CALIB_MAG_FIELD])]                  
                         
                             # Write each magnitude in a row.
                             writer.writerow(m_to_row)
@@ -491,7 +709,6 @@ class StarMagnitudes(object):
                 except IOError as ioe:
                     logging.error("Writing magnitudes file: '%s'" % 
                                   (output_full_path))                             
-            i += 1
             
     def read_magnitude_files(self, target_dir):
         """Look for files that contain magnitudes and process them in current 
@@ -515,7 +732,7 @@ class StarMagnitudes(object):
         # Process the files related to magnitudes.
         for mag_file in mag_files_full_path:
             
-            star_name = mag_file[:mag_file.find('.')]
+            star_name = os.path.splitext(os.path.basename(mag_file))[0]
             
             star = self._stars.get_star(star_name)
             
@@ -525,43 +742,58 @@ class StarMagnitudes(object):
                     logging.debug("Reading magnitude file '%s'." % 
                                   (mag_file))
                     
-                    mag_list = []
+                    rows = []
                     
                     with open(mag_file, 'rb') as fr:
                         reader = csv.reader(fr, delimiter='\t')        
                         
                         # Each line contains data for a magnitude of this star.
-                        for row in reader:
-                            
-                            # At least the number of values for the 
-                            # instrumental magnitude.
-                            if len(row) >= 5:                 
-                                mag = Magnitude(star_name,
-                                                row[0], # mjd
-                                                row[1], # filter
-                                                row[3], # mag
-                                                row[4], # mag_error
-                                                row[2]) # airmass
-                                                                
-                                # It also has the extinction corrected magnitude.
-                                if len(row) == 6: 
-                                    mag.ext_cor_mag = row[5]
-                                    
-                                # It also has the calibrated magnitude.
-                                if len(row) == 7:  
-                                    mag.calib_mag = row[6]
-                                    
-                                mag_list.append(mag)
+                        # At least the number of values for the instrumental 
+                        # magnitude.
+                        rows = [row for row in reader if len(row) >= 5]
                        
-                    # Add the magnitudes to the appropriate star.
-                    star_index = self._star_names.index(star_name)       
-            
-                    if star_index >= 0:                 
-                        self._magnitudes[star_index].extend(mag_list)         
+                    self.add_saved_magnitudes(star_name, rows)
                                                                                                                                    
                 except IOError as ioe:
                     logging.error("Reading the file of magnitudes: '%s'." % 
                                   (mag_file))    
             else:
                 logging.warning("Magnitude file '%s' corresponds to an unknown star %s." %
-                                (mag_file, star_name))                                
\ No newline at end of file
+                                (mag_file, star_name))
+                
+    def add_saved_magnitudes(self, star_name, rows):
+        """Adds the magnitudes of a star read from its file of magnitudes.
+        
+        Args:
+            star_name: Name of the star.
+            rows: The rows of the file, with the mjd, filter, airmass, 
+            magnitude, error, and optionally the extinction corrected and
+            calibrated magnitudes.
+        
+        """
+        
+        # The rows are added in the same order, a group for each sequence of
+        # rows of the same filter.
+        for filter_name, group in itertools.groupby(rows, lambda r: r[1]):
+            filter_rows = list(group)
+            
+            values = np.array([[photfile.to_number(v) if len(v) > 0 
+                                else np.nan for v in 
+                                [row[0], row[2], row[3], row[4]] + 
+                                (row[5:7] + ["", ""])[:2]]
+                               for row in filter_rows], dtype=np.float64)
+            
+            first = len(self._magnitudes)
+            
+            self._magnitudes.append(star_name, filter_name, values[:, 0], 
+                                    [get_day_from_mjd(row[0]) 
+                                     for row in filter_rows], 
+                                    values[:, 2], values[:, 3], values[:, 1])
+            
+            rows_added = np.arange(first, first + len(filter_rows))
+            
+            self._magnitudes.set_column(MagnitudeTable.EXT_COR_MAG_FIELD, 
+                                        rows_added, values[:, 4])
+            
+            self._magnitudes.set_column(MagnitudeTable.CALIB_MAG_FIELD, 
+                                        rows_added, values[:, 5])
@@ -248,6 +248,9 @@ class StarsSet(object):
         
         self._stars = []        
         
+        # Index of each star in the list by its name and its synonyms.
+        self._index = {}
+        
         self.read_stars(file_name, synonym_file_name)    
         
     def __str__(self):
@@ -284,14 +287,7 @@ class StarsSet(object):
     
     def has_star(self, name):
         
-        has = False
-        
-        for s in self._stars:
-            if s.name == name or s.has_synonym(name):
-                has = True
-                break
-        
-        return has    
+        return name in self._index
         
     @property
     def has_any_std_star(self):
@@ -335,28 +331,36 @@ class StarsSet(object):
         
         self._stars.append(star)
         
+        self.index_name(star.name, len(self._stars) - 1)
+        
+    def index_name(self, name, index):
+        """Add a name of a star to the index of the stars.
+        
+        When the same name is used by several stars the first of them in
+        the list is the one indexed.
+        
+        Args:
+            name: The name or synonym of the star.
+            index: The position of the star in the list of stars.
+        """
+        
+        if index < self._index.get(name, len(self._stars)):
+            self._index[name] = index
+        
     def get_star(self, name):
         
         star = None
         
-        for s in self._stars:
-            if s.name == name or s.has_synonym(name):
-                star = s
-                break
+        index = self.get_star_index(name)
+        
+        if index >= 0:
+            star = self._stars[index]
         
         return star
     
     def get_star_index(self, name):
         
-        index = -1
-        
-        for i in range(len(self._stars)):
-            s = self._stars[i]
-            if s.name == name or s.has_synonym(name):
-                index = i
-                break
-        
-        return index    
+        return self._index.get(name, -1)
     
     def number_of_fields_to_process(self, line, group_length):
         """Determines the number of fields to read from a line depending on the
@@ -545,10 +549,15 @@ class StarsSet(object):
                     # At least the name of the star and a synonym.
                     if len(row) > 1:
                         
-                        star = self.get_star(row[0])
+                        index = self.get_star_index(row[0])
                         
-                        if star is not None:
-                            star.add_synomyms(row[1:])                        
+                        if index >= 0:
+                            star = self._stars[index]
+                            
+                            star.add_synomyms(row[1:])
+                            
+                            for syn in row[1:]:
+                                self.index_name(syn.strip(), index)                        
                     
         except IOError as ioe:
             logging.error("Reading file of synonyms: '%s'." % 
@@ -31,6 +31,7 @@ import logging
 import numpy as np
 from scipy.stats import mode
 from constants import *
+from starmag import StarMagnitudes
 
 PATH_COL = 0
 FILE_NAME_COL = 1
@@ -602,10 +603,9 @@ class SummaryReport(object):
             image = image_files_no_final[i]
             
             photometry_file = image.replace(".%s" % (FIT_FILE_EXT),
-                                            "%s%s%s" %
+                                            "%s%s" %
                                             (DATA_FINAL_SUFFIX,
-                                            FILE_NAME_PARTS_DELIM,
-                                            MAG_CSV_PATTERN))
+                                            MAG_NPY_PATTERN))
              
             # Check if the final image related to current one exists.       
             if os.path.exists(photometry_file):
@@ -636,7 +636,7 @@ class SummaryReport(object):
             if self._stars_mag is None:                
                 self._stars_mag = StarMagnitudes(self._stars)
                 
-                self._stars_mag.read_magnitudes(self._target_dir)
+                self._stars_mag.read_magnitude_files(self._target_dir)
         else:
             raise SummaryException("A file with information about " + \
                                    "stars must be specified to " + \
@@ -647,19 +647,16 @@ class SummaryReport(object):
             if not s.is_std:                
                 mags = self._stars_mag.get_mags_of_star(s.name)
                 
-                inst_mag = 0
-                ext_cor_mag = 0
-                calib_mag = 0
+                table = self._stars_mag.magnitudes
                 
                 # Count the number of magnitudes of each type for current star.
-                for m in mags:
-                    inst_mag += 1
-                    
-                    if not m.ext_cor_mag is None:
-                        ext_cor_mag += 1
-                        
-                    if not m.calib_mag is None:
-                        calib_mag += 1
+                inst_mag = len(mags)
+                
+                ext_cor_mag = np.count_nonzero(np.isfinite(
+                    table.column(table.EXT_COR_MAG_FIELD, mags)))
+                
+                calib_mag = np.count_nonzero(np.isfinite(
+                    table.column(table.CALIB_MAG_FIELD, mags)))
                         
                 messages.append(["Star %s has: " % s.name])
                 messages.append(["%d instrumental magnitudes." %
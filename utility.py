@@ -19,6 +19,31 @@
 
 """This module performs some utility functions. """
 
+import logging
+import numpy as np
+from astropy.time import Time
+
+# Maximum length of the ISO-8601 dates parsed natively.
+ISO_DATE_MAX_LEN = 32
+
+# Lengths of the ISO-8601 dates with only the date, and with date and time
+# without fraction of seconds.
+ISO_DATE_LEN = 10
+ISO_DATE_TIME_LEN = 19
+
+# Positions of the digits and separators of the ISO-8601 dates.
+ISO_DATE_DIGITS = [ 0, 1, 2, 3, 5, 6, 8, 9 ]
+ISO_TIME_DIGITS = [ 11, 12, 14, 15, 17, 18 ]
+ISO_DATE_SEPARATORS = { 4: "-", 7: "-" }
+ISO_TIME_SEPARATORS = { 10: "T", 13: ":", 16: ":" }
+ISO_FRACTION_SEPARATOR_POS = 19
+
+# Days from 0000-03-01 to 1970-01-01 and MJD of 1970-01-01.
+DAYS_TO_EPOCH = 719468
+MJD_OF_EPOCH = 40587
+
+SECONDS_PER_DAY = 86400.0
+
 def get_day_from_mjd(mjd_time):
     """Returns the Modified Julian day related to the Modified Julian time
     received without decimals.
@@ -49,4 +74,162 @@ def get_day_from_mjd(mjd_time):
     else:
         day = mjd_time[:dot_pos]
     
-    return int(day)
\ No newline at end of file
+    return int(day)
+
+def get_iso_number(digits, first, last):
+    """Returns the numbers formed by some consecutive digits of a set of
+    dates.
+    
+    Args:
+        digits: The digits of the dates, a date for each row.
+        first: Position of the first digit.
+        last: Position following that of the last digit.
+        
+    Returns:
+        The numbers of the dates.
+    
+    """
+    
+    number = np.zeros(digits.shape[0], dtype=np.int64)
+    
+    for i in range(first, last):
+        number = number * 10 + digits[:, i]
+        
+    return number
+
+def days_from_civil(year, month, day):
+    """Returns the number of days since 1970-01-01 of a set of dates of the 
+    proleptic Gregorian calendar.
+    
+    Args:
+        year: The years of the dates.
+        month: The months of the dates.
+        day: The days of the dates.
+        
+    Returns:
+        The number of days of each date.
+    
+    """
+    
+    # The years are counted from March to leave the leap day at the end.
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + \
+        day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - \
+        year_of_era // 100 + day_of_year
+        
+    return era * 146097 + day_of_era - DAYS_TO_EPOCH
+
+def iso_dates_to_mjd(dates):
+    """Converts a set of ISO-8601 dates to Modified Julian Date.
+    
+    The dates are parsed at once for the formats YYYY-MM-DD and 
+    YYYY-MM-DDThh:mm:ss[.fff].
+    
+    Args:
+        dates: The list of dates.
+        
+    Returns:
+        An array with the MJD of each date, NaN for the dates that have not
+        one of these formats.
+    
+    """
+    
+    dates = [d.strip() for d in dates]
+    
+    lengths = np.array([len(d) for d in dates])
+    
+    codes = np.array(dates, dtype="S%d" % (ISO_DATE_MAX_LEN)).view(np.uint8)
+    codes = codes.reshape(len(dates), ISO_DATE_MAX_LEN).astype(np.int64)
+    
+    digits = codes - ord("0")
+    
+    is_digit = (digits >= 0) & (digits <= 9)
+    
+    has_time = lengths >= ISO_DATE_TIME_LEN
+    
+    has_fraction = lengths > ISO_DATE_TIME_LEN + 1
+    
+    valid = (lengths == ISO_DATE_LEN) | (lengths == ISO_DATE_TIME_LEN) | \
+        (has_fraction & (lengths <= ISO_DATE_MAX_LEN))
+    
+    valid &= is_digit[:, ISO_DATE_DIGITS].all(axis=1)
+    
+    for pos, sep in ISO_DATE_SEPARATORS.items():
+        valid &= codes[:, pos] == ord(sep)
+        
+    time_valid = is_digit[:, ISO_TIME_DIGITS].all(axis=1)
+    
+    for pos, sep in ISO_TIME_SEPARATORS.items():
+        time_valid &= codes[:, pos] == ord(sep)
+        
+    valid &= ~has_time | time_valid
+    
+    # The digits of the fraction of seconds are those inside the length of 
+    # each date.
+    fraction_pos = np.arange(ISO_FRACTION_SEPARATOR_POS + 1, ISO_DATE_MAX_LEN)
+    in_fraction = fraction_pos[np.newaxis, :] < lengths[:, np.newaxis]
+    
+    fraction_valid = \
+        (codes[:, ISO_FRACTION_SEPARATOR_POS] == ord(".")) & \
+        (is_digit[:, fraction_pos] | ~in_fraction).all(axis=1)
+    
+    valid &= ~has_fraction | fraction_valid
+    
+    year = get_iso_number(digits, 0, 4)
+    month = get_iso_number(digits, 5, 7)
+    day = get_iso_number(digits, 8, 10)
+    hour = np.where(has_time, get_iso_number(digits, 11, 13), 0)
+    minute = np.where(has_time, get_iso_number(digits, 14, 16), 0)
+    second = np.where(has_time, get_iso_number(digits, 17, 19), 0)
+    
+    fraction_weights = 10.0 ** -np.arange(1, len(fraction_pos) + 1)
+    fraction = (np.where(in_fraction & has_fraction[:, np.newaxis], 
+                         digits[:, fraction_pos], 0) * 
+                fraction_weights).sum(axis=1)
+    
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & \
+        (hour < 24) & (minute < 60) & (second <= 60)
+    
+    mjd = days_from_civil(year, month, day) + MJD_OF_EPOCH + \
+        (hour * 3600 + minute * 60 + second + fraction) / SECONDS_PER_DAY
+    
+    return np.where(valid, mjd, np.nan)
+
+def get_nights_from_dates(dates):
+    """Returns the number of the night of a set of ISO-8601 dates, this is,
+    the Modified Julian Day minus 0.5, so all the observations of a night
+    have the same number.
+    
+    The dates are converted at once, only the dates with a format not 
+    supported by this conversion are converted one by one using astropy.
+    
+    Args:
+        dates: The list of dates.
+    
+    Returns:
+        The list of the numbers of the nights, 0 for the dates that cannot be
+        converted.
+    
+    """
+    
+    nights = []
+    
+    if len(dates) > 0:
+        mjds = iso_dates_to_mjd(dates)
+        
+        for date, mjd in zip(dates, mjds):
+            if np.isnan(mjd):
+                try:
+                    mjd = Time(date.strip(), format='isot', scale='utc').mjd
+                    
+                except ValueError as ve:
+                    logging.warning("Date cannot be converted to MJD: %s" % 
+                                    (date))
+                    mjd = 0.5
+                
+            nights.append(int(mjd - 0.5))
+        
+    return nights
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of ycas: https://github.com/felgari/ycas
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""This module propagates the astrometry of an image to another image of the
+same field.
+
+The consecutive images of a star taken in a night only differ in small
+pointing offsets. The sources of the new image are detected and the offset
+between the images is estimated from the positions of the stars identified
+by the astrometry of the image already solved. If enough of these stars are
+found in the new image at their positions plus the offset, the astrometry
+files of the solved image are written for the new image with the positions
+shifted.
+
+Only translations are considered, images with rotations or different scales
+are not verified and must be solved.
+
+"""
+
+import os
+import shutil
+import logging
+import numpy as np
+import pyfits
+from scipy import ndimage
+from constants import *
+
+# Number of standard deviations over the background to detect a source.
+DETECTION_NUM_SIGMAS = 5.0
+
+# Size in pixels of the box to detect the local maxima.
+DETECTION_BOX_SIZE = 5
+
+# Maximum number of sources detected, the brightest ones.
+MAX_NUM_SOURCES = 200
+
+# Half size in pixels of the box to calculate the centroid of a source.
+CENTROID_HALF_SIZE = 2
+
+# Maximum offset in pixels between the images.
+MAX_OFFSET = 200.0
+
+# Distance in pixels to match a star with a source.
+MATCH_TOLERANCE = 2.0
+
+# Minimum number and fraction of stars of the astrometry matched to accept
+# the offset.
+MIN_MATCHES = 4
+MIN_MATCHED_FRACTION = 0.5
+
+CRPIX1 = "CRPIX1"
+CRPIX2 = "CRPIX2"
+
+# Index of the table in the astrometry files.
+XYLS_TABLE_INDEX = 1
+
+def get_astrometry_file_names(image_file_name):
+    """Returns the names of the files generated by the astrometry of an
+    image.
+
+    Args:
+        image_file_name: Name of the file of the image.
+
+    Returns:
+        The names of the xyls, rdls and wcs files.
+
+    """
+
+    xyls_file_name = image_file_name.replace("." + FIT_FILE_EXT,
+                                             INDEX_FILE_PATTERN)
+
+    rdls_file_name = image_file_name.replace("." + FIT_FILE_EXT,
+                                             "." + RDLS_FILE_EXT)
+
+    wcs_file_name = image_file_name.replace("." + FIT_FILE_EXT,
+                                            "." + WCS_FILE_EXT)
+
+    return xyls_file_name, rdls_file_name, wcs_file_name
+
+def detect_sources(data):
+    """Detects the sources of an image as the local maxima over a threshold
+    from the background.
+
+    Args:
+        data: The data of the image.
+
+    Returns:
+        The x and y coordinates of the sources, using the FIT convention where
+        the first pixel is 1.
+
+    """
+
+    background = np.median(data)
+
+    # Robust estimation of the noise using the median absolute deviation.
+    noise = 1.4826 * np.median(np.abs(data - background))
+
+    threshold = background + DETECTION_NUM_SIGMAS * max(noise, 1e-6)
+
+    local_max = ndimage.maximum_filter(data, size=DETECTION_BOX_SIZE)
+
+    rows, cols = np.nonzero((data == local_max) & (data > threshold))
+
+    # Discard the sources too close to the borders to get the centroid.
+    h = CENTROID_HALF_SIZE
+    inside = (rows >= h) & (rows < data.shape[0] - h) & \
+        (cols >= h) & (cols < data.shape[1] - h)
+
+    rows = rows[inside]
+    cols = cols[inside]
+
+    # Keep only the brightest sources.
+    brightest = np.argsort(data[rows, cols])[::-1][:MAX_NUM_SOURCES]
+
+    rows = rows[brightest]
+    cols = cols[brightest]
+
+    # Centroid of each source in a box around the maximum.
+    offsets = np.arange(-h, h + 1)
+    box_rows = rows[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+    box_cols = cols[:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+
+    weights = np.maximum(data[box_rows, box_cols] - background, 0)
+
+    # Marginals of the rows and the columns of each box.
+    row_weights = weights.sum(axis=2)
+    col_weights = weights.sum(axis=1)
+
+    total = row_weights.sum(axis=1)
+    total[total == 0] = 1.0
+
+    y = rows + (row_weights * offsets[np.newaxis, :]).sum(axis=1) / total
+    x = cols + (col_weights * offsets[np.newaxis, :]).sum(axis=1) / total
+
+    return x + 1.0, y + 1.0
+
+def estimate_offset(ref_x, ref_y, x, y):
+    """Estimates the offset between the positions of the reference stars and
+    those of the sources detected.
+
+    All the differences of positions between stars and sources are
+    calculated, the offset is that shared by more pairs.
+
+    Args:
+        ref_x: X coordinates of the reference stars.
+        ref_y: Y coordinates of the reference stars.
+        x: X coordinates of the sources.
+        y: Y coordinates of the sources.
+
+    Returns:
+        The offset in x and y, or None if it cannot be estimated.
+
+    """
+
+    offset = None
+
+    dx = (x[np.newaxis, :] - ref_x[:, np.newaxis]).ravel()
+    dy = (y[np.newaxis, :] - ref_y[:, np.newaxis]).ravel()
+
+    near = (np.abs(dx) <= MAX_OFFSET) & (np.abs(dy) <= MAX_OFFSET)
+
+    dx = dx[near]
+    dy = dy[near]
+
+    if len(dx) > 0:
+        num_bins = int(2 * MAX_OFFSET / MATCH_TOLERANCE)
+
+        counts, x_edges, y_edges = np.histogram2d(dx, dy, bins=num_bins,
+                                                  range=[[-MAX_OFFSET, MAX_OFFSET],
+                                                         [-MAX_OFFSET, MAX_OFFSET]])
+
+        i, j = np.unravel_index(np.argmax(counts), counts.shape)
+
+        # Refine the offset with the differences around the bin chosen.
+        center_x = (x_edges[i] + x_edges[i + 1]) / 2.0
+        center_y = (y_edges[j] + y_edges[j + 1]) / 2.0
+
+        in_bin = (np.abs(dx - center_x) <= MATCH_TOLERANCE) & \
+            (np.abs(dy - center_y) <= MATCH_TOLERANCE)
+
+        offset = (np.mean(dx[in_bin]), np.mean(dy[in_bin]))
+
+    return offset
+
+def count_matches(ref_x, ref_y, x, y):
+    """Returns the number of reference stars that have a source at a distance
+    below the tolerance.
+
+    Args:
+        ref_x: X coordinates of the reference stars.
+        ref_y: Y coordinates of the reference stars.
+        x: X coordinates of the sources.
+        y: Y coordinates of the sources.
+
+    Returns:
+        The number of reference stars matched.
+
+    """
+
+    distances = np.hypot(x[np.newaxis, :] - ref_x[:, np.newaxis],
+                         y[np.newaxis, :] - ref_y[:, np.newaxis])
+
+    return int(np.sum(distances.min(axis=1) <= MATCH_TOLERANCE))
+
+def write_shifted_astrometry(ref_image_file_name, image_file_name, offset):
+    """Writes the astrometry files of an image from those of the reference
+    image shifting the x,y positions by the offset.
+
+    Args:
+        ref_image_file_name: Name of the file of the reference image.
+        image_file_name: Name of the file of the image.
+        offset: The offset in x and y between the images.
+
+    Raises:
+        IOError if the files cannot be read or written.
+
+    """
+
+    ref_xyls, ref_rdls, ref_wcs = get_astrometry_file_names(ref_image_file_name)
+    xyls, rdls, wcs = get_astrometry_file_names(image_file_name)
+
+    hdulist = pyfits.open(ref_xyls, memmap=False)
+
+    try:
+        table = hdulist[XYLS_TABLE_INDEX].data
+
+        table.field(XY_DATA_X_COL)[:] += offset[0]
+        table.field(XY_DATA_Y_COL)[:] += offset[1]
+
+        hdulist.writeto(xyls, clobber=True)
+    finally:
+        hdulist.close()
+
+    # The celestial coordinates of the stars do not change.
+    shutil.copy(ref_rdls, rdls)
+
+    if os.path.exists(ref_wcs):
+        header = pyfits.getheader(ref_wcs)
+
+        header[CRPIX1] += offset[0]
+        header[CRPIX2] += offset[1]
+
+        pyfits.PrimaryHDU(header=header).writeto(wcs, clobber=True)
+
+def propagate_astrometry(ref_image_file_name, image_file_name):
+    """Propagates the astrometry of the reference image to the image
+    received, if the stars of the astrometry of the reference are found in
+    the image.
+
+    Args:
+        ref_image_file_name: Name of the file of the reference image.
+        image_file_name: Name of the file of the image.
+
+    Returns:
+        True if the astrometry has been propagated, False otherwise.
+
+    """
+
+    success = False
+
+    ref_xyls, _, _ = get_astrometry_file_names(ref_image_file_name)
+
+    try:
+        table = pyfits.getdata(ref_xyls, XYLS_TABLE_INDEX)
+
+        ref_x = np.asarray(table.field(XY_DATA_X_COL), dtype=np.float64)
+        ref_y = np.asarray(table.field(XY_DATA_Y_COL), dtype=np.float64)
+
+        x, y = detect_sources(pyfits.getdata(image_file_name).astype(np.float32))
+
+        if len(ref_x) > 0 and len(x) > 0:
+            offset = estimate_offset(ref_x, ref_y, x, y)
+
+            if offset is not None:
+                matches = count_matches(ref_x + offset[0], ref_y + offset[1],
+                                        x, y)
+
+                logging.debug("Offset of %s from %s: %.3f, %.3f with %d of %d stars matched." %
+                              (image_file_name, ref_image_file_name,
+                               offset[0], offset[1], matches, len(ref_x)))
+
+                if matches >= MIN_MATCHES and \
+                    matches >= MIN_MATCHED_FRACTION * len(ref_x):
+
+                    write_shifted_astrometry(ref_image_file_name,
+                                             image_file_name, offset)
+
+                    success = True
+
+    except IOError as ioe:
+        logging.error("Error propagating astrometry from %s to %s" %
+                      (ref_image_file_name, image_file_name))
+        logging.error("Error is: %s" % (ioe))
+
+    except (KeyError, ValueError) as e:
+        logging.error("Invalid astrometry of %s: %s" %
+                      (ref_image_file_name, e))
+
+    return success
@@ -27,6 +27,8 @@ import os
 import argparse
 from constants import *
 from textfiles import read_cfg_file
+from combine import COMBINE_METHODS, DEFAULT_COMBINE_METHOD
+from headerindex import DEFAULT_HEADER_INDEX_FILE_NAME
 
 class ProgramArgumentsException(Exception):
     
@@ -51,6 +53,11 @@ class ProgramArguments(object):
     # Default number of objects to look at when doing astrometry.
     DEFAULT_ASTROM_NUM_OBJS = 20
     
+    # Default number of processes to use in the steps performed in parallel.
+    DEFAULT_NUM_PROCESSES = 1
+    
+    DEFAULT_ASTROMETRY_TIMEOUT = 600
+    
     # Default named of the directories containing different types of files.
     DEFAULT_BIAS_DIRECTORY = 'bias'
     DEFAULT_DARK_DIRECTORY = 'dark' 
@@ -94,6 +101,24 @@ class ProgramArguments(object):
 
     SUMMARY_PAR_NAME = "SUMMARY"
     
+    NUM_PROCESSES_PAR_NAME = "NUM_PROCESSES"
+    
+    COMBINE_METHOD_PAR_NAME = "COMBINE_METHOD"
+    
+    HEADER_INDEX_PAR_NAME = "HEADER_INDEX"
+    
+    ORG_MODE_PAR_NAME = "ORG_MODE"
+    
+    ASTROMETRY_TIMEOUT_PAR_NAME = "ASTROMETRY_TIMEOUT"
+    
+    WCS_PROPAGATION_PAR_NAME = "WCS_PROPAGATION"
+    
+    FWHM_METHOD_PAR_NAME = "FWHM_METHOD"
+    
+    PHOT_BACKEND_PAR_NAME = "PHOT_BACKEND"
+    
+    INCREMENTAL_MAGNITUDES_PAR_NAME = "INCREMENTAL_MAGNITUDES"
+    
     # Error messages related to parameters coherence.
     NO_PIPELINE_STEPS_REQUESTED = "At least one pipeline step should be " + \
         "indicated."           
@@ -122,6 +147,23 @@ class ProgramArguments(object):
     TARGET_DIR_REQUIRED = "The target directory of the files must be supplied."
     
     ERROR_CREATING_TARGET_DIR = "The target directory cannot be created."  
+    
+    NUM_PROCESSES_INVALID = "The number of processes must be at least 1."
+    
+    COMBINE_METHOD_INVALID = "The method to combine images must be one " + \
+        "of: %s." % (", ".join(COMBINE_METHODS))
+        
+    ASTROMETRY_TIMEOUT_INVALID = "The time limit of astrometry must not " + \
+        "be negative."
+    
+    ORG_MODE_INVALID = "The mode to organize the files must be one " + \
+        "of: %s." % (", ".join(ORG_MODES))
+        
+    FWHM_METHOD_INVALID = "The method to calculate the FWHM must be one " + \
+        "of: %s." % (", ".join(FWHM_METHODS))
+        
+    PHOT_BACKEND_INVALID = "The backend of the photometry must be one " + \
+        "of: %s." % (", ".join(PHOT_BACKENDS))
 
     def __init__(self):
         """ Initializes parser. 
@@ -150,6 +192,15 @@ class ProgramArguments(object):
         self._log_file = ProgramArguments.DEFAULT_LOG_FILE
         self._log_level = ProgramArguments.DEFAULT_LOG_LEVEL
         self._generate_summary = False        
+        self._num_processes = ProgramArguments.DEFAULT_NUM_PROCESSES
+        self._combine_method = DEFAULT_COMBINE_METHOD
+        self._header_index_file = None
+        self._org_mode = ORG_MODE_COPY
+        self._astrometry_timeout = ProgramArguments.DEFAULT_ASTROMETRY_TIMEOUT
+        self._wcs_propagation = False
+        self._fwhm_method = FWHM_METHOD_SEXTRACTOR
+        self._phot_backend = PHOT_BACKEND_IRAF
+        self._incremental_magnitudes = False
         
         self._min_number_of_args = 1             
                 
@@ -187,7 +238,50 @@ class ProgramArguments(object):
     def number_of_objects_for_astrometry(self):        
         return self._astrometry_num_of_objects
     
+    @property
+    def number_of_processes(self):
+        return self._num_processes
+    
+    @property
+    def combine_method(self):
+        return self._combine_method
+    
+    @property
+    def wcs_propagation(self):
+        return self._wcs_propagation
+    
+    @property
+    def astrometry_timeout(self):
+        return self._astrometry_timeout
+    
+    @property
+    def organization_mode(self):
+        return self._org_mode
+    
+    @property
+    def fwhm_method(self):
+        return self._fwhm_method
+    
+    @property
+    def phot_backend(self):
+        return self._phot_backend
+    
+    @property
+    def incremental_magnitudes(self):
+        return self._incremental_magnitudes
+    
     @property    
+    def header_index_file_name(self):
+        # By default the index of headers is stored in the target directory.
+        if self._header_index_file is not None:
+            file_name = self._header_index_file
+        else:
+            file_name = os.path.join(self._target_dir,
+                                     DEFAULT_HEADER_INDEX_FILE_NAME)
+            
+        return file_name
+    
+    @property
     def log_file_provided(self): 
         return self._log_file is not None 
     
@@ -368,6 +462,43 @@ class ProgramArguments(object):
                                   "doing astrometry.")
         self._parser.add_argument("-us", dest="us", action="store_true", 
                                   help="Use sextractor for astrometry.")    
+        self._parser.add_argument("-wp", dest="wp", action="store_true", 
+                                  help="Propagate the astrometry of an image " + 
+                                  "to the next images of the same star " + 
+                                  "and filter.")
+        self._parser.add_argument("-at", dest="at", metavar="astrometry_timeout", 
+                                  type=int, help="Seconds to wait for the " + 
+                                  "astrometry of an image, 0 for no limit.")
+        self._parser.add_argument("-j", dest="j", metavar="number_of_processes", 
+                                  type=int, help="Number of processes to " + 
+                                  "use in the steps performed in parallel.")
+        self._parser.add_argument("-cm", dest="cm", metavar="combine_method", 
+                                  choices=COMBINE_METHODS,
+                                  help="Method to combine bias, dark and " + 
+                                  "flat images: %s." % 
+                                  (", ".join(COMBINE_METHODS)))
+        self._parser.add_argument("-hi", dest="hi", metavar="header_index_file", 
+                                  help="File of the index of FIT headers, " + 
+                                  "by default in the target directory.")
+        self._parser.add_argument("-om", "--org-mode", dest="om", 
+                                  metavar="org_mode", choices=ORG_MODES,
+                                  help="How the files are placed when " + 
+                                  "organized: %s. " % (", ".join(ORG_MODES)) +
+                                  "With move the images discarded are " +
+                                  "returned to the source.")
+        self._parser.add_argument("-fwhm", dest="fwhm", metavar="fwhm_method", 
+                                  choices=FWHM_METHODS,
+                                  help="Method to calculate the FWHM of the " + 
+                                  "images for the photometry: %s." % 
+                                  (", ".join(FWHM_METHODS)))
+        self._parser.add_argument("-pb", dest="pb", metavar="phot_backend", 
+                                  choices=PHOT_BACKENDS,
+                                  help="Backend to calculate the " + 
+                                  "photometry: %s." % 
+                                  (", ".join(PHOT_BACKENDS)))
+        self._parser.add_argument("-inc", dest="inc", action="store_true", 
+                                  help="Calculate only the magnitudes of " + 
+                                  "the nights not processed yet.")
     
     def load_configuration_parameters(self):
         """Load the values indicated in the configuration file."""
@@ -480,6 +611,67 @@ class ProgramArguments(object):
         except:
             print "Generation of summary not supplied in configuration file."     
 
+        try:
+            self._num_processes = int(params[ProgramArguments.NUM_PROCESSES_PAR_NAME])
+        except:
+            print "Number of processes not supplied in configuration file."     
+
+        try:
+            val = params[ProgramArguments.WCS_PROPAGATION_PAR_NAME]
+            
+            if val == ProgramArguments.YES_VALUE:                
+                self._wcs_propagation = True
+            elif val == ProgramArguments.NO_VALUE:                
+                self._wcs_propagation = False
+            else:
+                print "Value for parameter %s is not valid: %s" % \
+                    (ProgramArguments.WCS_PROPAGATION_PAR_NAME, val)
+        except:
+            print "Propagation of astrometry not indicated in configuration file."      
+
+        try:
+            self._astrometry_timeout = int(params[ProgramArguments.ASTROMETRY_TIMEOUT_PAR_NAME])
+        except:
+            print "Time limit of astrometry not supplied in configuration file."     
+
+        try:
+            self._combine_method = params[ProgramArguments.COMBINE_METHOD_PAR_NAME]
+        except:
+            print "Method to combine images not supplied in configuration file."     
+
+        try:
+            self._header_index_file = params[ProgramArguments.HEADER_INDEX_PAR_NAME]
+        except:
+            print "Header index file not supplied in configuration file."     
+
+        try:
+            self._org_mode = params[ProgramArguments.ORG_MODE_PAR_NAME]
+        except:
+            print "Mode to organize files not supplied in configuration file."     
+
+        try:
+            self._fwhm_method = params[ProgramArguments.FWHM_METHOD_PAR_NAME]
+        except:
+            print "Method to calculate the FWHM not supplied in configuration file."     
+
+        try:
+            self._phot_backend = params[ProgramArguments.PHOT_BACKEND_PAR_NAME]
+        except:
+            print "Backend of the photometry not supplied in configuration file."     
+
+        try:
+            val = params[ProgramArguments.INCREMENTAL_MAGNITUDES_PAR_NAME]
+            
+            if val == ProgramArguments.YES_VALUE:                
+                self._incremental_magnitudes = True
+            elif val == ProgramArguments.NO_VALUE:                
+                self._incremental_magnitudes = False
+            else:
+                print "Value for parameter %s is not valid: %s" % \
+                    (ProgramArguments.INCREMENTAL_MAGNITUDES_PAR_NAME, val)
+        except:
+            print "Incremental calculation of magnitudes not indicated in configuration file."      
+
     def parse_and_update(self):
         """Parse the program arguments and update attributes."""
 
@@ -548,6 +740,33 @@ class ProgramArguments(object):
                 
             if self._args.sum:
                 self._generate_summary = True          
+                
+            if self._args.j is not None:
+                self._num_processes = self._args.j
+                
+            if self._args.wp:
+                self._wcs_propagation = True
+                
+            if self._args.at is not None:
+                self._astrometry_timeout = self._args.at
+                
+            if self._args.cm is not None:
+                self._combine_method = self._args.cm
+                
+            if self._args.hi is not None:
+                self._header_index_file = self._args.hi
+                
+            if self._args.om is not None:
+                self._org_mode = self._args.om
+                
+            if self._args.fwhm is not None:
+                self._fwhm_method = self._args.fwhm
+                
+            if self._args.pb is not None:
+                self._phot_backend = self._args.pb
+                
+            if self._args.inc:
+                self._incremental_magnitudes = True
             
         except argparse.ArgumentError as ae:
             print ae.message
@@ -567,6 +786,24 @@ class ProgramArguments(object):
             not self.summary_requested:
             raise ProgramArgumentsException(ProgramArguments.NO_PIPELINE_STEPS_REQUESTED)        
         
+        if self.number_of_processes < 1:
+            raise ProgramArgumentsException(ProgramArguments.NUM_PROCESSES_INVALID)
+        
+        if self.astrometry_timeout < 0:
+            raise ProgramArgumentsException(ProgramArguments.ASTROMETRY_TIMEOUT_INVALID)
+        
+        if not self.combine_method in COMBINE_METHODS:
+            raise ProgramArgumentsException(ProgramArguments.COMBINE_METHOD_INVALID)
+        
+        if not self.organization_mode in ORG_MODES:
+            raise ProgramArgumentsException(ProgramArguments.ORG_MODE_INVALID)
+        
+        if not self.fwhm_method in FWHM_METHODS:
+            raise ProgramArgumentsException(ProgramArguments.FWHM_METHOD_INVALID)
+        
+        if not self.phot_backend in PHOT_BACKENDS:
+            raise ProgramArgumentsException(ProgramArguments.PHOT_BACKEND_INVALID)
+        
         # Check all the conditions required for the program arguments.        
         if self.use_sextractor_for_astrometry and \
             not self.sextractor_cfg_file_provided:
@@ -40,6 +40,7 @@ import magnitude
 import curves
 import summary
 import fitsheader
+import headerindex
 import textfiles
 from constants import *
 
@@ -68,19 +69,40 @@ def get_pipeline_parameters(progargs):
     return stars, filters, header_fields
 
 def pipeline(progargs):
+    """ Reads the parameters of the pipeline and performs the steps that have
+    been requested.
+    
+    Args:
+        progargs: Program arguments.    
+        
+    """
+    
+    stars, filters, header_fields = get_pipeline_parameters(progargs)
+    
+    # The headers of the FIT files read by any step are kept in an index.
+    headerindex.open_header_index(progargs.header_index_file_name)
+    
+    try:
+        run_pipeline_steps(progargs, stars, filters, header_fields)
+        
+    finally:
+        headerindex.close_header_index()
+    
+def run_pipeline_steps(progargs, stars, filters, header_fields):
     """ Performs sequentially the steps of the pipeline that have been 
     requested.
     
     Args:
         progargs: Program arguments.    
+        stars: The list of stars.
+        filters: Filters to use.
+        header_fields: Information about the headers.
         
     """
     
     # Magnitudes calculated.
     mag = None     
     
-    stars, filters, header_fields = get_pipeline_parameters(progargs)
-    
     # This step organizes the images in directories depending on the type of
     # image: bias, flat or data.
     if progargs.organization_requested or progargs.all_steps_requested:
@@ -121,7 +143,8 @@ def pipeline(progargs):
     if progargs.magnitudes_requested or progargs.all_steps_requested:
         logging.info("* Step 5 * Calculating magnitudes of stars.")
         mag = magnitude.process_magnitudes(stars, progargs.target_dir,
-                                           progargs.light_directory)
+                                           progargs.light_directory,
+                                           progargs.incremental_magnitudes)
         anything_done = True
     else:
         logging.info("* Step 5 * Skipping the calculation of magnitudes of stars. Not requested.")